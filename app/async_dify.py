@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from dify import RETRY_STATUS
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDifyClient:
+    # 非同期ランタイム用の Dify クライアント
+    # aiohttp のコネクションプールを共有し、同時実行数はセマフォで制限します
+
+    def __init__(
+        self,
+        url: str,
+        tokens: dict,
+        user: str,
+        pool_size: int = 100,
+        max_concurrency: int = 100,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 60.0,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        cache=None,
+        singleflight=None,
+    ):
+        self.url = url
+        self.cache = cache
+        self.singleflight = singleflight
+        self.tokens = tokens
+        self.user = user
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(
+            connect=connect_timeout, sock_read=read_timeout
+        )
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "in_flight": 0,
+            "waiting": 0,
+            "latency_seconds_total": 0.0,
+        }
+        self._per_app = {app: 0 for app in tokens}
+
+    @classmethod
+    def from_env(cls, config, **kwargs):
+        # 接続先とトークンは起動時に検証済みの Config から受け取ります
+        return cls(
+            url=config.dify_url,
+            tokens=dict(config.dify_tokens),
+            user=config.dify_user,
+            pool_size=int(os.environ.get("DIFY_POOL_SIZE", "100")),
+            max_concurrency=int(os.environ.get("DIFY_MAX_CONCURRENCY", "100")),
+            connect_timeout=float(os.environ.get("DIFY_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.environ.get("DIFY_READ_TIMEOUT", "60")),
+            max_retries=int(os.environ.get("DIFY_MAX_RETRIES", "2")),
+            backoff_factor=float(os.environ.get("DIFY_BACKOFF_FACTOR", "0.5")),
+            **kwargs,
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # イベントループ上で最初に使われたときに作成します
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+            )
+        return self._session
+
+    def _headers(self, app: str) -> dict:
+        token = self.tokens.get(app)
+        if not token:
+            raise ValueError(f"Dify token for {app} is not configured")
+        return {"Authorization": f"Bearer {token}"}
+
+    async def _post(self, app: str, payload: dict) -> aiohttp.ClientResponse:
+        # 429 / 5xx と接続エラーはバックオフしながら max_retries 回まで再試行します
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = await self.session.post(
+                    self.url, headers=self._headers(app), json=payload
+                )
+            except aiohttp.ClientConnectionError:
+                if last:
+                    raise
+                delay = self.backoff_factor * (2**attempt)
+            else:
+                if response.status not in RETRY_STATUS or last:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+                delay = (
+                    float(retry_after)
+                    if retry_after and retry_after.isdigit()
+                    else self.backoff_factor * (2**attempt)
+                )
+
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def _enter(self, app: str):
+        self._counters["waiting"] += 1
+        await self.semaphore.acquire()
+        self._counters["waiting"] -= 1
+        self._counters["requests"] += 1
+        self._counters["in_flight"] += 1
+        self._per_app[app] = self._per_app.get(app, 0) + 1
+        return time.perf_counter()
+
+    def _exit(self, start: float, failed: bool):
+        self.semaphore.release()
+        self._counters["in_flight"] -= 1
+        self._counters["latency_seconds_total"] += time.perf_counter() - start
+        if failed:
+            self._counters["errors"] += 1
+
+    async def run(self, app: str, inputs: dict, response_mode: str = "blocking") -> dict:
+        payload = {"inputs": inputs, "user": self.user}
+        if response_mode:
+            payload["response_mode"] = response_mode
+
+        # キャッシュ対象のアプリは同じ入力ならキャッシュから返します
+        # （SQLite のキャッシュもあるので、読み書きは別スレッドで行います）
+        key = None
+        if self.cache is not None and self.cache.enabled_for(app):
+            key = self.cache.key(app, self.tokens.get(app), inputs)
+            cached = await asyncio.to_thread(self.cache.get, app, key)
+            if cached is not None:
+                return cached
+
+        # 同じ入力の呼び出しが実行中なら、その結果を待って共有します
+        if self.singleflight is not None and self.singleflight.enabled_for(app):
+            flight_key = self.singleflight.key(app, self.tokens.get(app), inputs)
+            return await self.singleflight.do(
+                flight_key, lambda: self._call(app, payload, key)
+            )
+        return await self._call(app, payload, key)
+
+    async def _call(self, app: str, payload: dict, key: str = None) -> dict:
+        start = await self._enter(app)
+        failed = True
+        try:
+            with tracer.span("dify", app=app):
+                response = await self._post(app, payload)
+                tracer.observe("dify_ttfb", time.perf_counter() - start, app=app)
+                async with response:
+                    result = await response.json()
+            failed = False
+            if key is not None:
+                await asyncio.to_thread(self.cache.set, key, result)
+            return result
+        except Exception:
+            logger.exception(f"Dify {app} request failed")
+            raise
+        finally:
+            self._exit(start, failed)
+
+    async def stream(self, app: str, inputs: dict):
+        # streaming モードで実行し、SSE のイベントを dict で順に返します
+        payload = {"inputs": inputs, "user": self.user, "response_mode": "streaming"}
+
+        start = await self._enter(app)
+        failed = True
+        first = True
+        try:
+            response = await self._post(app, payload)
+            tracer.observe("dify_ttfb", time.perf_counter() - start, app=app)
+            async with response:
+                async for raw in response.content:
+                    line = raw.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:") :].strip())
+                    if event.get("event") == "error":
+                        raise RuntimeError(event.get("message", "Dify stream error"))
+                    if first:
+                        first = False
+                        tracer.observe(
+                            "dify_first_event", time.perf_counter() - start, app=app
+                        )
+                    yield event
+            failed = False
+            tracer.observe("dify", time.perf_counter() - start, app=app)
+        except Exception:
+            logger.exception(f"Dify {app} stream failed")
+            raise
+        finally:
+            self._exit(start, failed)
+
+    def stats(self) -> dict:
+        connector = self._session.connector if self._session else None
+        return {
+            **self._counters,
+            "per_app": dict(self._per_app),
+            "semaphore_available": self.semaphore._value,
+            "pool_limit": self.pool_size,
+            "pool_open": len(connector._acquired) if connector else 0,
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
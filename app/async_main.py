@@ -0,0 +1,758 @@
+# 起動時間の計測の起点にするため、最初に import します
+from startup import startup
+
+import asyncio
+import datetime
+import logging
+import os
+import zoneinfo
+
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncAck, AsyncApp, AsyncBoltContext, AsyncRespond
+from slack_bolt.response import BoltResponse
+from slack_sdk.web.async_client import AsyncWebClient
+
+from async_dify import AsyncDifyClient
+from async_tracing import RateLimitedAsyncWebClient
+from cache import ResponseCache
+from config import Config
+from debounce import AsyncDebouncer, combine_text
+from dates import DateNormalizer
+from dedup import Deduplicator
+from directory import Directory
+from filters import MessageFilter
+from history import HistoryCache
+from images import ImagePool, parse_image
+from leader import LeaderLock
+from logconfig import configure_logging, log_body, log_payload
+from prefetch import PrefetchStore, prefetch_enabled
+from reminders import (
+    ReminderScheduler,
+    build_reminders,
+    format_reminders,
+    parse_command,
+)
+from retrieval import HistoryReader
+from serializer import TASKS_HISTORY_BUDGET_CHARS, serialize_history
+from singleflight import AsyncSingleFlight
+from streaming import astream_to_ephemeral, astream_to_message, streaming_enabled
+from tasks import TaskStore, serialize_tasks
+from tracing import request_kind, tracer
+from views import (
+    APP1_SHORTCUT_ID,
+    APP1_CALLBACK_ID,
+    APP1_MODAL1_BLOCK1_ID,
+    APP1_MODAL1_BLOCK1_ACTIONID,
+    APP1_MODAL1_BLOCK2_ACTIONID,
+    APP1_MODAL1_BLOCK3_ID,
+    APP1_MODAL1_BLOCK3_ACTIONID,
+    APP1_MODAL1_BLOCK4_ID,
+    APP1_MODAL1_BLOCK4_ACTIONID,
+    APP1_MODAL1_BLOCK5_ID,
+    APP1_MODAL1_BLOCK5_ACTIONID,
+    APP2_SHORTCUT_ID,
+    APP2_CALLBACK_ID,
+    APP2_MODAL1_BLOCK1_ACTIONID,
+    app1_create_view,
+    app1_message_blocks,
+    app2_create_view,
+)
+from workers import WorkerPool
+
+# main.py の非同期版です。スレッドではなくコルーチンでリクエストを処理します
+# 起動方法: python3 async_main.py
+
+startup.mark("imports")
+
+# ログはキュー経由で別スレッドから書き出します（レベルや形式は LOG_* で指定します）
+configure_logging()
+
+# Slack / Dify のトークンと接続先は起動時に 1 回だけ読み込んで検証します（不備があれば ConfigError）
+config = Config.from_env()
+startup.mark("config")
+
+# ボットトークンを渡してアプリを初期化します
+slack_client = RateLimitedAsyncWebClient(
+    token=config.slack_bot_token,
+    base_url=config.slack_api_url or AsyncWebClient.BASE_URL,
+)
+app = AsyncApp(client=slack_client)
+
+# 処理済みのイベント・操作の記録（Slack からの再送を捨てます）
+dedup = Deduplicator.from_env()
+
+
+@app.middleware
+async def drop_redeliveries(body, next, logger):
+    # 再送されたリクエストは ack だけ返し、Dify や Slack を呼ぶ前に捨てます
+    # SQLite の記録も見るときは、イベントループを止めないよう別スレッドで確かめます
+    if dedup is not None:
+        if dedup.backend is None:
+            duplicate = dedup.is_duplicate(body)
+        else:
+            duplicate = await asyncio.to_thread(dedup.is_duplicate, body)
+        if duplicate:
+            logger.info(f"dropped redelivered request: {body.get('type')}")
+            return BoltResponse(status=200, body="")
+    await next()
+
+
+@app.middleware
+async def trace_requests(body, context, next):
+    # ack() が呼ばれるまでの時間を記録します
+    if tracer.enabled:
+        context["ack"] = tracer.timed_async_ack(request_kind(body))
+    # Bolt はリクエストごとに WebClient を作り直すので、レート制限とスパンの記録を共有する
+    # クライアントに差し替えます（トレースが無効でも、レート制限のために常に差し替えます）
+    context["client"] = slack_client
+    await next()
+
+
+# Dify クライアント（同時実行数は DIFY_MAX_CONCURRENCY で制限します）
+dify = AsyncDifyClient.from_env(
+    config,
+    cache=ResponseCache.from_env(),
+    singleflight=AsyncSingleFlight.from_env(),
+)
+
+# チャンネルごとの会話履歴キャッシュ（message イベントで差分更新します）
+history_cache = HistoryCache.from_env()
+
+# 長い履歴をページ単位で読み込みます（タスク抽出でスレッドの返信を含めて読むときに使います）
+history_reader = HistoryReader.from_env()
+
+# ユーザー・チャンネルの ID と名前の対応表（起動時に一括読み込みし、イベントで更新します）
+directory = Directory()
+
+# タスクの期限の解釈（dateparser は Slack への接続後にバックグラウンドで準備します）
+date_normalizer = DateNormalizer.from_env()
+
+# 応答しない message イベント（ボットの投稿・編集など）を弾くルール
+message_filter = MessageFilter.from_env(channel_name=directory.channel_name)
+
+# タスク抽出の対象チャンネル / やわらかコミュニケーターの既定の送信先（名前でも ID でも可）
+TASKS_CHANNEL = config.tasks_channel
+APP1_DEFAULT_RECIPIENT = config.app1_default_recipient
+TASKS_CHANNEL_NOT_FOUND_TEXT = (
+    f"タスクを取得できませんでした。チャンネル「{TASKS_CHANNEL}」が見つかりません。"
+    "ボットがチャンネルに参加しているか確認してください🙏"
+)
+
+# 抽出したタスク一覧と、最後に抽出したメッセージの位置（モーダルはここから表示し、差分だけ Dify に渡します）
+task_store = TaskStore.from_env()
+
+
+# タスク管理モーダルを開いた時点での先読み結果（APP2_PREFETCH=true のとき）
+prefetch = PrefetchStore.from_env()
+PREFETCH_WAIT = config.prefetch_wait
+
+# 生成済み画像のストック（モーダルを開いた時点で補充を始めます）
+image_pool = ImagePool.from_env()
+
+# 複数ワーカーで動かすとき、定期実行の処理を担当するワーカーを 1 つに決めます
+leader = LeaderLock.from_env()
+
+# リマインダーの送信はスケジューラーのスレッドから、このイベントループに依頼します
+event_loop = None
+
+
+def send_reminder(reminder):
+    future = asyncio.run_coroutine_threadsafe(
+        slack_client.chat_postMessage(channel=reminder.user, text=reminder.text),
+        event_loop,
+    )
+    future.result(timeout=60)
+
+
+# リマインダー（SQLite に保存し、リーダーのワーカーがまとめて送信します）
+reminders = ReminderScheduler.from_env(send=send_reminder)
+
+# 実行中のバックグラウンドタスク（GC で消えないよう参照を持っておきます）
+background_tasks = set()
+
+# 同じチャンネル・スレッドに続けて届いたメッセージをまとめて 1 回で返信します（MESSAGE_DEBOUNCE_WINDOW）
+debouncer = AsyncDebouncer.from_env(on_flush=lambda batch: flush_messages(batch))
+
+# 各部品の統計を /metrics で公開します（METRICS_PORT を設定したとき）
+tracer.register("dify", dify.stats)
+tracer.register("slack_api", slack_client.dispatcher.stats, label="method")
+tracer.register("history_cache", history_cache.stats)
+tracer.register("history_reader", history_reader.stats)
+tracer.register("message_filter", message_filter.stats)
+tracer.register("prefetch", prefetch.stats)
+tracer.register("image_pool", image_pool.stats)
+tracer.register("dates", date_normalizer.stats)
+tracer.register("tasks", task_store.stats)
+tracer.register("reminders", reminders.stats)
+tracer.register("background_tasks", lambda: {"running": len(background_tasks)})
+if dify.cache is not None:
+    tracer.register("dify_cache", dify.cache.stats)
+if dify.singleflight is not None:
+    tracer.register("dify_singleflight", dify.singleflight.stats)
+if dedup is not None:
+    tracer.register("dedup", dedup.stats)
+if debouncer is not None:
+    tracer.register("message_debounce", debouncer.stats)
+tracer.register("startup", startup.stats)
+
+startup.mark("init")
+
+
+def spawn(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+
+def _on_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.getLogger(__name__).error(
+            "background task failed", exc_info=task.exception()
+        )
+
+
+def _now() -> str:
+    dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
+    return dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
+
+
+@app.command("/command")
+async def handle_command_test(ack: AsyncAck, body: dict, logger: logging.Logger):
+
+    await ack()
+    log_body(logger, body)
+
+
+@app.command("/yaruki")
+async def handle_command_yaruki(
+    ack: AsyncAck,
+    body: dict,
+    client: AsyncWebClient,
+    logger: logging.Logger,
+    respond: AsyncRespond,
+):
+
+    await ack()
+    log_body(logger, body)
+
+    # 非同期版はジョブキューを使わずハンドラーの中で処理するので、ack 後の処理をスパンで記録します
+    with tracer.span("handler", fn="handle_command_yaruki"):
+        text = body["text"]
+
+        channel_id = body["channel_id"]
+        messages = await history_cache.aget(client, channel_id, limit=20)
+
+        inputs = {
+            "chat_history": serialize_history(messages, names=directory.user_name),
+            "today": _now(),
+            "prompt": text,
+        }
+
+        # ストリーミングモードでは生成途中の文章を順次表示します
+        if streaming_enabled():
+            await astream_to_ephemeral(respond, dify.stream("APP4", inputs))
+            return
+
+        response_json = await dify.run("APP4", inputs)
+        output = response_json["data"]["outputs"]["text"]
+
+        await client.chat_postEphemeral(
+            channel=body["channel_id"],
+            user=body["user_id"],
+            text=output,
+        )
+
+
+@app.command("/yaruki_reminder")
+async def handle_command_yaruki_reminder(
+    ack: AsyncAck,
+    body: dict,
+    client: AsyncWebClient,
+    context: AsyncBoltContext,
+    logger: logging.Logger,
+    respond: AsyncRespond,
+):
+    await ack()
+    log_body(logger, body)
+
+    with tracer.span("handler", fn="handle_command_yaruki_reminder"):
+        text = await run_reminder_command(body, client, context.bot_user_id)
+        await respond(text=text, response_type="ephemeral")
+
+
+async def run_reminder_command(
+    body: dict, client: AsyncWebClient, bot_user_id: str
+) -> str:
+    # 日付の解釈（dateparser の準備が終わるまで待つことがあります）と SQLite への読み書きは、
+    # イベントループを止めないよう別スレッドで行います
+    command = await asyncio.to_thread(
+        parse_command, body["text"], parse_date=date_normalizer.parse
+    )
+    user_id = body["user_id"]
+
+    if command["action"] == "list":
+        return format_reminders(await asyncio.to_thread(reminders.list, user_id))
+    if command["action"] == "cancel":
+        cancelled = await asyncio.to_thread(reminders.cancel, command["ids"], user_id)
+        return f"{len(cancelled)} 件のリマインダーを取り消しました"
+
+    # チャンネルを指定したらメンバー全員に送ります。宛先がなければ自分に送ります
+    # メンバーのうちボットと削除済みのユーザー、このアプリ自身（auth.test の user_id）には送りません
+    users = list(command["users"])
+    for channel in command["channels"]:
+        members = await directory.achannel_members(client, channel)
+        users.extend(directory.people(members, exclude=[bot_user_id]))
+    if not command["users"] and not command["channels"]:
+        users.append(user_id)
+
+    batch = build_reminders(
+        users, command["text"], command["delay"], command["interval"], user_id
+    )
+    await asyncio.to_thread(reminders.schedule, batch)
+    return f"{len(batch)} 人にリマインダーを登録しました"
+
+
+@app.shortcut(APP2_SHORTCUT_ID)
+async def handle_shortcuts_app2(
+    ack: AsyncAck, body: dict, client: AsyncWebClient, logger: logging.Logger
+):
+
+    log_body(logger, body)
+    await ack()
+
+    with tracer.span("handler", fn="handle_shortcuts_app2"):
+        # views.open という API を呼び出すことでモーダルを開きます
+        response = await client.views_open(
+            trigger_id=body["trigger_id"],
+            view=app2_create_view(
+                APP2_CALLBACK_ID, task_list=await asyncio.to_thread(stored_task_list)
+            ),
+        )
+
+        # ボタンが押される前にタスク抽出を始めておきます
+        if prefetch_enabled():
+            view_id = response["view"]["id"]
+            future = prefetch.start(view_id)
+            prefetch.attach_task(view_id, spawn(run_prefetch(future, client, logger)))
+
+
+async def run_prefetch(future, client: AsyncWebClient, logger: logging.Logger):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(await fetch_task_list(client, logger))
+    except asyncio.CancelledError:
+        future.set_exception(RuntimeError("prefetch cancelled"))
+        raise
+    except Exception as e:
+        future.set_exception(e)
+
+
+def stored_task_list() -> list:
+    # 保存済みのタスク一覧（Dify を待たずにモーダルへ表示します）
+    channel_id = directory.resolve_channel(TASKS_CHANNEL)
+    return task_store.list(channel_id) if channel_id else []
+
+
+@app.view_closed(APP2_CALLBACK_ID)
+async def handle_view_closed_app2(ack: AsyncAck, body: dict):
+    await ack()
+    prefetch.cancel(body["view"]["id"])
+
+
+@app.action(APP2_MODAL1_BLOCK1_ACTIONID)
+async def handle_action_app2_modal1_block1(
+    ack: AsyncAck, body: dict, client: AsyncWebClient, logger: logging.Logger
+):
+    await ack()
+    log_body(logger, body)
+
+    with tracer.span("handler", fn="handle_action_app2_modal1_block1"):
+        # 先読み済みならその結果を使います
+        task_list = None
+        try:
+            task_list = await prefetch.aget(body["view"]["id"], timeout=PREFETCH_WAIT)
+        except Exception:
+            logger.exception("prefetched task list is not available")
+
+        if task_list is None:
+            task_list = await fetch_task_list(client, logger)
+        if task_list is None:
+            # 対象のチャンネルが見つからなければ、押した人に知らせます
+            await client.chat_postMessage(
+                channel=body["user"]["id"], text=TASKS_CHANNEL_NOT_FOUND_TEXT
+            )
+            return
+
+        await client.views_update(
+            view_id=body.get("view").get("id"),
+            hash=body.get("view").get("hash"),
+            view=app2_create_view(
+                callback_id=APP2_CALLBACK_ID,
+                task_list=task_list,
+            ),
+        )
+
+
+async def fetch_task_list(client: AsyncWebClient, logger: logging.Logger):
+
+    # 起動時のユーザー・チャンネル一覧の読み込みが終わっていなければ、ここで読み込んでから引きます
+    channel_id = await directory.afind_channel(client, TASKS_CHANNEL)
+    if channel_id is None:
+        logger.error(f"channel not found: {TASKS_CHANNEL}")
+        return None
+
+    # 前回の抽出以降のメッセージ（スレッドの返信を含む）と保存済みのタスク一覧だけを Dify に渡して、
+    # 差分で更新します。初回は予算に収まるまでさかのぼって読み、2 回目からは前回の続きから古い順に読みます
+    # （予算で止めた先は、次回の差分で読みます）
+    # 履歴キャッシュで新着がないと分かれば、Slack の履歴も Dify も呼びません
+    # 前回より前に始まったスレッドへの新しい返信は、履歴キャッシュが覚えているスレッドから読み直します
+    # SQLite の読み書きと日付の解釈は、イベントループを止めないよう別スレッドで行います
+    cursor = None
+    if task_store.incremental:
+        cursor = await asyncio.to_thread(task_store.cursor, channel_id)
+    messages = []
+    if cursor is None or await history_cache.ahas_newer(client, channel_id, cursor):
+        active_threads = (
+            history_cache.active_threads(channel_id, cursor) if cursor else ()
+        )
+        messages = await history_reader.acollect(
+            client,
+            channel_id,
+            budget_chars=TASKS_HISTORY_BUDGET_CHARS,
+            names=directory.user_name,
+            oldest=cursor,
+            threads=True,
+            active_threads=active_threads,
+        )
+        # 読んだ直近のメッセージで履歴キャッシュを温めて、次回の has_newer で Slack を呼ばずに済ませます
+        history_cache.prime(channel_id, messages)
+    last_ts, current, messages = await asyncio.to_thread(
+        task_store.pending, channel_id, messages
+    )
+    if not messages:
+        return await asyncio.to_thread(task_store.list, channel_id)
+
+    inputs = {
+        "chat_history": serialize_history(
+            messages,
+            names=directory.user_name,
+            budget_chars=TASKS_HISTORY_BUDGET_CHARS,
+        ),
+        "date": _now(),
+    }
+    if task_store.incremental:
+        inputs["task_list"] = serialize_tasks(current)
+
+    response_json = await dify.run("APP3", inputs)
+    task_list = response_json["data"]["outputs"]["task_list"]
+    if not isinstance(task_list, list):
+        log_payload(logger, "task list", task_list)
+        return task_list
+
+    task_list = await asyncio.to_thread(date_normalizer.normalize_tasks, task_list)
+    stored = await asyncio.to_thread(
+        task_store.replace, channel_id, task_list, messages[-1]["ts"], last_ts
+    )
+    if stored is None:
+        # 別のワーカーが先に更新していたか、空の一覧で消すのを断ったら、保存済みの一覧を使います
+        stored = await asyncio.to_thread(task_store.list, channel_id)
+
+    log_payload(logger, "task list", stored)
+
+    return stored
+
+
+@app.shortcut(APP1_SHORTCUT_ID)
+async def handle_shortcuts_app1(ack: AsyncAck, body: dict, client: AsyncWebClient):
+
+    await ack()
+
+    with tracer.span("handler", fn="handle_shortcuts_app1"):
+        # views.open という API を呼び出すことでモーダルを開きます
+        await client.views_open(
+            trigger_id=body["trigger_id"],
+            view=app1_create_view(APP1_CALLBACK_ID),
+        )
+
+
+def refill_image_pool():
+    # ストックは起動時に 1 度満たし、以降はストックから使った分だけ補充します
+    # （モーダルを開いただけでは生成しません）
+    for _ in range(image_pool.reserve()):
+        spawn(generate_pool_image())
+
+
+async def generate_pool_image():
+    try:
+        image = parse_image(await dify.run("APP2", {}, response_mode=None))
+    except Exception:
+        image_pool.cancel()
+        raise
+    image_pool.fill(image)
+
+
+@app.action(APP1_MODAL1_BLOCK2_ACTIONID)
+async def handle_action_app1_modal1_block2(
+    ack: AsyncAck, body: dict, client: AsyncWebClient, logger: logging.Logger
+):
+
+    log_body(logger, body)
+
+    await ack()
+
+    with tracer.span("handler", fn="handle_action_app1_modal1_block2"):
+        view = body["view"]
+        inputs = view["state"]["values"]
+        message = (
+            inputs.get(APP1_MODAL1_BLOCK1_ID, {})
+            .get(APP1_MODAL1_BLOCK1_ACTIONID, {})
+            .get("value")
+        )
+
+        response_json = await dify.run(
+            "APP1",
+            {
+                "input": message,
+                "role": "上司",
+            },
+        )
+        created_message = response_json["data"]["outputs"]["result"]
+        knowledge = response_json["data"]["outputs"]["knowledge"]
+
+        references = [
+            {
+                "document_name": x["metadata"]["document_name"],
+                "segment_id": x["metadata"]["segment_id"],
+                "content": x["content"],
+            }
+            for x in knowledge
+        ]
+
+        await client.views_update(
+            view_id=body.get("view").get("id"),
+            hash=body.get("view").get("hash"),
+            view=app1_create_view(
+                APP1_CALLBACK_ID,
+                message=message,
+                created_message=created_message,
+                references=references,
+                initial_user=directory.resolve_user(APP1_DEFAULT_RECIPIENT),
+            ),
+        )
+
+
+@app.view(APP1_CALLBACK_ID)
+async def handle_view_app1_callback(
+    ack: AsyncAck, body: dict, logger: logging.Logger, client: AsyncWebClient
+):
+
+    await ack()
+
+    log_body(logger, body)
+
+    with tracer.span("handler", fn="handle_view_app1_callback"):
+        user = body["user"]
+        view = body["view"]
+        inputs = view["state"]["values"]
+
+        created_message = (
+            inputs.get(APP1_MODAL1_BLOCK3_ID, {})
+            .get(APP1_MODAL1_BLOCK3_ACTIONID, {})
+            .get("value")
+        )
+
+        selected_user = (
+            inputs.get(APP1_MODAL1_BLOCK4_ID, {})
+            .get(APP1_MODAL1_BLOCK4_ACTIONID, {})
+            .get("selected_user")
+        )
+
+        selected_references_options = (
+            inputs.get(APP1_MODAL1_BLOCK5_ID, {})
+            .get(APP1_MODAL1_BLOCK5_ACTIONID, {})
+            .get("selected_options")
+        )
+
+        url = os.environ.get(f"WEBHOOK_URL_{selected_user}", None)
+
+        if url:
+
+            message_args = dict(
+                selected_user=selected_user,
+                sender_id=user["id"],
+                created_message=created_message,
+                selected_references_options=selected_references_options,
+            )
+
+            # ストックの画像があればそのまま使い、なければ先に本文だけ送って後から画像を追加します
+            image = image_pool.take()
+            if image:
+                refill_image_pool()
+                blocks = app1_message_blocks(
+                    image_url=image["url"], prompt=image["prompt"], **message_args
+                )
+            else:
+                blocks = app1_message_blocks(**message_args)
+
+            response = await client.chat_postMessage(channel=selected_user, blocks=blocks)
+
+            if not image:
+                spawn(attach_image(client, response["channel"], response["ts"], message_args))
+
+
+async def attach_image(
+    client: AsyncWebClient, channel: str, ts: str, message_args: dict
+):
+    # 画像を生成して、送信済みのメッセージに追加します
+    image = image_pool.take()
+    if image:
+        refill_image_pool()
+    else:
+        image = parse_image(await dify.run("APP2", {}, response_mode=None))
+    blocks = app1_message_blocks(
+        image_url=image["url"], prompt=image["prompt"], **message_args
+    )
+    await client.chat_update(channel=channel, ts=ts, blocks=blocks)
+
+
+async def filter_messages(event: dict, next):
+    # 履歴キャッシュには、応答しないメッセージ（ボットの投稿や編集など）も反映します
+    history_cache.feed(event)
+    if not message_filter.accept(event):
+        return BoltResponse(status=200, body="")
+    await next()
+
+
+@app.event("message", middleware=[filter_messages])
+async def handle_message_events(
+    ack: AsyncAck, body: dict, logger: logging.Logger, client: AsyncWebClient
+):
+    await ack()
+    log_body(logger, body)
+
+    with tracer.span("handler", fn="handle_message_events"):
+        event = body["event"]
+
+        # 続けて届いたメッセージはまとめてから返信します
+        if debouncer is not None:
+            debouncer.add(event)
+            return
+
+        await reply_messages([event], client)
+
+
+def flush_messages(batch):
+    return spawn(reply_batch(batch))
+
+
+async def reply_batch(batch):
+    # 返信に失敗しても、まとめたメッセージが次の返信に混ざらないよう手放します
+    try:
+        with tracer.span("handler", fn="reply_batch"):
+            await reply_messages(batch.events, slack_client, batch)
+    finally:
+        batch.release()
+
+
+async def reply_messages(events: list, client: AsyncWebClient, batch=None):
+    # batch の返信は、投稿前に新しいメッセージが来るとキャンセルされます
+    event = events[-1]
+    user = event["user"]
+    thread_ts = event.get("thread_ts", None)
+    text = combine_text(events)
+
+    channel_id = event["channel"]
+    messages = await history_cache.aget(client, channel_id, limit=10)
+
+    inputs = {
+        "chat_history": serialize_history(messages, names=directory.user_name),
+        "today": _now(),
+        "prompt": text,
+    }
+
+    # ストリーミングモードでは生成途中の文章を順次表示します
+    # 表示を始めた後に届いたメッセージは、次のバッチとして別に返信します
+    if streaming_enabled():
+        if batch is not None and not batch.claim():
+            return
+        await astream_to_message(
+            client, channel_id, dify.stream("APP4", inputs), thread_ts=thread_ts
+        )
+        return
+
+    response_json = await dify.run("APP4", inputs)
+    output = response_json["data"]["outputs"]["text"]
+
+    if batch is not None and not batch.claim():
+        return
+
+    await client.chat_postMessage(
+        channel=channel_id,
+        thread_ts=thread_ts,
+        user=user,
+        text=output,
+    )
+
+
+@app.event("user_change")
+@app.event("team_join")
+async def handle_user_events(ack: AsyncAck, event: dict):
+    await ack()
+    directory.on_user_event(event)
+
+
+@app.event("channel_rename")
+@app.event("channel_created")
+async def handle_channel_events(ack: AsyncAck, event: dict):
+    await ack()
+    directory.on_channel_event(event)
+
+
+@app.action(APP1_MODAL1_BLOCK4_ACTIONID)
+async def handle_action_app1_model1_block4(ack: AsyncAck, body: dict, logger):
+    await ack()
+    log_body(logger, body)
+
+
+@app.action(APP1_MODAL1_BLOCK5_ACTIONID)
+async def handle_action_app1_model1_block5(ack: AsyncAck, body: dict, logger):
+    await ack()
+    log_body(logger, body)
+
+
+async def main():
+    global event_loop
+
+    # アプリを起動して、ソケットモードで Slack に接続します
+    handler = AsyncSocketModeHandler(app, config.slack_app_token)
+    await handler.connect_async()
+    startup.mark("connect")
+    startup.report()
+
+    # 接続を待たせないよう、ユーザー・チャンネル一覧の読み込みなどは接続後にバックグラウンドで行います
+    spawn(directory.aload_with_retry(app.client))
+    asyncio.get_running_loop().run_in_executor(None, date_normalizer.preload)
+    event_loop = asyncio.get_running_loop()
+    refill_image_pool()
+    leader.on_elected(reminders.start)
+    leader.start()
+    tracer.serve_from_env()
+
+    # 接続を保ったまま待ちます（AsyncSocketModeHandler.start_async() と同じです）
+    try:
+        await asyncio.sleep(float("inf"))
+    finally:
+        await dify.close()
+
+
+def start():
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    # SOCKET_MODE_WORKERS=N なら、このプロセスに加えて N-1 個のワーカープロセスから接続します
+    WorkerPool.from_env(__file__).start()
+    start()
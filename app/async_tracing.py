@@ -0,0 +1,42 @@
+import time
+
+from slack_bolt.context.ack.async_ack import AsyncAck
+from slack_sdk.web.async_client import AsyncWebClient
+
+from ratelimit import AsyncDispatcher, channel_of
+from tracing import Tracer, tracer
+
+# tracing.py の非同期版の部品です（aiohttp を読み込むため、async_main.py からだけ使います）
+
+
+class TimedAsyncAck(AsyncAck):
+    def __init__(self, tracer: Tracer, kind: str, start: float):
+        super().__init__()
+        self._tracer = tracer
+        self._kind = kind
+        self._start = start
+
+    async def __call__(self, *args, **kwargs):
+        if self.response is None:
+            self._tracer.observe("ack", time.perf_counter() - self._start, type=self._kind)
+        return await super().__call__(*args, **kwargs)
+
+
+class RateLimitedAsyncWebClient(AsyncWebClient):
+    # すべての API 呼び出しを AsyncDispatcher 経由にして、スパンを記録する AsyncWebClient
+    # （ratelimit.py の RateLimitedWebClient の非同期版です。aiohttp を読み込むのでここに置きます）
+
+    def __init__(self, *args, dispatcher: AsyncDispatcher = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatcher = dispatcher or AsyncDispatcher.from_env()
+
+    async def api_call(self, api_method: str, **kwargs):
+        # スパンにはレート制限の待ち時間も含みます
+        with tracer.span("slack_api", method=api_method):
+            return await self.dispatcher.call(
+                api_method,
+                lambda: super(RateLimitedAsyncWebClient, self).api_call(
+                    api_method, **kwargs
+                ),
+                channel=channel_of(kwargs),
+            )
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from state import default_backend, state_path
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_inputs(inputs: dict, ignore: set = frozenset()) -> str:
+    # キーの順序や空白の違いでキーが変わらないように正規化します
+    return json.dumps(
+        {k: v for k, v in inputs.items() if k not in ignore},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def cache_key(app: str, token: str, inputs: dict, ignore: set = frozenset()) -> str:
+    # トークンそのものは保存しないよう、ハッシュ化したものをキーに含めます
+    token_id = hashlib.sha256((token or "").encode()).hexdigest()[:16]
+    source = f"{app}:{token_id}:{canonical_inputs(inputs, ignore)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+class MemoryCacheBackend:
+    # TTL 付きの LRU キャッシュ。合計サイズが max_bytes を超えたら古いものから捨てます
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()  # key : (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                self._delete(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._delete(key)
+            self._items[key] = (value, time.time() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._delete(next(iter(self._items)))
+
+    def _delete(self, key: str):
+        value, _ = self._items.pop(key)
+        self.size -= len(value)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteCacheBackend:
+    # コンテナを再起動してもキャッシュが残るように SQLite に保存します
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dify_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS dify_cache_accessed ON dify_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM dify_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM dify_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE dify_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def pop(self, key: str):
+        # 読み出しと同時に削除します。同じキーを別のワーカーが同時に取り出しても、
+        # DELETE で行を消せた 1 つだけが値を受け取ります
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM dify_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                cursor = self._conn.execute(
+                    "DELETE FROM dify_cache WHERE key = ?", (key,)
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            if not cursor.rowcount or row[1] < time.time():
+                return None
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dify_cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now),
+            )
+            self._conn.execute("DELETE FROM dify_cache WHERE expires_at < ?", (now,))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM dify_cache"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM dify_cache ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM dify_cache WHERE key = ?", (key,))
+            total -= size
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dify_cache").fetchone()[0]
+
+
+class ResponseCache:
+    # Dify のレスポンスキャッシュ。apps に含まれるアプリだけが対象です
+
+    def __init__(
+        self,
+        backend,
+        apps: set,
+        ttl: float = 600.0,
+        ignore_inputs: set = frozenset(),
+    ):
+        self.backend = backend
+        self.apps = set(apps)
+        self.ttl = ttl
+        self.ignore_inputs = set(ignore_inputs)
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    @classmethod
+    def from_env(cls):
+        # DIFY_CACHE_APPS が空ならキャッシュを使いません
+        apps = {a.strip() for a in os.environ.get("DIFY_CACHE_APPS", "").split(",")}
+        apps.discard("")
+        if not apps:
+            return None
+
+        max_bytes = int(os.environ.get("DIFY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+        if (os.environ.get("DIFY_CACHE_BACKEND") or default_backend()) == "sqlite":
+            backend = SQLiteCacheBackend(
+                os.environ.get("DIFY_CACHE_PATH") or state_path("dify_cache.sqlite3"),
+                max_bytes,
+            )
+        else:
+            backend = MemoryCacheBackend(max_bytes)
+
+        ignore = os.environ.get("DIFY_CACHE_IGNORE_INPUTS", "date,today")
+        return cls(
+            backend,
+            apps,
+            ttl=float(os.environ.get("DIFY_CACHE_TTL", "600")),
+            ignore_inputs={k.strip() for k in ignore.split(",") if k.strip()},
+        )
+
+    def enabled_for(self, app: str) -> bool:
+        return app in self.apps
+
+    def key(self, app: str, token: str, inputs: dict) -> str:
+        return cache_key(app, token, inputs, self.ignore_inputs)
+
+    def get(self, app: str, key: str):
+        value = self.backend.get(key)
+        with self._lock:
+            counter = self.misses if value is None else self.hits
+            counter[app] = counter.get(app, 0) + 1
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, response_json: dict):
+        self.backend.set(
+            key, json.dumps(response_json, ensure_ascii=False).encode(), self.ttl
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "entries": len(self.backend),
+            }
@@ -0,0 +1,92 @@
+import dataclasses
+import os
+from urllib.parse import urlparse
+
+from dify import DIFY_APPS
+
+# トークンの種類ごとの接頭辞（.env.sample の「xoxb-」などのままなら未設定とみなします）
+SLACK_BOT_TOKEN_PREFIX = "xoxb-"
+SLACK_APP_TOKEN_PREFIX = "xapp-"
+DIFY_TOKEN_PREFIX = "app-"
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class Config:
+    # Slack / Dify の接続先とトークン、ハンドラーが使う設定
+    # 起動時に 1 回だけ環境変数から読み込んで検証し、各部品にはこのオブジェクトを渡します
+    # 処理の調整用の値（プールの大きさなど）は、これまでどおり各部品の from_env() で読み込みます
+
+    slack_bot_token: str
+    slack_app_token: str
+    slack_api_url: str
+    dify_url: str
+    dify_tokens: dict
+    dify_user: str
+    tasks_channel: str = "user1-bot"
+    app1_default_recipient: str = None
+    prefetch_wait: float = 30.0
+
+    @classmethod
+    def from_env(cls):
+        # 問題はまとめて 1 つの ConfigError で報告します（トークンの値はメッセージに含めません）
+        errors = []
+        config = cls(
+            slack_bot_token=_token("SLACK_BOT_TOKEN", SLACK_BOT_TOKEN_PREFIX, errors),
+            slack_app_token=_token("SLACK_APP_TOKEN", SLACK_APP_TOKEN_PREFIX, errors),
+            slack_api_url=_url("SLACK_API_URL", errors, required=False),
+            dify_url=_url("DIFY_API_APP_URL", errors),
+            dify_tokens={
+                app: _token(env, DIFY_TOKEN_PREFIX, errors)
+                for app, env in DIFY_APPS.items()
+            },
+            dify_user=_required("DIFY_API_TOKEN_USER", errors),
+            tasks_channel=os.environ.get("TASKS_CHANNEL") or "user1-bot",
+            app1_default_recipient=os.environ.get("APP1_DEFAULT_RECIPIENT") or None,
+            prefetch_wait=_float("APP2_PREFETCH_WAIT", 30.0, errors),
+        )
+        if errors:
+            raise ConfigError("invalid configuration: " + "; ".join(errors))
+        return config
+
+
+def _required(name: str, errors: list) -> str:
+    value = os.environ.get(name, "").strip()
+    if not value:
+        errors.append(f"{name} is not set")
+    return value
+
+
+def _token(name: str, prefix: str, errors: list) -> str:
+    value = os.environ.get(name, "").strip()
+    if not value or value == prefix:
+        errors.append(f"{name} is not set")
+    elif not value.startswith(prefix):
+        errors.append(f"{name} must start with {prefix}")
+    return value
+
+
+def _url(name: str, errors: list, required: bool = True) -> str:
+    value = os.environ.get(name, "").strip()
+    if not value:
+        if required:
+            errors.append(f"{name} is not set")
+        return None
+    parsed = urlparse(value)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        errors.append(f"{name} must be an http(s) URL")
+    return value
+
+
+def _float(name: str, default: float, errors: list) -> float:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        errors.append(f"{name} must be a number")
+        return default
@@ -0,0 +1,138 @@
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+import zoneinfo
+from collections import OrderedDict
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = zoneinfo.ZoneInfo("Asia/Tokyo")
+
+WEEKDAYS = "月火水木金土日"
+
+# 読み込み時に正規表現を作らせるための例（起動時に 1 回ずつ解析します）
+WARMUP_TEXTS = ("明日", "3日後", "来週", "2024年10月20日", "next friday", "tomorrow")
+
+# よくある書き方は dateparser を使わずに解釈します（末尾の曜日は無視します）
+_FULL_DATE = re.compile(
+    r"^(\d{4})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})\s*日?\s*(?:[(（].[)）])?$"
+)
+_MONTH_DAY = re.compile(r"^(\d{1,2})\s*[/月]\s*(\d{1,2})\s*日?\s*(?:[(（].[)）])?$")
+
+
+class DateNormalizer:
+    # Dify のタスク一覧の期限（「10/20」「明日」など）を日付に変換して、並べ替えやリマインダーに使います
+    # dateparser は読み込みと最初の解析が遅いので、起動時に preload() で言語を固定して準備しておきます
+    # 解析結果は日付が変わるまで LRU に保存します（「明日」などは日付によって結果が変わるため）
+
+    def __init__(self, languages: tuple = ("ja", "en"), cache_size: int = 1024):
+        self.languages = list(languages)
+        self.cache_size = cache_size
+        self._parser = None
+        self._cache = OrderedDict()  # (text, 今日の日付) : date または None
+        self._lock = threading.Lock()
+        self._preload_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "fast_path": 0, "unparsed": 0}
+
+    @classmethod
+    def from_env(cls):
+        languages = os.environ.get("DATE_LANGUAGES", "ja,en")
+        return cls(
+            languages=tuple(lang.strip() for lang in languages.split(",") if lang.strip()),
+            cache_size=int(os.environ.get("DATE_CACHE_SIZE", "1024")),
+        )
+
+    def preload(self):
+        # dateparser を読み込み、言語を固定したパーサーで例文を解析しておきます
+        with self._preload_lock:
+            if self._parser is not None:
+                return
+            start = time.perf_counter()
+            from dateparser.date import DateDataParser
+
+            parser = DateDataParser(
+                languages=self.languages,
+                settings={"TIMEZONE": "Asia/Tokyo", "RETURN_AS_TIMEZONE_AWARE": True},
+            )
+            for text in WARMUP_TEXTS:
+                parser.get_date_data(text)
+            self._parser = parser
+            tracer.observe("dates_preload", time.perf_counter() - start)
+            logger.info(f"dateparser ready in {time.perf_counter() - start:.2f}s")
+
+    def parse(self, text: str, today: datetime.date = None):
+        # 日付（datetime.date）を返します。解釈できなければ None
+        if not text:
+            return None
+        text = text.strip()
+        today = today or datetime.datetime.now(TIMEZONE).date()
+        key = (text, today)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._cache[key]
+            self.stats["misses"] += 1
+
+        result = self._parse(text, today)
+
+        with self._lock:
+            if result is None:
+                self.stats["unparsed"] += 1
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _parse(self, text: str, today: datetime.date):
+        match = _FULL_DATE.match(text)
+        if match:
+            self.stats["fast_path"] += 1
+            return _date(*map(int, match.groups()))
+        match = _MONTH_DAY.match(text)
+        if match:
+            # 年がなければ今年とし、半年以上前になるなら来年とみなします
+            self.stats["fast_path"] += 1
+            month, day = map(int, match.groups())
+            result = _date(today.year, month, day)
+            if result is not None and (today - result).days > 183:
+                result = _date(today.year + 1, month, day)
+            return result
+
+        # 相対表現（「明日」など）は実行時刻が基準です。キャッシュは日付ごとなので結果は変わりません
+        if self._parser is None:
+            self.preload()
+        try:
+            data = self._parser.get_date_data(text)
+        except Exception:
+            logger.exception(f"failed to parse date: {text}")
+            return None
+        return data.date_obj.date() if data.date_obj is not None else None
+
+    def format(self, value: datetime.date) -> str:
+        return f"{value.month}/{value.day}({WEEKDAYS[value.weekday()]})"
+
+    def normalize_tasks(self, task_list: list) -> list:
+        # 期限を「10/20(日)」の形にそろえ、期限の早い順に並べます（解釈できないものは元の順で最後）
+        today = datetime.datetime.now(TIMEZONE).date()
+        dated = []
+        for index, task in enumerate(task_list):
+            due = self.parse(str(task.get("term") or ""), today)
+            if due is not None:
+                task = {**task, "term": self.format(due), "due": due.isoformat()}
+            dated.append((due is None, due or today, index, task))
+        dated.sort(key=lambda item: item[:3])
+        return [task for *_, task in dated]
+
+
+def _date(year: int, month: int, day: int):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
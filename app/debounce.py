@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def burst_key(event: dict) -> tuple:
+    # スレッド内の発言はスレッドごと、それ以外はチャンネルごとにまとめます
+    return event["channel"], event.get("thread_ts")
+
+
+def combine_text(events: list) -> str:
+    return "\n".join(event["text"] for event in events if event.get("text"))
+
+
+class _Burst:
+    def __init__(self):
+        self.events = []
+        self.generation = 0
+        self.started = None
+        self.deadline = None  # None なら返信待ち（またはタイマー未設定）
+        self.handle = None  # 非同期版のタイマー
+        self.task = None  # 非同期版の実行中の返信
+
+
+class Batch:
+    # まとめて 1 回で返信するメッセージ。返信を投稿する直前に claim() してください
+    # 返信の処理が終わったら（失敗しても）release() を呼んでください
+
+    def __init__(self, debouncer, key: tuple, events: list, generation: int):
+        self._debouncer = debouncer
+        self.key = key
+        self.events = events
+        self.generation = generation
+
+    def is_current(self) -> bool:
+        # まとめた後に新しいメッセージが来ていなければ True
+        return self._debouncer._is_current(self.key, self.generation)
+
+    def claim(self) -> bool:
+        # 返信してよければ True を返し、まとめたメッセージを返信済みにします
+        # 新しいメッセージが来ていたら False（そちらを含めてまとめ直したバッチが返信します）
+        return self._debouncer._claim(self.key, self.generation)
+
+    def release(self):
+        # claim() せずに終わった（返信に失敗した）バッチのメッセージを捨てます
+        # 新しいメッセージが来ていれば、まとめ直したバッチがそれを含めて返信するので何もしません
+        self._debouncer._release(self.key, self.generation)
+
+
+class _DebouncerBase:
+    # 同じチャンネル・スレッドに続けて届いたメッセージを window 秒待ってまとめ、1 回だけ返信させます
+    # 最初のメッセージから max_wait 秒たったら、発言が続いていてもまとめて返信します
+
+    def __init__(self, on_flush, window: float = 1.5, max_wait: float = 5.0):
+        self.on_flush = on_flush
+        self.window = window
+        self.max_wait = max_wait
+        self._bursts = {}  # burst_key : _Burst
+        self._lock = threading.Lock()
+        self.stats = {
+            "messages": 0,
+            "batches": 0,
+            "coalesced": 0,
+            "superseded": 0,
+            "replies": 0,
+            "released": 0,
+        }
+
+    @classmethod
+    def from_env(cls, on_flush):
+        # MESSAGE_DEBOUNCE_WINDOW が 0（既定）なら無効で、メッセージごとに返信します
+        window = float(os.environ.get("MESSAGE_DEBOUNCE_WINDOW", "0"))
+        if window <= 0:
+            return None
+        return cls(
+            on_flush,
+            window=window,
+            max_wait=float(os.environ.get("MESSAGE_DEBOUNCE_MAX_WAIT", "5")),
+        )
+
+    def _add(self, event: dict) -> _Burst:
+        # ロックを持った状態で呼びます
+        now = time.monotonic()
+        key = burst_key(event)
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst()
+        burst.events.append(event)
+        burst.generation += 1
+        if burst.deadline is None:
+            burst.started = now
+        burst.deadline = min(now + self.window, burst.started + self.max_wait)
+        self.stats["messages"] += 1
+        return burst
+
+    def _take(self, key: tuple):
+        # ロックを持った状態で呼びます。期限が来たバーストを Batch にします
+        burst = self._bursts.get(key)
+        if burst is None or burst.deadline is None:
+            return None
+        burst.deadline = None
+        self.stats["batches"] += 1
+        self.stats["coalesced"] += len(burst.events) - 1
+        return Batch(self, key, list(burst.events), burst.generation)
+
+    def _is_current(self, key: tuple, generation: int) -> bool:
+        with self._lock:
+            burst = self._bursts.get(key)
+            return burst is not None and burst.generation == generation
+
+    def _claim(self, key: tuple, generation: int) -> bool:
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is None or burst.generation != generation:
+                self.stats["superseded"] += 1
+                return False
+            del self._bursts[key]
+            self.stats["replies"] += 1
+            return True
+
+    def _release(self, key: tuple, generation: int):
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is not None and burst.generation == generation:
+                del self._bursts[key]
+                self.stats["released"] += 1
+
+
+class Debouncer(_DebouncerBase):
+    # スレッド版。期限の管理は 1 本のスレッドで行い、期限が来たら on_flush(batch) を呼びます
+    # 実行中の Dify 呼び出しは止められないので、返信側が is_current() / claim() で古い結果を捨てます
+
+    def __init__(self, on_flush, window: float = 1.5, max_wait: float = 5.0):
+        super().__init__(on_flush, window, max_wait)
+        self._wakeup = threading.Condition(self._lock)
+        threading.Thread(target=self._run, name="debounce", daemon=True).start()
+
+    def add(self, event: dict):
+        with self._lock:
+            self._add(event)
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                deadlines = {
+                    key: burst.deadline
+                    for key, burst in self._bursts.items()
+                    if burst.deadline is not None
+                }
+                due = [key for key, deadline in deadlines.items() if deadline <= now]
+                if not due:
+                    timeout = min(deadlines.values()) - now if deadlines else None
+                    self._wakeup.wait(timeout)
+                    continue
+                batches = [self._take(key) for key in due]
+
+            for batch in batches:
+                try:
+                    self.on_flush(batch)
+                except Exception:
+                    logger.exception("failed to flush debounced messages")
+
+
+class AsyncDebouncer(_DebouncerBase):
+    # 非同期版。on_flush(batch) は返信のタスクを返してください
+    # 返信の投稿前に新しいメッセージが来たら、そのタスク（Dify の呼び出し中でも）をキャンセルします
+
+    def add(self, event: dict):
+        with self._lock:
+            burst = self._add(event)
+            task, burst.task = burst.task, None
+            if task is not None and not task.done():
+                self.stats["superseded"] += 1
+            else:
+                task = None
+            if burst.handle is not None:
+                burst.handle.cancel()
+            key = burst_key(event)
+            burst.handle = asyncio.get_running_loop().call_later(
+                burst.deadline - time.monotonic(), self._fire, key
+            )
+        if task is not None:
+            task.cancel()
+
+    def _fire(self, key: tuple):
+        with self._lock:
+            batch = self._take(key)
+        if batch is None:
+            return
+        task = self.on_flush(batch)
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is not None and burst.generation == batch.generation:
+                burst.task = task
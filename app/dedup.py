@@ -0,0 +1,136 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from state import default_backend, state_path
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(body: dict):
+    # Slack が再送しても変わらない ID からキーを作ります。キーを作れないリクエストは None
+    # （envelope_id は再送のたびに新しくなるので使えません）
+    if body.get("event_id"):
+        return f"event:{body['event_id']}"
+
+    request_type = body.get("type")
+    view = body.get("view") or {}
+    if request_type in ("view_submission", "view_closed") and view.get("id"):
+        return f"{request_type}:{view['id']}:{view.get('hash')}"
+
+    actions = body.get("actions") or []
+    if request_type == "block_actions" and actions and actions[0].get("action_ts"):
+        user = (body.get("user") or {}).get("id")
+        return f"action:{user}:{actions[0]['action_ts']}"
+
+    # ショートカットとスラッシュコマンド
+    if body.get("trigger_id"):
+        return f"trigger:{body['trigger_id']}"
+    return None
+
+
+class SQLiteDedupBackend:
+    # 同じホストの複数プロセスで処理済みのキーを共有します
+
+    def __init__(self, path: str, purge_interval: float = 60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slack_dedup ("
+            " key TEXT PRIMARY KEY,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add(self, key: str, ttl: float) -> bool:
+        # 初めてのキー（または期限切れのキー）なら True を返します
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO slack_dedup VALUES (?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at"
+                " WHERE slack_dedup.expires_at < ?",
+                (key, now + ttl, now),
+            )
+            if now - self._purged_at > self.purge_interval:
+                self._conn.execute("DELETE FROM slack_dedup WHERE expires_at < ?", (now,))
+                self._purged_at = now
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM slack_dedup").fetchone()[0]
+
+
+class Deduplicator:
+    # Slack からの再送（ack が遅れたときなど）をネットワーク I/O の前に捨てます
+    # まずプロセス内の LRU を見て、backend があればホスト内の他のプロセスとも共有します
+
+    def __init__(self, backend=None, max_entries: int = 10000, ttl: float = 600.0):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._recent = OrderedDict()  # key : expires_at
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "duplicates": 0, "unkeyed": 0}
+
+    @classmethod
+    def from_env(cls):
+        # DEDUP_ENABLED=false なら None を返します
+        if os.environ.get("DEDUP_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+
+        backend = None
+        if (os.environ.get("DEDUP_BACKEND") or default_backend()) == "sqlite":
+            backend = SQLiteDedupBackend(
+                os.environ.get("DEDUP_PATH") or state_path("slack_dedup.sqlite3")
+            )
+        return cls(
+            backend,
+            max_entries=int(os.environ.get("DEDUP_MAX_ENTRIES", "10000")),
+            ttl=float(os.environ.get("DEDUP_TTL", "600")),
+        )
+
+    def _remember(self, key: str, now: float) -> bool:
+        # LRU に記録します。すでに記録済み（期限内）なら False
+        expires_at = self._recent.get(key)
+        if expires_at is not None and expires_at >= now:
+            self._recent.move_to_end(key)
+            return False
+        self._recent[key] = now + self.ttl
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+        return True
+
+    def first_seen(self, key: str) -> bool:
+        now = time.time()
+        with self._lock:
+            self.stats["checked"] += 1
+            first = self._remember(key, now)
+        if first and self.backend is not None:
+            try:
+                first = self.backend.add(key, self.ttl)
+            except sqlite3.Error:
+                # 共有ストアが使えなくても処理は止めません
+                logger.exception("dedup store is not available")
+        if not first:
+            with self._lock:
+                self.stats["duplicates"] += 1
+        return first
+
+    def is_duplicate(self, body: dict) -> bool:
+        key = request_key(body)
+        if key is None:
+            with self._lock:
+                self.stats["unkeyed"] += 1
+            return False
+        return not self.first_seen(key)
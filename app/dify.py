@@ -0,0 +1,239 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Dify のアプリ名 : トークンの環境変数名
+DIFY_APPS = {
+    "APP1": "DIFY_API_APP1_TOKEN",
+    "APP2": "DIFY_API_APP2_TOKEN",
+    "APP3": "DIFY_API_APP3_TOKEN",
+    "APP4": "DIFY_API_APP4_TOKEN",
+}
+
+# リトライ対象のステータスコード
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class DifyClient:
+    # 全ハンドラーで共有する Dify クライアント
+    # requests.Session のコネクションプールを使い回して TCP/TLS ハンドシェイクを省きます
+    # requests は読み込みに時間がかかるので、Slack への接続後（preload）か最初の呼び出しで読み込みます
+
+    def __init__(
+        self,
+        url: str,
+        tokens: dict,
+        user: str,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 60.0,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        cache=None,
+        singleflight=None,
+    ):
+        self.url = url
+        self.cache = cache
+        self.singleflight = singleflight
+        self.tokens = tokens
+        self.user = user
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.adapter = None
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "in_flight": 0,
+            "latency_seconds_total": 0.0,
+        }
+        self._per_app = {app: 0 for app in tokens}
+
+    @classmethod
+    def from_env(cls, config, **kwargs):
+        # 接続先とトークンは起動時に検証済みの Config から受け取ります
+        return cls(
+            url=config.dify_url,
+            tokens=dict(config.dify_tokens),
+            user=config.dify_user,
+            pool_size=int(os.environ.get("DIFY_POOL_SIZE", "10")),
+            connect_timeout=float(os.environ.get("DIFY_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.environ.get("DIFY_READ_TIMEOUT", "60")),
+            max_retries=int(os.environ.get("DIFY_MAX_RETRIES", "2")),
+            backoff_factor=float(os.environ.get("DIFY_BACKOFF_FACTOR", "0.5")),
+            **kwargs,
+        )
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        return session
+
+    def preload(self):
+        # requests を読み込んでセッションを作っておきます（最初の呼び出しを待たせないため）
+        start = time.perf_counter()
+        self.session
+        tracer.observe("dify_preload", time.perf_counter() - start)
+
+    def _headers(self, app: str) -> dict:
+        token = self.tokens.get(app)
+        if not token:
+            raise ValueError(f"Dify token for {app} is not configured")
+        return {"Authorization": f"Bearer {token}"}
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self._counters[key] += value
+
+    @contextlib.contextmanager
+    def _track(self, app: str):
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["in_flight"] += 1
+            self._per_app[app] = self._per_app.get(app, 0) + 1
+
+        start = time.perf_counter()
+        try:
+            with tracer.span("dify", app=app):
+                yield
+        except Exception:
+            self._count("errors")
+            logger.exception(f"Dify {app} request failed")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._counters["in_flight"] -= 1
+                self._counters["latency_seconds_total"] += elapsed
+
+    def _post(self, app: str, payload: dict, stream: bool = False):
+        response = self.session.post(
+            self.url,
+            headers=self._headers(app),
+            json=payload,
+            timeout=self.timeout,
+            stream=stream,
+        )
+        # ヘッダーを受け取るまでの時間（time to first byte）
+        tracer.observe("dify_ttfb", response.elapsed.total_seconds(), app=app)
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            self._count("retries", len(retries.history))
+        response.raise_for_status()
+        return response
+
+    def run(self, app: str, inputs: dict, response_mode: str = "blocking") -> dict:
+        # response_mode=None の場合はパラメータ自体を送りません（Dify 側のデフォルト）
+        payload = {"inputs": inputs, "user": self.user}
+        if response_mode:
+            payload["response_mode"] = response_mode
+
+        # キャッシュ対象のアプリは同じ入力ならキャッシュから返します
+        key = None
+        if self.cache is not None and self.cache.enabled_for(app):
+            key = self.cache.key(app, self.tokens.get(app), inputs)
+            cached = self.cache.get(app, key)
+            if cached is not None:
+                return cached
+
+        def call():
+            with self._track(app):
+                response_json = self._post(app, payload).json()
+            if key is not None:
+                self.cache.set(key, response_json)
+            return response_json
+
+        # 同じ入力の呼び出しが実行中なら、その結果を待って共有します
+        if self.singleflight is not None and self.singleflight.enabled_for(app):
+            flight_key = self.singleflight.key(app, self.tokens.get(app), inputs)
+            return self.singleflight.do(flight_key, call)
+        return call()
+
+    def stream(self, app: str, inputs: dict):
+        # streaming モードで実行し、SSE のイベントを dict で順に返します
+        payload = {"inputs": inputs, "user": self.user, "response_mode": "streaming"}
+
+        start = time.perf_counter()
+        first = True
+        with self._track(app):
+            with self._post(app, payload, stream=True) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:") :].strip())
+                    if event.get("event") == "error":
+                        raise RuntimeError(event.get("message", "Dify stream error"))
+                    if first:
+                        first = False
+                        tracer.observe(
+                            "dify_first_event", time.perf_counter() - start, app=app
+                        )
+                    yield event
+
+    def stats(self) -> dict:
+        # モニタリング用にプールの状態とリクエスト数を返します
+        pools = []
+        manager = self.adapter.poolmanager if self.adapter is not None else None
+        for key in list(manager.pools.keys()) if manager is not None else ():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append(
+                {
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": pool.pool.qsize() if pool.pool else 0,
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                }
+            )
+
+        with self._lock:
+            return {**self._counters, "per_app": dict(self._per_app), "pools": pools}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
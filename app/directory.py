@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+if TYPE_CHECKING:
+    # aiohttp の読み込みが重いので、同期版では読み込みません
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+USER_ID_PATTERN = re.compile(r"^[UW][A-Z0-9]{2,}$")
+CHANNEL_ID_PATTERN = re.compile(r"^[CGD][A-Z0-9]{2,}$")
+
+PAGE_SIZE = 200
+
+# 起動時の読み込みに失敗したときの再試行の間隔（秒）。失敗するたびに倍にします
+RETRY_DELAY = 5.0
+RETRY_MAX_DELAY = 300.0
+
+
+def _display_name(user: dict) -> str:
+    profile = user.get("profile") or {}
+    return (
+        profile.get("display_name")
+        or profile.get("real_name")
+        or user.get("real_name")
+        or user.get("name")
+    )
+
+
+class Directory:
+    # ユーザーとチャンネルの ID と名前をメモリ上で引けるようにします
+    # 起動時に一括で読み込み、以降は user_change / channel_rename などのイベントで更新します
+    # 読み込みに失敗したら（権限不足や 429 など）間隔を空けて読み込めるまで再試行します
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_names = {}  # user_id : 表示名
+        self._user_ids = {}  # name / 表示名 : user_id
+        self._bots = set()  # ボット（Slackbot を含む）の user_id
+        self._deleted = set()  # 削除（無効化）されたユーザーの user_id
+        self._channel_names = {}  # channel_id : name
+        self._channel_ids = {}  # name : channel_id
+        self.loaded = False
+        self._load_lock = threading.Lock()
+        self._aload_lock = asyncio.Lock()
+
+    def load(self, client: WebClient):
+        users = self._paginate(client.users_list, "members")
+        channels = self._paginate(
+            client.conversations_list,
+            "channels",
+            types="public_channel,private_channel",
+            exclude_archived=True,
+        )
+        self._replace(users, channels)
+
+    async def aload(self, client: "AsyncWebClient"):
+        users = await self._apaginate(client.users_list, "members")
+        channels = await self._apaginate(
+            client.conversations_list,
+            "channels",
+            types="public_channel,private_channel",
+            exclude_archived=True,
+        )
+        self._replace(users, channels)
+
+    def load_with_retry(self, client: WebClient):
+        delay = RETRY_DELAY
+        while not self.ensure_loaded(client):
+            logger.warning(f"retrying directory load in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    async def aload_with_retry(self, client: "AsyncWebClient"):
+        delay = RETRY_DELAY
+        while not await self.aensure_loaded(client):
+            logger.warning(f"retrying directory load in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    def ensure_loaded(self, client: WebClient) -> bool:
+        # まだ読み込めていなければ読み込みます。読み込み中なら終わるまで待ちます
+        with self._load_lock:
+            if not self.loaded:
+                try:
+                    self.load(client)
+                except Exception:
+                    logger.exception("failed to load users and channels")
+            return self.loaded
+
+    async def aensure_loaded(self, client: "AsyncWebClient") -> bool:
+        async with self._aload_lock:
+            if not self.loaded:
+                try:
+                    await self.aload(client)
+                except Exception:
+                    logger.exception("failed to load users and channels")
+            return self.loaded
+
+    def find_channel(self, client: WebClient, value: str):
+        # resolve_channel と同じですが、起動時の読み込みが終わっていなければその場で読み込んでから引きます
+        channel_id = self.resolve_channel(value)
+        if channel_id is None and not self.loaded and self.ensure_loaded(client):
+            channel_id = self.resolve_channel(value)
+        return channel_id
+
+    async def afind_channel(self, client: "AsyncWebClient", value: str):
+        channel_id = self.resolve_channel(value)
+        if channel_id is None and not self.loaded and await self.aensure_loaded(client):
+            channel_id = self.resolve_channel(value)
+        return channel_id
+
+    def channel_members(self, client: WebClient, channel: str) -> list:
+        return self._paginate(client.conversations_members, "members", channel=channel)
+
+    async def achannel_members(self, client: "AsyncWebClient", channel: str) -> list:
+        return await self._apaginate(
+            client.conversations_members, "members", channel=channel
+        )
+
+    @staticmethod
+    def _paginate(method, key: str, **kwargs) -> list:
+        items = []
+        cursor = None
+        while True:
+            response = method(limit=PAGE_SIZE, cursor=cursor, **kwargs)
+            items.extend(response[key])
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return items
+
+    @staticmethod
+    async def _apaginate(method, key: str, **kwargs) -> list:
+        items = []
+        cursor = None
+        while True:
+            response = await method(limit=PAGE_SIZE, cursor=cursor, **kwargs)
+            items.extend(response[key])
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return items
+
+    def _replace(self, users: list, channels: list):
+        with self._lock:
+            self._user_names.clear()
+            self._user_ids.clear()
+            self._bots.clear()
+            self._deleted.clear()
+            self._channel_names.clear()
+            self._channel_ids.clear()
+            for user in users:
+                self._put_user(user)
+            for channel in channels:
+                self._put_channel(channel)
+            self.loaded = True
+        logger.info(f"directory loaded: {len(users)} users, {len(channels)} channels")
+
+    def _put_user(self, user: dict):
+        if user.get("is_bot") or user["id"] == "USLACKBOT":
+            self._bots.add(user["id"])
+        else:
+            self._bots.discard(user["id"])
+        if user.get("deleted"):
+            self._deleted.add(user["id"])
+            self._user_names.pop(user["id"], None)
+            return
+        self._deleted.discard(user["id"])
+        name = _display_name(user)
+        self._user_names[user["id"]] = name
+        for key in (user.get("name"), name):
+            if key:
+                self._user_ids[key] = user["id"]
+
+    def _put_channel(self, channel: dict):
+        old = self._channel_names.get(channel["id"])
+        if old and self._channel_ids.get(old) == channel["id"]:
+            del self._channel_ids[old]
+        self._channel_names[channel["id"]] = channel["name"]
+        self._channel_ids[channel["name"]] = channel["id"]
+
+    # イベントでの更新（user_change / team_join / channel_rename / channel_created）
+    def on_user_event(self, event: dict):
+        with self._lock:
+            self._put_user(event["user"])
+
+    def on_channel_event(self, event: dict):
+        with self._lock:
+            self._put_channel(event["channel"])
+
+    # 参照
+    def user_name(self, user_id: str):
+        return self._user_names.get(user_id)
+
+    def user_id(self, name: str):
+        return self._user_ids.get(name)
+
+    def people(self, user_ids: list, exclude=()) -> list:
+        # ボットと削除済みのユーザー、exclude（アプリ自身など）を除きます
+        with self._lock:
+            skip = self._bots | self._deleted | set(exclude)
+        return [user_id for user_id in user_ids if user_id not in skip]
+
+    def channel_name(self, channel_id: str):
+        return self._channel_names.get(channel_id)
+
+    def channel_id(self, name: str):
+        return self._channel_ids.get(name.lstrip("#"))
+
+    def resolve_user(self, value: str):
+        # ID ならそのまま、名前なら ID に変換します
+        if not value or USER_ID_PATTERN.match(value):
+            return value
+        return self.user_id(value.lstrip("@"))
+
+    def resolve_channel(self, value: str):
+        if not value or CHANNEL_ID_PATTERN.match(value):
+            return value
+        return self.channel_id(value)
@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def _env_set(name: str, default: str = "") -> frozenset:
+    return frozenset(
+        item.strip() for item in os.environ.get(name, default).split(",") if item.strip()
+    )
+
+
+class MessageFilter:
+    # message イベントのうち、応答しないもの（ボットの投稿・編集・参加通知など）を弾きます
+    # 履歴の取得や Dify の呼び出しより前に、イベントごとに一定時間で判定します
+
+    def __init__(
+        self,
+        allowed_subtypes: frozenset = frozenset({"thread_broadcast", "file_share"}),
+        ignore_bots: bool = True,
+        allow_channels: frozenset = frozenset(),
+        deny_channels: frozenset = frozenset(),
+        thread_only: bool = False,
+        min_text_length: int = 1,
+        channel_name=None,
+    ):
+        self.allowed_subtypes = frozenset(allowed_subtypes)
+        self.ignore_bots = ignore_bots
+        self.allow_channels = frozenset(allow_channels)  # 空ならすべて許可
+        self.deny_channels = frozenset(deny_channels)
+        self.thread_only = thread_only
+        self.min_text_length = min_text_length
+        # チャンネル ID から名前を引く関数（名前でも指定できるようにします）
+        self.channel_name = channel_name or (lambda channel_id: None)
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.dropped = Counter()
+
+    @classmethod
+    def from_env(cls, channel_name=None):
+        return cls(
+            allowed_subtypes=_env_set(
+                "MESSAGE_ALLOWED_SUBTYPES", "thread_broadcast,file_share"
+            ),
+            ignore_bots=os.environ.get("MESSAGE_IGNORE_BOTS", "true").lower()
+            in ("1", "true", "yes"),
+            allow_channels=_env_set("MESSAGE_ALLOW_CHANNELS"),
+            deny_channels=_env_set("MESSAGE_DENY_CHANNELS"),
+            thread_only=os.environ.get("MESSAGE_THREAD_ONLY", "false").lower()
+            in ("1", "true", "yes"),
+            min_text_length=int(os.environ.get("MESSAGE_MIN_TEXT_LENGTH", "1")),
+            channel_name=channel_name,
+        )
+
+    def _in(self, channels: frozenset, channel_id: str) -> bool:
+        return channel_id in channels or self.channel_name(channel_id) in channels
+
+    def reason(self, event: dict):
+        # 弾く理由を返します。応答するイベントなら None
+        subtype = event.get("subtype")
+        if subtype and subtype not in self.allowed_subtypes:
+            return f"subtype:{subtype}"
+        if self.ignore_bots and (event.get("bot_id") or event.get("bot_profile")):
+            return "bot"
+        if not event.get("user"):
+            return "no_user"
+
+        channel_id = event.get("channel")
+        if self.deny_channels and self._in(self.deny_channels, channel_id):
+            return "channel_denied"
+        if self.allow_channels and not self._in(self.allow_channels, channel_id):
+            return "channel_not_allowed"
+
+        if self.thread_only and not event.get("thread_ts"):
+            return "not_in_thread"
+        if len((event.get("text") or "").strip()) < self.min_text_length:
+            return "short_text"
+        return None
+
+    def accept(self, event: dict) -> bool:
+        reason = self.reason(event)
+        with self._lock:
+            if reason is None:
+                self.passed += 1
+            else:
+                self.dropped[reason] += 1
+        if reason is not None:
+            logger.debug(f"message ignored: {reason}")
+        return reason is None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"passed": self.passed, "dropped": dict(self.dropped)}
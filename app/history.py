@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+from state import shared
+from tracing import tracer
+from workers import worker_count
+
+if TYPE_CHECKING:
+    # aiohttp の読み込みが重いので、同期版では読み込みません
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+
+def strip_message(message: dict) -> dict:
+    # Dify に送らないフィールドを落とします
+    return {k: v for k, v in message.items() if k != "blocks"}
+
+
+def _is_top_level(message: dict) -> bool:
+    # conversations.history と同じく、スレッドの返信は含めません
+    thread_ts = message.get("thread_ts")
+    return (
+        thread_ts is None
+        or thread_ts == message.get("ts")
+        or message.get("subtype") == "thread_broadcast"
+    )
+
+
+class _ChannelHistory:
+    def __init__(self):
+        self.messages = {}  # ts : message
+        self.order = []  # 昇順の ts
+        self.exhausted = False  # チャンネルの全履歴を保持しているか
+        self.threads = {}  # スレッドの親の ts : 最新の返信の ts
+        self.synced_at = 0.0
+        self.accessed_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.alock = asyncio.Lock()
+
+    def insert(self, message: dict):
+        ts = message["ts"]
+        if ts not in self.messages:
+            self.order.append(ts)
+            if len(self.order) > 1 and self.order[-2] > ts:
+                self.order.sort()
+        self.messages[ts] = strip_message(message)
+        if message.get("latest_reply"):
+            self.note_reply(ts, message["latest_reply"])
+
+    def note_reply(self, thread_ts: str, ts: str):
+        if float(ts) > float(self.threads.get(thread_ts, "0")):
+            self.threads[thread_ts] = ts
+
+    def remove(self, ts: str):
+        if self.messages.pop(ts, None) is not None:
+            self.order.remove(ts)
+
+    def trim(self, max_messages: int):
+        while len(self.order) > max_messages:
+            del self.messages[self.order.pop(0)]
+            self.exhausted = False
+        # スレッドは最近返信があったものから max_messages 件だけ覚えておきます
+        if len(self.threads) > max_messages:
+            recent = sorted(self.threads, key=lambda ts: float(self.threads[ts]))
+            for thread_ts in recent[: len(self.threads) - max_messages]:
+                del self.threads[thread_ts]
+
+    def latest(self, limit: int) -> list:
+        return [self.messages[ts] for ts in self.order[-limit:]]
+
+    def active_threads(self, ts: str) -> list:
+        return sorted(
+            (
+                thread_ts
+                for thread_ts, latest_reply in self.threads.items()
+                if float(thread_ts) <= float(ts) < float(latest_reply)
+            ),
+            key=float,
+        )
+
+
+class HistoryCache:
+    # チャンネルごとの会話履歴をメモリに保持します
+    # message イベントで差分を積み上げ、コールドスタート時と一定時間経過後だけ Slack API を呼びます
+    # 複数のワーカーで動かすとイベントは各ワーカーに分かれて届き、他のワーカーに届いたメッセージが
+    # 反映されないので、complete_events=False にして毎回取り直します
+
+    def __init__(
+        self,
+        max_messages: int = 200,
+        max_channels: int = 100,
+        resync_interval: float = 300.0,
+        ttl: float = 3600.0,
+        complete_events: bool = True,
+    ):
+        self.max_messages = max_messages
+        self.max_channels = max_channels
+        self.resync_interval = resync_interval
+        self.ttl = ttl
+        self.complete_events = complete_events
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "full_fetches": 0, "delta_fetches": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        # イベントがすべてこのプロセスに届くか（届かなければ差分取得を信用せず毎回取得します）
+        # 未設定なら、ワーカーが 1 つで STATE_DIR も使っていない（コンテナを増やしていない）ときだけ信用します
+        complete_events = os.environ.get("HISTORY_CACHE_COMPLETE_EVENTS", "")
+        if complete_events:
+            complete_events = complete_events.lower() in ("1", "true", "yes")
+        else:
+            complete_events = worker_count() <= 1 and not shared()
+        return cls(
+            max_messages=int(os.environ.get("HISTORY_CACHE_MAX_MESSAGES", "200")),
+            max_channels=int(os.environ.get("HISTORY_CACHE_MAX_CHANNELS", "100")),
+            resync_interval=float(os.environ.get("HISTORY_CACHE_RESYNC", "300")),
+            ttl=float(os.environ.get("HISTORY_CACHE_TTL", "3600")),
+            complete_events=complete_events,
+        )
+
+    def _entry(self, channel: str, create: bool = False):
+        with self._lock:
+            self._evict()
+            entry = self._channels.get(channel)
+            if entry is None and create:
+                entry = self._channels[channel] = _ChannelHistory()
+            if entry is not None:
+                self._channels.move_to_end(channel)
+                entry.accessed_at = time.monotonic()
+            return entry
+
+    def _evict(self):
+        now = time.monotonic()
+        for channel in list(self._channels):
+            if now - self._channels[channel].accessed_at > self.ttl:
+                del self._channels[channel]
+                self.stats["evictions"] += 1
+        while len(self._channels) > self.max_channels:
+            self._channels.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def feed(self, event: dict):
+        # message イベントを履歴に反映します。まだ取得していないチャンネルは無視します
+        channel = event.get("channel")
+        entry = self._entry(channel) if channel else None
+        if entry is None:
+            return
+
+        subtype = event.get("subtype")
+        with entry.lock:
+            if subtype == "message_changed":
+                message = event.get("message", {})
+                if message.get("ts") in entry.messages:
+                    entry.insert(message)
+            elif subtype == "message_deleted":
+                entry.remove(event.get("deleted_ts"))
+            elif "ts" in event:
+                thread_ts = event.get("thread_ts")
+                if thread_ts and thread_ts != event["ts"]:
+                    # スレッドの返信は履歴には入れず、スレッドの最新の返信として覚えます
+                    entry.note_reply(thread_ts, event["ts"])
+                if _is_top_level(event):
+                    entry.insert(event)
+                    entry.trim(self.max_messages)
+
+    def _plan(self, entry, limit: int) -> str:
+        enough = len(entry.order) >= limit or entry.exhausted
+        if not entry.synced_at or not enough or not self.complete_events:
+            return "full"
+        if time.monotonic() - entry.synced_at > self.resync_interval:
+            return "delta"
+        self.stats["hits"] += 1
+        return "hit"
+
+    def _delta_oldest(self, entry) -> str:
+        # 最後に保持しているメッセージ以降だけを取得します
+        self.stats["delta_fetches"] += 1
+        return entry.order[-1] if entry.order else "0"
+
+    def get(
+        self, client: WebClient, channel: str, limit: int, window: int = None
+    ) -> list:
+        # ts 昇順・blocks 除去済みの直近 limit 件を返します
+        # window を指定すると、取り直すときにはその件数まで読みます（既定は limit 件）
+        limit = min(limit, self.max_messages)
+        window = min(max(window or limit, limit), self.max_messages)
+        entry = self._entry(channel, create=True)
+
+        with tracer.span("history") as span, entry.lock:
+            action = self._plan(entry, limit)
+            if action == "delta":
+                history = client.conversations_history(
+                    channel=channel, oldest=self._delta_oldest(entry), limit=limit
+                )
+                if not self._apply_delta(entry, history):
+                    action = "full"
+            if action == "full":
+                self.stats["full_fetches"] += 1
+                history = client.conversations_history(channel=channel, limit=window)
+                self._apply_full(entry, history)
+
+            span.set(plan=action)
+            return entry.latest(limit)
+
+    async def aget(
+        self, client: "AsyncWebClient", channel: str, limit: int, window: int = None
+    ) -> list:
+        # 非同期ランタイム用の get()
+        limit = min(limit, self.max_messages)
+        window = min(max(window or limit, limit), self.max_messages)
+        entry = self._entry(channel, create=True)
+
+        with tracer.span("history") as span:
+            async with entry.alock:
+                action = self._plan(entry, limit)
+                if action == "delta":
+                    history = await client.conversations_history(
+                        channel=channel, oldest=self._delta_oldest(entry), limit=limit
+                    )
+                    if not self._apply_delta(entry, history):
+                        action = "full"
+                if action == "full":
+                    self.stats["full_fetches"] += 1
+                    history = await client.conversations_history(
+                        channel=channel, limit=window
+                    )
+                    self._apply_full(entry, history)
+
+                span.set(plan=action)
+                return entry.latest(limit)
+
+    def has_newer(self, client: WebClient, channel: str, ts: str) -> bool:
+        # ts より新しいメッセージかスレッドの返信があるか。キャッシュが新しければ Slack を呼びません
+        # 返信は、保持している親の latest_reply と返信の message イベントから判断します
+        # （取り直すときは、親の latest_reply も新しくなるよう保持件数いっぱいまで読みます）
+        latest = self.get(client, channel, limit=1, window=self.max_messages)
+        return self._newer(channel, latest, ts)
+
+    async def ahas_newer(self, client: "AsyncWebClient", channel: str, ts: str) -> bool:
+        latest = await self.aget(client, channel, limit=1, window=self.max_messages)
+        return self._newer(channel, latest, ts)
+
+    def _newer(self, channel: str, latest: list, ts: str) -> bool:
+        if latest and float(latest[-1]["ts"]) > float(ts):
+            return True
+        return bool(self.active_threads(channel, ts))
+
+    def active_threads(self, channel: str, ts: str) -> list:
+        # ts 以前に始まり、ts より後に返信があったスレッドの親の ts（古い順）
+        # conversations.history(oldest=ts) では親が返ってこないので、HistoryReader に別に渡します
+        entry = self._entry(channel)
+        if entry is None:
+            return []
+        with entry.lock:
+            return entry.active_threads(ts)
+
+    def prime(self, channel: str, messages: list):
+        # 別の経路（HistoryReader など）で読んだ直近のメッセージで、まだ取得していないチャンネルを埋めます
+        # messages は最新から途切れずに読んだものに限ります。次の get() / has_newer() で Slack を呼ばずに済みます
+        entry = self._entry(channel, create=True)
+        with entry.lock:
+            for message in messages:
+                thread_ts = message.get("thread_ts")
+                if thread_ts and thread_ts != message["ts"]:
+                    entry.note_reply(thread_ts, message["ts"])
+            if entry.synced_at:
+                return
+            for message in messages:
+                if _is_top_level(message):
+                    entry.insert(message)
+            entry.trim(self.max_messages)
+            entry.synced_at = time.monotonic()
+
+    def _apply_full(self, entry, history):
+        entry.messages.clear()
+        entry.order.clear()
+        for message in reversed(history["messages"]):
+            entry.insert(message)
+        entry.exhausted = not history.get("has_more", False)
+        entry.synced_at = time.monotonic()
+
+    def _apply_delta(self, entry, history) -> bool:
+        if history.get("has_more", False):
+            # 取りこぼしが limit 件を超えているので取り直します
+            return False
+
+        for message in reversed(history["messages"]):
+            entry.insert(message)
+        entry.trim(self.max_messages)
+        entry.synced_at = time.monotonic()
+        return True
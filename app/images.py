@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def parse_image(response_json: dict) -> dict:
+    # Dify APP2（画像生成）のレスポンスからプロンプトと URL を取り出します
+    outputs = response_json["data"]["outputs"]
+    return {"prompt": outputs["prompt"], "url": outputs["url"]}
+
+
+class ImagePool:
+    # 生成済みの画像を数枚ストックしておき、送信時に待たずに使えるようにします
+    # 画像生成のプロンプトは送信内容に依存しないので、先に作っておけます
+
+    def __init__(self, size: int = 2, ttl: float = 1800.0):
+        self.size = size
+        self.ttl = ttl
+        self._images = deque()  # (作成時刻, image)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "generated": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=int(os.environ.get("IMAGE_POOL_SIZE", "2")),
+            ttl=float(os.environ.get("IMAGE_POOL_TTL", "1800")),
+        )
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        while self._images and now - self._images[0][0] > self.ttl:
+            self._images.popleft()
+            self.stats["expired"] += 1
+
+    def take(self):
+        # ストックがあれば 1 枚取り出します。なければ None
+        with self._lock:
+            self._drop_expired()
+            if not self._images:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return self._images.popleft()[1]
+
+    def reserve(self) -> int:
+        # 補充が必要な枚数を返し、その分を生成中として予約します
+        with self._lock:
+            self._drop_expired()
+            needed = max(0, self.size - len(self._images) - self._pending)
+            self._pending += needed
+            return needed
+
+    def fill(self, image: dict):
+        with self._lock:
+            self._pending -= 1
+            self._images.append((time.monotonic(), image))
+            self.stats["generated"] += 1
+
+    def cancel(self):
+        # 予約した生成が失敗・中止されたときに呼びます
+        with self._lock:
+            self._pending -= 1
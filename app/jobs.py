@@ -0,0 +1,149 @@
+import enum
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class JobKind(str, enum.Enum):
+    REWRITE = "rewrite"  # やわらかくする（APP1）
+    IMAGE = "image"  # 画像生成（APP2）
+    TASKS = "tasks"  # タスク抽出（APP3）
+    CHAT = "chat"  # チャット応答（APP4）
+    DELIVER = "deliver"  # Dify を待たない Slack への投稿
+
+
+# 種類ごとのワーカー数（= 同時実行数の上限）
+DEFAULT_CONCURRENCY = {
+    JobKind.REWRITE: 4,
+    JobKind.IMAGE: 2,
+    JobKind.TASKS: 2,
+    JobKind.CHAT: 8,
+    JobKind.DELIVER: 4,
+}
+
+
+@dataclass
+class Job:
+    kind: JobKind
+    fn: object
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class _Lane:
+    # 種類ごとのキューとワーカー。遅いアプリが速いアプリのワーカーを占有しないように分けています
+
+    def __init__(self, kind: JobKind, concurrency: int, max_queue: int):
+        self.kind = kind
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "running": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+        self.threads = [
+            threading.Thread(
+                target=self._work, name=f"job-{kind.value}-{i}", daemon=True
+            )
+            for i in range(concurrency)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            wait = time.monotonic() - job.enqueued_at
+            tracer.new_trace()
+            tracer.observe("job_wait", wait, kind=self.kind.value)
+            with self.lock:
+                self.stats["running"] += 1
+                self.stats["wait_seconds_total"] += wait
+                self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], wait)
+
+            try:
+                with tracer.span("job", kind=self.kind.value, fn=job.fn.__name__):
+                    job.fn(*job.args, **job.kwargs)
+                result = "completed"
+            except Exception:
+                logger.exception(f"{self.kind.value} job failed")
+                result = "failed"
+            finally:
+                with self.lock:
+                    self.stats["running"] -= 1
+                    self.stats[result] += 1
+                self.queue.task_done()
+
+
+class JobQueue:
+    # ack() 後の重い処理（Dify 呼び出しなど）を Bolt のリスナースレッドから切り離します
+
+    def __init__(self, concurrency: dict = None, max_queue: int = 100):
+        concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.lanes = {
+            kind: _Lane(kind, concurrency[kind], max_queue) for kind in JobKind
+        }
+
+    @classmethod
+    def from_env(cls):
+        # 例: JOB_CONCURRENCY=chat=8,tasks=2
+        concurrency = {}
+        for item in os.environ.get("JOB_CONCURRENCY", "").split(","):
+            if "=" in item:
+                kind, value = item.split("=", 1)
+                concurrency[JobKind(kind.strip())] = int(value)
+        return cls(
+            concurrency=concurrency,
+            max_queue=int(os.environ.get("JOB_QUEUE_SIZE", "100")),
+        )
+
+    def submit(self, kind: JobKind, fn, *args, **kwargs) -> bool:
+        # キューが一杯なら False を返します（呼び出し側で「混雑中」を返してください）
+        lane = self.lanes[kind]
+        try:
+            lane.queue.put_nowait(Job(kind, fn, args, kwargs))
+        except queue.Full:
+            with lane.lock:
+                lane.stats["rejected"] += 1
+            return False
+
+        with lane.lock:
+            lane.stats["submitted"] += 1
+        return True
+
+    def stats(self) -> dict:
+        result = {}
+        for kind, lane in self.lanes.items():
+            with lane.lock:
+                result[kind.value] = {
+                    **lane.stats,
+                    "depth": lane.queue.qsize(),
+                    "concurrency": lane.concurrency,
+                }
+        return result
+
+    def shutdown(self, wait: bool = True):
+        for lane in self.lanes.values():
+            for _ in lane.threads:
+                lane.queue.put(None)
+        if wait:
+            for lane in self.lanes.values():
+                for thread in lane.threads:
+                    thread.join()
@@ -0,0 +1,77 @@
+import fcntl
+import logging
+import os
+import threading
+
+from state import state_path
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    # 同じホストで動くワーカーのうち 1 つだけをリーダーにします（定期実行の処理はリーダーだけが行います）
+    # ファイルロックはプロセスが終了すると外れるので、残りのワーカーのどれかが引き継ぎます
+
+    def __init__(self, path: str, retry_interval: float = 5.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self.elected = threading.Event()
+        self._callbacks = []
+        self._file = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("LEADER_LOCK_PATH") or state_path("leader.lock"),
+            retry_interval=float(os.environ.get("LEADER_RETRY_INTERVAL", "5")),
+        )
+
+    def is_leader(self) -> bool:
+        return self.elected.is_set()
+
+    def on_elected(self, callback):
+        # リーダーになったときに呼ばれます（すでにリーダーならすぐに呼びます）
+        self._callbacks.append(callback)
+        if self.is_leader():
+            callback()
+
+    def try_acquire(self) -> bool:
+        if self.is_leader():
+            return True
+        file = open(self.path, "a+")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+
+        # ロックを持ち続けるため、ファイルは閉じずに保持します
+        self._file = file
+        file.seek(0)
+        file.truncate()
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        self.elected.set()
+        logger.info(f"elected as leader (pid {os.getpid()})")
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("leader callback failed")
+        return True
+
+    def _campaign(self):
+        while not self._stopped.is_set() and not self.try_acquire():
+            self._stopped.wait(self.retry_interval)
+
+    def start(self):
+        threading.Thread(target=self._campaign, name="leader", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+            self.elected.clear()
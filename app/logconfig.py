@@ -0,0 +1,220 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+
+# ログの設定。ハンドラーのスレッドではレコードをキューに積むだけにして、
+# 整形（JSON 化・マスク・切り詰め）と書き出しは QueueListener のスレッドで行います
+
+# マスクするトークン（Slack / Dify の Bearer）
+TOKEN_PATTERN = re.compile(r"(xox[abposr]-[\w-]+|xapp-[\w-]+|Bearer\s+[\w.-]+)")
+
+# 値を文字数だけに置き換えるキー（メッセージ本文や入力内容）
+TEXT_KEYS = frozenset(
+    {
+        "text",
+        "value",
+        "initial_value",
+        "prompt",
+        "chat_history",
+        "created_message",
+        "input",
+        "preview",
+    }
+)
+
+# LogRecord の標準の属性（これ以外は extra として出力します）
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_settings = {
+    "redact": True,
+    "body_sample_rate": 0.0,
+    "body_max_chars": 2000,
+    "debug_payloads": False,
+}
+
+_listener = None
+
+
+def redact(value):
+    # トークンを伏せ、本文は文字数だけを残します
+    if not _settings["redact"]:
+        return value
+    if isinstance(value, dict):
+        return {
+            key: f"<{len(inner)} chars>"
+            if key in TEXT_KEYS and isinstance(inner, str)
+            else redact(inner)
+            for key, inner in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(inner) for inner in value]
+    if isinstance(value, str):
+        return TOKEN_PATTERN.sub("<token>", value)
+    return value
+
+
+def _truncate(text: str) -> str:
+    limit = _settings["body_max_chars"]
+    if limit and len(text) > limit:
+        return f"{text[:limit]}…(+{len(text) - limit} chars)"
+    return text
+
+
+def summarize(body: dict) -> dict:
+    # ペイロードから調査に必要な ID だけを取り出します（ハンドラーのスレッドでも安く済む範囲）
+    event = body.get("event") or {}
+    view = body.get("view") or {}
+    user = body.get("user")
+    summary = {
+        "type": body.get("type") or ("slash_command" if "command" in body else None),
+        "event_id": body.get("event_id"),
+        "event": event.get("type"),
+        "subtype": event.get("subtype"),
+        "command": body.get("command"),
+        "callback_id": body.get("callback_id") or view.get("callback_id"),
+        "view_id": view.get("id"),
+        "actions": [a.get("action_id") for a in body.get("actions") or []] or None,
+        "user": (user.get("id") if isinstance(user, dict) else user)
+        or body.get("user_id")
+        or event.get("user"),
+        "channel": event.get("channel") or body.get("channel_id"),
+    }
+    return {key: value for key, value in summary.items() if value is not None}
+
+
+def log_body(logger: logging.Logger, body: dict, message: str = "slack request"):
+    # 受信したペイロードを記録します。通常は要約だけで、本文は LOG_BODY_SAMPLE_RATE の割合で残します
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    extra = {"slack": summarize(body)}
+    rate = _settings["body_sample_rate"]
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        extra["body"] = body
+    logger.info(message, extra=extra)
+
+
+def log_payload(logger: logging.Logger, message: str, payload):
+    # 組み立てた blocks やタスク一覧などの確認用。整形して出すのは LOG_DEBUG_PAYLOADS のときだけです
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if _settings["debug_payloads"]:
+        pretty = json.dumps(redact(payload), indent=2, ensure_ascii=False)
+        logger.debug(f"{message}\n{pretty}")
+    else:
+        logger.debug(message, extra={"body": payload})
+
+
+def _extras(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": TOKEN_PATTERN.sub("<token>", _truncate(record.getMessage()))
+            if _settings["redact"]
+            else _truncate(record.getMessage()),
+        }
+        for key, value in _extras(record).items():
+            value = redact(value)
+            if key == "body":
+                # 長すぎる本文だけ文字列にして切り詰めます
+                text = json.dumps(value, ensure_ascii=False, default=str)
+                if len(text) > _settings["body_max_chars"] > 0:
+                    value = _truncate(text)
+            data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extras = _extras(record)
+        if extras:
+            body = redact(extras)
+            text += " " + _truncate(json.dumps(body, ensure_ascii=False, default=str))
+        return TOKEN_PATTERN.sub("<token>", text) if _settings["redact"] else text
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # 標準の QueueHandler は積む前にメッセージを整形するので、それをリスナー側に回します
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+def stop_logging():
+    # キューに残ったレコードを書き出してリスナーを止めます
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def _levels_from_env() -> dict:
+    # 例: LOG_LEVELS=slack_bolt=WARNING,dify=DEBUG
+    levels = {}
+    for item in os.environ.get("LOG_LEVELS", "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    # ルートロガーを非同期の書き出しに差し替えます。キューに残ったレコードは終了時に書き出します
+    _settings.update(
+        redact=os.environ.get("LOG_REDACT", "true").lower() in ("1", "true", "yes"),
+        body_sample_rate=float(os.environ.get("LOG_BODY_SAMPLE_RATE", "0")),
+        body_max_chars=int(os.environ.get("LOG_BODY_MAX_CHARS", "2000")),
+        debug_payloads=os.environ.get("LOG_DEBUG_PAYLOADS", "false").lower()
+        in ("1", "true", "yes"),
+    )
+
+    output = logging.StreamHandler(sys.stderr)
+    if os.environ.get("LOG_FORMAT", "json") == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(TextFormatter())
+
+    # 設定し直すときは前のリスナーに残ったレコードを書き出してから切り替えます
+    stop_logging()
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, output, respect_handler_level=True
+    )
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    for name, level in _levels_from_env().items():
+        logging.getLogger(name).setLevel(level)
+    return _listener
@@ -1,22 +1,204 @@
+# 起動時間の計測の起点にするため、最初に import します
+from startup import startup
+
 import datetime
-import json
 import logging
 import os
-import time
+import threading
 import zoneinfo
 
-import dateparser
-import requests
-from slack_bolt import Ack, App, logger
+from slack_bolt import Ack, App, BoltContext, logger
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from slack_bolt.response import BoltResponse
 from slack_sdk import WebClient
 from slack_sdk.web.slack_response import SlackResponse
 
-# デバッグレベルのログを有効化
-logging.basicConfig(level=logging.DEBUG)
+from cache import ResponseCache
+from config import Config
+from debounce import Debouncer, combine_text
+from dates import DateNormalizer
+from dedup import Deduplicator
+from dify import DifyClient
+from directory import Directory
+from filters import MessageFilter
+from history import HistoryCache
+from images import ImagePool, parse_image
+from jobs import JobKind, JobQueue
+from leader import LeaderLock
+from logconfig import configure_logging, log_body, log_payload
+from prefetch import PrefetchStore, prefetch_enabled
+from ratelimit import RateLimitedWebClient
+from reminders import (
+    ReminderScheduler,
+    build_reminders,
+    format_reminders,
+    parse_command,
+)
+from retrieval import HistoryReader
+from serializer import TASKS_HISTORY_BUDGET_CHARS, serialize_history
+from singleflight import SingleFlight
+from streaming import stream_to_ephemeral, stream_to_message, streaming_enabled
+from tasks import TaskStore, serialize_tasks
+from tracing import request_kind, tracer
+from views import (
+    APP1_SHORTCUT_ID,
+    APP1_CALLBACK_ID,
+    APP1_MODAL1_BLOCK1_ID,
+    APP1_MODAL1_BLOCK1_ACTIONID,
+    APP1_MODAL1_BLOCK2_ACTIONID,
+    APP1_MODAL1_BLOCK3_ID,
+    APP1_MODAL1_BLOCK3_ACTIONID,
+    APP1_MODAL1_BLOCK4_ID,
+    APP1_MODAL1_BLOCK4_ACTIONID,
+    APP1_MODAL1_BLOCK5_ID,
+    APP1_MODAL1_BLOCK5_ACTIONID,
+    APP2_SHORTCUT_ID,
+    APP2_CALLBACK_ID,
+    APP2_MODAL1_BLOCK1_ACTIONID,
+    app1_create_view,
+    app1_message_blocks,
+    app2_create_view,
+)
+from workers import WorkerPool
+
+startup.mark("imports")
+
+# ログはキュー経由で別スレッドから書き出します（レベルや形式は LOG_* で指定します）
+configure_logging()
+
+# Slack / Dify のトークンと接続先は起動時に 1 回だけ読み込んで検証します（不備があれば ConfigError）
+config = Config.from_env()
+startup.mark("config")
+
+# Slack API はレート制限を考慮したクライアント経由で呼び出します
+# SLACK_API_URL で接続先を差し替えられます（負荷試験でローカルの偽サーバーを使うときなど）
+slack_client = RateLimitedWebClient(
+    token=config.slack_bot_token,
+    base_url=config.slack_api_url or WebClient.BASE_URL,
+)
+
+# ボットトークンを渡してアプリを初期化します（ここで auth.test を呼び出します）
+app = App(client=slack_client)
+startup.mark("auth")
+
+# 処理済みのイベント・操作の記録（Slack からの再送を捨てます）
+dedup = Deduplicator.from_env()
+
+
+@app.middleware
+def drop_redeliveries(body, next, logger):
+    # 再送されたリクエストは ack だけ返し、Dify や Slack を呼ぶ前に捨てます
+    if dedup is not None and dedup.is_duplicate(body):
+        logger.info(f"dropped redelivered request: {body.get('type')}")
+        return BoltResponse(status=200, body="")
+    next()
+
+
+@app.middleware
+def trace_ack(body, context, next):
+    # ack() が呼ばれるまでの時間を記録します
+    if tracer.enabled:
+        context["ack"] = tracer.timed_ack(request_kind(body))
+    next()
+
+
+@app.middleware
+def use_rate_limited_client(context, next):
+    # Bolt はリクエストごとに WebClient を作り直すので、共有のクライアントに差し替えます
+    context["client"] = slack_client
+    next()
+
+
+# Dify クライアント（全ハンドラーでコネクションプールを共有します）
+dify = DifyClient.from_env(
+    config,
+    cache=ResponseCache.from_env(),
+    singleflight=SingleFlight.from_env(),
+)
+
+# チャンネルごとの会話履歴キャッシュ（message イベントで差分更新します）
+history_cache = HistoryCache.from_env()
+
+# 長い履歴をページ単位で読み込みます（タスク抽出でスレッドの返信を含めて読むときに使います）
+history_reader = HistoryReader.from_env()
+
+# ユーザー・チャンネルの ID と名前の対応表（起動時に一括読み込みし、イベントで更新します）
+directory = Directory()
+
+# タスクの期限の解釈（dateparser は Slack への接続後にバックグラウンドで準備します）
+date_normalizer = DateNormalizer.from_env()
+
+# 応答しない message イベント（ボットの投稿・編集など）を弾くルール
+message_filter = MessageFilter.from_env(channel_name=directory.channel_name)
+
+# タスク抽出の対象チャンネル / やわらかコミュニケーターの既定の送信先（名前でも ID でも可）
+TASKS_CHANNEL = config.tasks_channel
+APP1_DEFAULT_RECIPIENT = config.app1_default_recipient
+TASKS_CHANNEL_NOT_FOUND_TEXT = (
+    f"タスクを取得できませんでした。チャンネル「{TASKS_CHANNEL}」が見つかりません。"
+    "ボットがチャンネルに参加しているか確認してください🙏"
+)
+
+# 抽出したタスク一覧と、最後に抽出したメッセージの位置（モーダルはここから表示し、差分だけ Dify に渡します）
+task_store = TaskStore.from_env()
+
+# ack() 後の Dify 呼び出しはジョブキューのワーカーで処理します
+jobs = JobQueue.from_env()
+
+# タスク管理モーダルを開いた時点での先読み結果（APP2_PREFETCH=true のとき）
+prefetch = PrefetchStore.from_env()
+PREFETCH_WAIT = config.prefetch_wait
+
+# 生成済み画像のストック（モーダルを開いた時点で補充を始めます）
+image_pool = ImagePool.from_env()
+
+# 複数ワーカーで動かすとき、定期実行の処理を担当するワーカーを 1 つに決めます
+leader = LeaderLock.from_env()
+
+
+def send_reminder(reminder):
+    slack_client.chat_postMessage(channel=reminder.user, text=reminder.text)
+
+
+# リマインダー（SQLite に保存し、リーダーのワーカーがまとめて送信します）
+reminders = ReminderScheduler.from_env(send=send_reminder)
+
+# 同じチャンネル・スレッドに続けて届いたメッセージをまとめて 1 回で返信します（MESSAGE_DEBOUNCE_WINDOW）
+debouncer = Debouncer.from_env(on_flush=lambda batch: flush_messages(batch))
+
+# 各部品の統計を /metrics で公開します（METRICS_PORT を設定したとき）
+tracer.register("jobs", jobs.stats, label="kind")
+tracer.register("dify", dify.stats)
+tracer.register("slack_api", slack_client.dispatcher.stats, label="method")
+tracer.register("history_cache", history_cache.stats)
+tracer.register("history_reader", history_reader.stats)
+tracer.register("message_filter", message_filter.stats)
+tracer.register("prefetch", prefetch.stats)
+tracer.register("image_pool", image_pool.stats)
+tracer.register("dates", date_normalizer.stats)
+tracer.register("tasks", task_store.stats)
+tracer.register("reminders", reminders.stats)
+if dify.cache is not None:
+    tracer.register("dify_cache", dify.cache.stats)
+if dify.singleflight is not None:
+    tracer.register("dify_singleflight", dify.singleflight.stats)
+if dedup is not None:
+    tracer.register("dedup", dedup.stats)
+if debouncer is not None:
+    tracer.register("message_debounce", debouncer.stats)
+tracer.register("startup", startup.stats)
+
+startup.mark("init")
 
-# ボットトークンを渡してアプリを初期化します
-app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
+# ジョブキューが一杯のときに返すメッセージ
+BUSY_TEXT = "ただいま混み合っています。少し時間をおいてもう一度お試しください🙏"
+
+
+def notify_busy(client: WebClient, user_id: str, channel_id: str = None):
+    if channel_id:
+        client.chat_postEphemeral(channel=channel_id, user=user_id, text=BUSY_TEXT)
+    else:
+        client.chat_postMessage(channel=user_id, text=BUSY_TEXT)
 
 
 # 'こんにちは' を含むメッセージをリッスンします
@@ -60,46 +242,44 @@ app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
 def handle_command_test(ack: Ack, body: dict, client: WebClient, logger: logger, say):
 
     ack()
-    logger.info(body)
+    log_body(logger, body)
     pass
 
 
 @app.command("/yaruki")
-def handle_command_yaruki(ack: Ack, body: dict, client: WebClient, logger: logger, say):
+def handle_command_yaruki(
+    ack: Ack, body: dict, client: WebClient, logger: logger, say, respond
+):
 
     ack()
-    logger.info(body)
+    log_body(logger, body)
 
-    text = body["text"]
+    if not jobs.submit(JobKind.CHAT, run_yaruki, body, client, respond):
+        notify_busy(client, body["user_id"], body["channel_id"])
 
-    channel_id = body["channel_id"]
-    history = client.conversations_history(channel=channel_id, limit=20)
-    messages = history["messages"]
 
-    messages = sorted(messages, key=lambda x: x["ts"], reverse=False)
+def run_yaruki(body: dict, client: WebClient, respond):
+
+    text = body["text"]
 
-    for m in messages:
-        if "blocks" in m:
-            del m["blocks"]
+    channel_id = body["channel_id"]
+    messages = history_cache.get(client, channel_id, limit=20)
 
     dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
     now = dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
 
-    response = requests.post(
-        DIFY_API_APP_URL,
-        headers={"Authorization": f"Bearer {DIFY_API_APP4_TOKEN}"},
-        json={
-            "inputs": {
-                "chat_history": json.dumps(messages, ensure_ascii=False),
-                "today": now,
-                "prompt": text,
-            },
-            "response_mode": "blocking",
-            "user": DIFY_API_TOKEN_USER,
-        },
-    )
+    inputs = {
+        "chat_history": serialize_history(messages, names=directory.user_name),
+        "today": now,
+        "prompt": text,
+    }
+
+    # ストリーミングモードでは生成途中の文章を順次表示します
+    if streaming_enabled():
+        stream_to_ephemeral(respond, dify.stream("APP4", inputs))
+        return
 
-    response_json = response.json()
+    response_json = dify.run("APP4", inputs)
     output = response_json["data"]["outputs"]["text"]
 
     client.chat_postEphemeral(
@@ -111,280 +291,88 @@ def handle_command_yaruki(ack: Ack, body: dict, client: WebClient, logger: logge
 
 @app.command("/yaruki_reminder")
 def handle_command_yaruki_reminder(
-    ack: Ack, body: dict, client: WebClient, logger: logger, say
+    ack: Ack,
+    body: dict,
+    client: WebClient,
+    context: BoltContext,
+    logger: logger,
+    respond,
 ):
     ack()
-    logger.info(body)
-
-    text = body["text"]
-
-    channel_id = body["channel_id"]
-    history = client.conversations_history(channel=channel_id, limit=20)
-    messages = history["messages"]
-
-    messages = sorted(messages, key=lambda x: x["ts"], reverse=False)
-
-    for m in messages:
-        if "blocks" in m:
-            del m["blocks"]
-
-    dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
-    now = dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
-
-    client.chat_scheduleMessage(
-        channel=body["user_id"],
-        text="議事録の修正終わった？🍔",
-        post_at=int(time.time()) + 30,
+    log_body(logger, body)
+
+    # ジョブを使わずにその場で処理するので、ハンドラー全体をスパンで記録します
+    with tracer.span("handler", fn="handle_command_yaruki_reminder"):
+        text = run_reminder_command(body, client, context.bot_user_id)
+        respond(text=text, response_type="ephemeral")
+
+
+def run_reminder_command(body: dict, client: WebClient, bot_user_id: str) -> str:
+    command = parse_command(body["text"], parse_date=date_normalizer.parse)
+    user_id = body["user_id"]
+
+    if command["action"] == "list":
+        return format_reminders(reminders.list(user_id))
+    if command["action"] == "cancel":
+        cancelled = reminders.cancel(command["ids"], user_id)
+        return f"{len(cancelled)} 件のリマインダーを取り消しました"
+
+    # チャンネルを指定したらメンバー全員に送ります。宛先がなければ自分に送ります
+    # メンバーのうちボットと削除済みのユーザー、このアプリ自身（auth.test の user_id）には送りません
+    users = list(command["users"])
+    for channel in command["channels"]:
+        members = directory.channel_members(client, channel)
+        users.extend(directory.people(members, exclude=[bot_user_id]))
+    if not command["users"] and not command["channels"]:
+        users.append(user_id)
+
+    batch = build_reminders(
+        users, command["text"], command["delay"], command["interval"], user_id
     )
+    reminders.schedule(batch)
+    return f"{len(batch)} 人にリマインダーを登録しました"
 
 
-### ショートカットアプリ１
-APP1_SHORTCUT_ID = "test_shortcut1"
-APP1_CALLBACK_ID = "APP_1_CALLBACK_ID"
-APP1_MODAL1_BLOCK1_ID = "APP1_MODAL1_BLOCK1_ID"
-APP1_MODAL1_BLOCK1_ACTIONID = "APP1_MODAL1_BLOCK1_ID"
-APP1_MODAL1_BLOCK2_ID = "APP1_MODAL1_BLOCK2_ID"
-APP1_MODAL1_BLOCK2_ACTIONID = "APP1_MODAL1_BLOCK2_ACTIONID"
-APP1_MODAL1_BLOCK3_ID = "APP1_MODAL1_BLOCK3_ID"
-APP1_MODAL1_BLOCK3_ACTIONID = "APP1_MODAL1_BLOCK3_ACTIONID"
-APP1_MODAL1_BLOCK4_ID = "APP1_MODAL1_BLOCK4_ID"
-APP1_MODAL1_BLOCK4_ACTIONID = "APP1_MODAL1_BLOCK4_ACTIONID"
-APP1_MODAL1_BLOCK5_ID = "APP1_MODAL1_BLOCK5_ID"
-APP1_MODAL1_BLOCK5_ACTIONID = "APP1_MODAL1_BLOCK5_ACTIONID"
-
-DIFY_API_APP1_TOKEN = os.environ.get("DIFY_API_APP1_TOKEN")
-DIFY_API_APP2_TOKEN = os.environ.get("DIFY_API_APP2_TOKEN")
-DIFY_API_TOKEN_USER = os.environ.get("DIFY_API_TOKEN_USER")
-DIFY_API_APP_URL = os.environ.get("DIFY_API_APP_URL")
-
-### ショートカットアプリ２
-APP2_SHORTCUT_ID = "task_manager_001"
-DIFY_API_APP3_TOKEN = os.environ.get("DIFY_API_APP3_TOKEN")
-APP2_CALLBACK_ID = "APP2_CALLBACK_ID"
-APP2_MODAL1_BLOCK1_ID = "APP2_MODAL1_BLOCK1_ID"
-APP2_MODAL1_BLOCK1_ACTIONID = "APP2_MODAL1_BLOCK1_ACTIONID"
-APP2_MODAL1_BLOCK2_ID = "APP2_MODAL1_BLOCK2_ID"
-APP2_MODAL1_BLOCK2_ACTIONID = "APP2_MODAL1_BLOCK2_ACTIONID"
-APP2_MODAL1_BLOCK3_ID = "APP2_MODAL1_BLOCK3_ID"
-APP2_MODAL1_BLOCK3_ACTIONID = "APP2_MODAL1_BLOCK3_ACTIONID"
-APP2_MODAL1_BLOCK4_ID = "APP2_MODAL1_BLOCK4_ID"
-APP2_MODAL1_BLOCK4_ACTIONID = "APP2_MODAL1_BLOCK4_ACTIONID"
-
-### コマンドアプリ
-DIFY_API_APP4_TOKEN = os.environ.get("DIFY_API_APP4_TOKEN")
-
-
-## ショートカットアプリ２
-APP3_SHORTCUT_ID = "test_shortcut3"
-APP3_CALLBACK_ID = "APP_3_CALLBACK_ID"
-
-
-def app1_create_view(
-    callback_id: str,
-    message: str = None,
-    created_message: str = None,
-    references: dict = None,
-):
-
-    block_1 = {
-        "type": "input",
-        "block_id": APP1_MODAL1_BLOCK1_ID,
-        "element": {
-            "type": "plain_text_input",
-            "action_id": APP1_MODAL1_BLOCK1_ACTIONID,
-            "multiline": True,
-        },
-        "label": {"type": "plain_text", "text": "送りたい内容"},
-    }
-    if message:
-        block_1["element"]["initial_value"] = message
-
-    block_2 = {
-        "type": "actions",
-        "elements": [
-            {
-                "type": "button",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"やわらかくする",
-                },
-                "value": "click_me_123",
-                "action_id": APP1_MODAL1_BLOCK2_ACTIONID,
-            }
-        ],
-    }
-
-    blocks = [block_1, block_2]
-
-    if created_message:
-        block_3 = {
-            "type": "input",
-            "block_id": APP1_MODAL1_BLOCK3_ID,
-            "element": {
-                "type": "plain_text_input",
-                "action_id": APP1_MODAL1_BLOCK3_ACTIONID,
-                "multiline": True,
-                "initial_value": created_message,
-            },
-            "label": {"type": "plain_text", "text": "やわらか"},
-        }
-
-        blocks.append(block_3)
-
-        block_4 = {
-            "type": "section",
-            "block_id": APP1_MODAL1_BLOCK4_ID,
-            "text": {"type": "mrkdwn", "text": "送信先を選択"},
-            "accessory": {
-                "type": "users_select",
-                "action_id": APP1_MODAL1_BLOCK4_ACTIONID,
-                "placeholder": {
-                    "type": "plain_text",
-                    "text": "Select a user",
-                    "emoji": True,
-                },
-                "initial_user": "U07RNU50QKW",
-            },
-        }
-
-        blocks.append(block_4)
-
-        if references:
-            block_5 = {
-                "type": "section",
-                "block_id": APP1_MODAL1_BLOCK5_ID,
-                "text": {"type": "mrkdwn", "text": "関連ドキュメントを選択（任意）"},
-                "accessory": {
-                    "type": "checkboxes",
-                    "action_id": APP1_MODAL1_BLOCK5_ACTIONID,
-                    "options": [
-                        {
-                            "text": {
-                                "type": "mrkdwn",
-                                "text": f"{ref['document_name']}",
-                            },
-                            "description": {
-                                "type": "mrkdwn",
-                                "text": f"{ref['content']}",
-                            },
-                            "value": f"{ref['segment_id']}",
-                        }
-                        for ref in references
-                    ],
-                },
-            }
-            blocks.append(block_5)
-
-    return {
-        "type": "modal",
-        "callback_id": callback_id,
-        "title": {"type": "plain_text", "text": "やわらかコミュニケーター"},
-        "submit": {"type": "plain_text", "text": "送信"},
-        "close": {"type": "plain_text", "text": "閉じる"},
-        "blocks": blocks,
-    }
-
-
-# チャンネル名 : channel_id
-channel_list = {"user1-bot": "C07S4DSDMBQ"}
-
-
-def app2_create_view(callback_id: str, task_list: list = None):
+@app.shortcut(APP2_SHORTCUT_ID)
+def handle_shortcuts_app2(ack: Ack, body: dict, client: WebClient, logger: logger):
 
-    blocks = []
+    log_body(logger, body)
+    ack()
 
-    block_1 = {
-        "type": "actions",
-        "block_id": APP2_MODAL1_BLOCK1_ID,
-        "elements": [
-            {
-                "type": "button",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"タスク取得",
-                },
-                "value": "click_me_123",
-                "action_id": APP2_MODAL1_BLOCK1_ACTIONID,
-            }
-        ],
-    }
+    with tracer.span("handler", fn="handle_shortcuts_app2"):
+        # views.open という API を呼び出すことでモーダルを開きます
+        response = client.views_open(
+            trigger_id=body["trigger_id"],
+            view=app2_create_view(APP2_CALLBACK_ID, task_list=stored_task_list()),
+        )
 
-    blocks.append(block_1)
+        # ボタンが押される前にタスク抽出を始めておきます
+        if prefetch_enabled():
+            view_id = response["view"]["id"]
+            future = prefetch.start(view_id)
+            if not jobs.submit(JobKind.TASKS, run_prefetch, future, client, logger):
+                prefetch.cancel(view_id)
 
-    if task_list:
 
-        task_str = [
-            f"{task['term']} {task['description']} {task['status']}"
-            for task in task_list
-        ]
-        task_str = "\n".join(task_str)
+def stored_task_list() -> list:
+    # 保存済みのタスク一覧（Dify を待たずにモーダルへ表示します）
+    channel_id = directory.resolve_channel(TASKS_CHANNEL)
+    return task_store.list(channel_id) if channel_id else []
 
-        block_2 = {
-            "type": "input",
-            "block_id": APP2_MODAL1_BLOCK2_ID,
-            "element": {
-                "type": "plain_text_input",
-                "action_id": APP2_MODAL1_BLOCK2_ACTIONID,
-                "multiline": True,
-                "initial_value": task_str,
-            },
-            "label": {"type": "plain_text", "text": "タスク"},
-        }
-
-        blocks.append(block_2)
-
-        block_3 = {
-            "type": "input",
-            "block_id": APP2_MODAL1_BLOCK3_ID,
-            "element": {
-                "type": "plain_text_input",
-                "action_id": APP2_MODAL1_BLOCK3_ACTIONID,
-                "multiline": True,
-            },
-            "label": {"type": "plain_text", "text": "変更ある？？"},
-        }
-
-        blocks.append(block_3)
-
-        block_4 = {
-            "type": "actions",
-            "block_id": APP2_MODAL1_BLOCK4_ID,
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": f"お願い！",
-                    },
-                    "value": "click_me_123",
-                    "action_id": APP2_MODAL1_BLOCK4_ACTIONID,
-                }
-            ],
-        }
-
-        blocks.append(block_4)
-
-    return {
-        "type": "modal",
-        "callback_id": callback_id,
-        "title": {"type": "plain_text", "text": "モーダル"},
-        "submit": {"type": "plain_text", "text": "送信"},
-        "close": {"type": "plain_text", "text": "閉じる"},
-        "blocks": blocks,
-    }
 
+def run_prefetch(future, client: WebClient, logger: logging.Logger):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(fetch_task_list(client, logger))
+    except Exception as e:
+        future.set_exception(e)
 
-@app.shortcut(APP2_SHORTCUT_ID)
-def handle_shortcuts_app2(ack: Ack, body: dict, client: WebClient, logger: logger):
 
-    logger.info(body)
+@app.view_closed(APP2_CALLBACK_ID)
+def handle_view_closed_app2(ack: Ack, body: dict):
     ack()
-
-    # views.open という API を呼び出すことでモーダルを開きます
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        view=app2_create_view(APP2_CALLBACK_ID),
-    )
+    prefetch.cancel(body["view"]["id"])
 
 
 @app.action(APP2_MODAL1_BLOCK1_ACTIONID)
@@ -392,40 +380,94 @@ def handle_action_app2_modal1_block1(
     ack: Ack, body: dict, client: WebClient, logger: logger
 ):
     ack()
-    logger.info(body)
+    log_body(logger, body)
+
+    if not jobs.submit(JobKind.TASKS, run_app2_tasks, body, client, logger):
+        notify_busy(client, body["user"]["id"])
+
+
+def fetch_task_list(client: WebClient, logger: logging.Logger):
+
+    # 起動時のユーザー・チャンネル一覧の読み込みが終わっていなければ、ここで読み込んでから引きます
+    channel_id = directory.find_channel(client, TASKS_CHANNEL)
+    if channel_id is None:
+        logger.error(f"channel not found: {TASKS_CHANNEL}")
+        return None
+
+    # 前回の抽出以降のメッセージ（スレッドの返信を含む）と保存済みのタスク一覧だけを Dify に渡して、
+    # 差分で更新します。初回は予算に収まるまでさかのぼって読み、2 回目からは前回の続きから古い順に読みます
+    # （予算で止めた先は、次回の差分で読みます）
+    # 履歴キャッシュで新着がないと分かれば、Slack の履歴も Dify も呼びません
+    # 前回より前に始まったスレッドへの新しい返信は、履歴キャッシュが覚えているスレッドから読み直します
+    cursor = task_store.cursor(channel_id) if task_store.incremental else None
+    messages = []
+    if cursor is None or history_cache.has_newer(client, channel_id, cursor):
+        active_threads = (
+            history_cache.active_threads(channel_id, cursor) if cursor else ()
+        )
+        messages = history_reader.collect(
+            client,
+            channel_id,
+            budget_chars=TASKS_HISTORY_BUDGET_CHARS,
+            names=directory.user_name,
+            oldest=cursor,
+            threads=True,
+            active_threads=active_threads,
+        )
+        # 読んだ直近のメッセージで履歴キャッシュを温めて、次回の has_newer で Slack を呼ばずに済ませます
+        history_cache.prime(channel_id, messages)
+    last_ts, current, messages = task_store.pending(channel_id, messages)
+    if not messages:
+        return task_store.list(channel_id)
 
-    channel_id = channel_list["user1-bot"]
-    history = client.conversations_history(channel=channel_id, limit=100)
-    messages = history["messages"]
+    dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
+    now = dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
 
-    messages = sorted(messages, key=lambda x: x["ts"], reverse=False)
+    inputs = {
+        "chat_history": serialize_history(
+            messages,
+            names=directory.user_name,
+            budget_chars=TASKS_HISTORY_BUDGET_CHARS,
+        ),
+        "date": now,
+    }
+    if task_store.incremental:
+        inputs["task_list"] = serialize_tasks(current)
 
-    for m in messages:
-        if "blocks" in m:
-            del m["blocks"]
+    response_json = dify.run("APP3", inputs)
+    task_list = response_json["data"]["outputs"]["task_list"]
+    if not isinstance(task_list, list):
+        log_payload(logger, "task list", task_list)
+        return task_list
 
-    # logger.info(json.dumps(messages, indent=2, ensure_ascii=False))
+    task_list = date_normalizer.normalize_tasks(task_list)
+    stored = task_store.replace(channel_id, task_list, messages[-1]["ts"], last_ts)
+    if stored is None:
+        # 別のワーカーが先に更新していたか、空の一覧で消すのを断ったら、保存済みの一覧を使います
+        stored = task_store.list(channel_id)
 
-    dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
-    now = dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
+    log_payload(logger, "task list", stored)
 
-    response = requests.post(
-        DIFY_API_APP_URL,
-        headers={"Authorization": f"Bearer {DIFY_API_APP3_TOKEN}"},
-        json={
-            "inputs": {
-                "chat_history": json.dumps(messages, ensure_ascii=False),
-                "date": now,
-            },
-            "response_mode": "blocking",
-            "user": DIFY_API_TOKEN_USER,
-        },
-    )
+    return stored
 
-    response_json = response.json()
-    task_list = response_json["data"]["outputs"]["task_list"]
 
-    logger.info(json.dumps(task_list, indent=2, ensure_ascii=False))
+def run_app2_tasks(body: dict, client: WebClient, logger: logging.Logger):
+
+    # 先読み済みならその結果を使います
+    task_list = None
+    try:
+        task_list = prefetch.get(body["view"]["id"], timeout=PREFETCH_WAIT)
+    except Exception:
+        logger.exception("prefetched task list is not available")
+
+    if task_list is None:
+        task_list = fetch_task_list(client, logger)
+    if task_list is None:
+        # 対象のチャンネルが見つからなければ、押した人に知らせます
+        client.chat_postMessage(
+            channel=body["user"]["id"], text=TASKS_CHANNEL_NOT_FOUND_TEXT
+        )
+        return
 
     client.views_update(
         view_id=body.get("view").get("id"),
@@ -436,19 +478,35 @@ def handle_action_app2_modal1_block1(
         ),
     )
 
-    pass
-
 
 @app.shortcut(APP1_SHORTCUT_ID)
 def handle_shortcuts_app1(ack: Ack, body: dict, client: WebClient):
 
     ack()
 
-    # views.open という API を呼び出すことでモーダルを開きます
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        view=app1_create_view(APP1_CALLBACK_ID),
-    )
+    with tracer.span("handler", fn="handle_shortcuts_app1"):
+        # views.open という API を呼び出すことでモーダルを開きます
+        client.views_open(
+            trigger_id=body["trigger_id"],
+            view=app1_create_view(APP1_CALLBACK_ID),
+        )
+
+
+def refill_image_pool():
+    # ストックは起動時に 1 度満たし、以降はストックから使った分だけ補充します
+    # （モーダルを開いただけでは生成しません）
+    for _ in range(image_pool.reserve()):
+        if not jobs.submit(JobKind.IMAGE, generate_pool_image):
+            image_pool.cancel()
+
+
+def generate_pool_image():
+    try:
+        image = parse_image(dify.run("APP2", {}, response_mode=None))
+    except Exception:
+        image_pool.cancel()
+        raise
+    image_pool.fill(image)
 
 
 @app.action(APP1_MODAL1_BLOCK2_ACTIONID)
@@ -456,10 +514,16 @@ def handle_action_app1_modal1_block2(
     ack: Ack, body: dict, client: WebClient, logger: logger
 ):
 
-    logger.info(body)
+    log_body(logger, body)
 
     ack()
 
+    if not jobs.submit(JobKind.REWRITE, run_app1_rewrite, body, client):
+        notify_busy(client, body["user"]["id"])
+
+
+def run_app1_rewrite(body: dict, client: WebClient):
+
     view = body["view"]
     inputs = view["state"]["values"]
     message = (
@@ -468,20 +532,13 @@ def handle_action_app1_modal1_block2(
         .get("value")
     )
 
-    response = requests.post(
-        DIFY_API_APP_URL,
-        headers={"Authorization": f"Bearer {DIFY_API_APP1_TOKEN}"},
-        json={
-            "inputs": {
-                "input": message,
-                "role": "上司",
-            },
-            "response_mode": "blocking",
-            "user": DIFY_API_TOKEN_USER,
+    response_json = dify.run(
+        "APP1",
+        {
+            "input": message,
+            "role": "上司",
         },
     )
-
-    response_json = response.json()
     created_message = response_json["data"]["outputs"]["result"]
     knowledge = response_json["data"]["outputs"]["knowledge"]
 
@@ -504,6 +561,7 @@ def handle_action_app1_modal1_block2(
             message=message,
             created_message=created_message,
             references=references,
+            initial_user=directory.resolve_user(APP1_DEFAULT_RECIPIENT),
         ),
     )
 
@@ -515,7 +573,13 @@ def handle_view_app1_callback(
 
     ack()
 
-    logger.info(body)
+    log_body(logger, body)
+
+    if not jobs.submit(JobKind.DELIVER, run_app1_submit, body, client, logger):
+        notify_busy(client, body["user"]["id"])
+
+
+def run_app1_submit(body: dict, client: WebClient, logger: logging.Logger):
 
     user = body["user"]
     view = body["view"]
@@ -545,75 +609,30 @@ def handle_view_app1_callback(
         .get("selected_options")
     )
 
-    logger.debug(created_message)
-    logger.debug(selected_user)
-
-    ## 画像生成
-    response = requests.post(
-        DIFY_API_APP_URL,
-        headers={"Authorization": f"Bearer {DIFY_API_APP2_TOKEN}"},
-        json={"user": DIFY_API_TOKEN_USER, "inputs": {}},
-    )
-
-    response_json = response.json()
-    prompt = response_json["data"]["outputs"]["prompt"]
-    image_url = response_json["data"]["outputs"]["url"]
+    logger.debug(f"app1 submit to {selected_user}")
 
     url = os.environ.get(f"WEBHOOK_URL_{selected_user}", None)
 
     if url:
 
-        blocks = [
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"<@{selected_user}> さんへ <@{user['id']}> さんからメッセージが届いています。",
-                },
-            },
-            {"type": "divider"},
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"{created_message}",
-                },
-                "accessory": {
-                    "type": "image",
-                    "image_url": f"{image_url}",
-                    "alt_text": f"{prompt}",
-                },
-            },
-            {"type": "divider"},
-            {"type": "section", "text": {"type": "mrkdwn", "text": "関連ドキュメント"}},
-            {
-                "type": "rich_text",
-                "elements": [
-                    {
-                        "type": "rich_text_list",
-                        "style": "bullet",
-                        "elements": [
-                            {
-                                "type": "rich_text_section",
-                                "elements": [
-                                    {
-                                        "type": "text",
-                                        "text": f"{ref['text']['text']}:\n",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": f"{ref['description']['text']}:\n",
-                                    },
-                                ],
-                            }
-                            for ref in selected_references_options
-                        ],
-                    }
-                ],
-            },
-        ]
+        message_args = dict(
+            selected_user=selected_user,
+            sender_id=user["id"],
+            created_message=created_message,
+            selected_references_options=selected_references_options,
+        )
+
+        # ストックの画像があればそのまま使い、なければ先に本文だけ送って後から画像を追加します
+        image = image_pool.take()
+        if image:
+            refill_image_pool()
+            blocks = app1_message_blocks(
+                image_url=image["url"], prompt=image["prompt"], **message_args
+            )
+        else:
+            blocks = app1_message_blocks(**message_args)
 
-        logger.debug(json.dumps(blocks, indent=2, ensure_ascii=False))
+        log_payload(logger, "app1 message blocks", blocks)
 
         # response = requests.post(
         #     url,
@@ -622,54 +641,113 @@ def handle_view_app1_callback(
 
         # logger.debug(response.text)
 
-        client.chat_postMessage(channel=selected_user, blocks=blocks)
+        response = client.chat_postMessage(channel=selected_user, blocks=blocks)
+
+        if not image:
+            jobs.submit(
+                JobKind.IMAGE,
+                attach_image,
+                client,
+                response["channel"],
+                response["ts"],
+                message_args,
+            )
+
+
+def attach_image(client: WebClient, channel: str, ts: str, message_args: dict):
+    # 画像を生成して、送信済みのメッセージに追加します
+    image = image_pool.take()
+    if image:
+        refill_image_pool()
+    else:
+        image = parse_image(dify.run("APP2", {}, response_mode=None))
+    blocks = app1_message_blocks(
+        image_url=image["url"], prompt=image["prompt"], **message_args
+    )
+    client.chat_update(channel=channel, ts=ts, blocks=blocks)
+
 
+def filter_messages(event: dict, next):
+    # 履歴キャッシュには、応答しないメッセージ（ボットの投稿や編集など）も反映します
+    history_cache.feed(event)
+    if not message_filter.accept(event):
+        return BoltResponse(status=200, body="")
+    next()
 
-@app.event("message")
+
+@app.event("message", middleware=[filter_messages])
 def handle_message_events(
     ack: Ack, body: dict, logger: logging.Logger, client: WebClient
 ):
-    logger.info(body)
     ack()
+    log_body(logger, body)
 
     event = body["event"]
-    user = event["user"]
-    ts = event["ts"]
-    thread_ts = event.get("thread_ts", None)
-    text = event["text"]
 
-    logger.info(body)
+    # 続けて届いたメッセージはまとめてから返信します
+    if debouncer is not None:
+        debouncer.add(event)
+        return
+
+    if not jobs.submit(JobKind.CHAT, run_message_reply, [event], client):
+        notify_busy(client, event["user"], event["channel"])
+
+
+def flush_messages(batch):
+    event = batch.events[-1]
+    if not jobs.submit(JobKind.CHAT, run_batch_reply, batch, slack_client):
+        batch.claim()
+        notify_busy(slack_client, event["user"], event["channel"])
 
-    channel_id = event["channel"]
-    history = client.conversations_history(channel=channel_id, limit=10)
-    messages = history["messages"]
 
-    messages = sorted(messages, key=lambda x: x["ts"], reverse=False)
+def run_batch_reply(batch, client: WebClient):
+    # 返信に失敗しても、まとめたメッセージが次の返信に混ざらないよう手放します
+    try:
+        run_message_reply(batch.events, client, batch)
+    finally:
+        batch.release()
 
-    for m in messages:
-        if "blocks" in m:
-            del m["blocks"]
+
+def run_message_reply(events: list, client: WebClient, batch=None):
+
+    # まとめた後に新しいメッセージが来ていたら、それを含めたバッチの方で返信します
+    if batch is not None and not batch.is_current():
+        return
+
+    event = events[-1]
+    user = event["user"]
+    thread_ts = event.get("thread_ts", None)
+    text = combine_text(events)
+
+    channel_id = event["channel"]
+    messages = history_cache.get(client, channel_id, limit=10)
 
     dt_now = datetime.datetime.now(zoneinfo.ZoneInfo("Asia/Tokyo"))
     now = dt_now.strftime("%Y年%m月%d日 %H:%M:%S")
 
-    response = requests.post(
-        DIFY_API_APP_URL,
-        headers={"Authorization": f"Bearer {DIFY_API_APP4_TOKEN}"},
-        json={
-            "inputs": {
-                "chat_history": json.dumps(messages, ensure_ascii=False),
-                "today": now,
-                "prompt": text,
-            },
-            "response_mode": "blocking",
-            "user": DIFY_API_TOKEN_USER,
-        },
-    )
+    inputs = {
+        "chat_history": serialize_history(messages, names=directory.user_name),
+        "today": now,
+        "prompt": text,
+    }
 
-    response_json = response.json()
+    # ストリーミングモードでは生成途中の文章を順次表示します
+    # 表示を始めた後に届いたメッセージは、次のバッチとして別に返信します
+    if streaming_enabled():
+        if batch is not None and not batch.claim():
+            return
+        stream_to_message(
+            client, channel_id, dify.stream("APP4", inputs), thread_ts=thread_ts
+        )
+        return
+
+    response_json = dify.run("APP4", inputs)
     output = response_json["data"]["outputs"]["text"]
 
+    # 生成中に新しいメッセージが来ていたら、古い文脈の返信は投稿しません
+    if batch is not None and not batch.claim():
+        return
+
     client.chat_postMessage(
         channel=channel_id,
         thread_ts=thread_ts,
@@ -678,18 +756,60 @@ def handle_message_events(
     )
 
 
+@app.event("user_change")
+@app.event("team_join")
+def handle_user_events(ack: Ack, event: dict):
+    ack()
+    directory.on_user_event(event)
+
+
+@app.event("channel_rename")
+@app.event("channel_created")
+def handle_channel_events(ack: Ack, event: dict):
+    ack()
+    directory.on_channel_event(event)
+
+
 @app.action(APP1_MODAL1_BLOCK4_ACTIONID)
 def handle_action_app1_model1_block4(ack, body, logger):
     ack()
-    logger.info(body)
+    log_body(logger, body)
 
 
 @app.action(APP1_MODAL1_BLOCK5_ACTIONID)
 def handle_action_app1_model1_block5(ack, body, logger):
     ack()
-    logger.info(body)
+    log_body(logger, body)
 
 
-if __name__ == "__main__":
+def preload():
+    # 最初のリクエストで読み込むと遅い dateparser と requests を準備しておきます
+    date_normalizer.preload()
+    dify.preload()
+
+
+def start():
     # アプリを起動して、ソケットモードで Slack に接続します
-    SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
+    handler = SocketModeHandler(app, config.slack_app_token)
+    handler.connect()
+    startup.mark("connect")
+    startup.report()
+
+    # 接続を待たせないよう、ユーザー・チャンネル一覧の読み込みなどは接続後にバックグラウンドで行います
+    threading.Thread(
+        target=directory.load_with_retry, args=(app.client,), daemon=True
+    ).start()
+    threading.Thread(target=preload, daemon=True).start()
+    refill_image_pool()
+    leader.on_elected(reminders.start)
+    leader.start()
+    tracer.serve_from_env()
+
+    # 接続を保ったまま待ちます（SocketModeHandler.start() と同じです）
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    # SOCKET_MODE_WORKERS=N なら、このプロセスに加えて N-1 個のワーカープロセスから接続します
+    WorkerPool.from_env(__file__).start()
+    start()
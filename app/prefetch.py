@@ -0,0 +1,160 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import SQLiteCacheBackend
+from state import default_backend, state_path
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch_enabled() -> bool:
+    return os.environ.get("APP2_PREFETCH", "false").lower() in ("1", "true", "yes")
+
+
+class _Entry:
+    def __init__(self):
+        self.future = concurrent.futures.Future()
+        self.created_at = time.monotonic()
+        self.task = None  # 非同期ランタイムでの実行タスク
+
+
+class PrefetchStore:
+    # モーダルを開いた時点で先に Dify を呼び出し、結果を view_id ごとに保持します
+    # ボタンが押されたら結果を返すか、実行中ならその完了を待ちます
+    # shared を渡すと完了した結果を書き込み、別のワーカーがボタンを受け取っても使えるようにします
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 100, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "started": 0,
+            "hits": 0,
+            "waits": 0,
+            "misses": 0,
+            "cancelled": 0,
+            "expired": 0,
+            "shared_hits": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        shared = None
+        if (os.environ.get("APP2_PREFETCH_BACKEND") or default_backend()) == "sqlite":
+            # 先読み結果は Dify のレスポンスキャッシュと同じテーブル形式で保存します
+            shared = SQLiteCacheBackend(
+                os.environ.get("APP2_PREFETCH_PATH") or state_path("prefetch.sqlite3")
+            )
+        return cls(
+            ttl=float(os.environ.get("APP2_PREFETCH_TTL", "300")),
+            max_entries=int(os.environ.get("APP2_PREFETCH_MAX_ENTRIES", "100")),
+            shared=shared,
+        )
+
+    def _expire(self):
+        now = time.monotonic()
+        for view_id in list(self._entries):
+            if now - self._entries[view_id].created_at <= self.ttl:
+                break
+            self._drop(self._entries.pop(view_id))
+            self.stats["expired"] += 1
+        while len(self._entries) > self.max_entries:
+            self._drop(self._entries.popitem(last=False)[1])
+            self.stats["expired"] += 1
+
+    @staticmethod
+    def _drop(entry: _Entry):
+        entry.future.cancel()
+        if entry.task is not None:
+            entry.task.cancel()
+
+    def start(self, view_id: str) -> concurrent.futures.Future:
+        # 呼び出し側はこの Future に結果（または例外）を設定してください
+        with self._lock:
+            self._expire()
+            entry = self._entries[view_id] = _Entry()
+            self.stats["started"] += 1
+        if self.shared is not None:
+            entry.future.add_done_callback(lambda f: self._on_done(view_id, f))
+        return entry.future
+
+    def _on_done(self, view_id: str, future: concurrent.futures.Future):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._share(view_id, future)
+            return
+        # イベントループ上で完了したときは、SQLite への書き込みを別スレッドで行います
+        loop.run_in_executor(None, self._share, view_id, future)
+
+    def _share(self, view_id: str, future: concurrent.futures.Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            value = json.dumps(future.result(), ensure_ascii=False).encode()
+            self.shared.set(f"prefetch:{view_id}", value, self.ttl)
+        except Exception:
+            logger.exception("failed to share prefetched result")
+
+    def _shared_get(self, view_id: str):
+        # このワーカーに先読みがなければ、別のワーカーが保存した結果を探します
+        # 結果は 1 回しか使わないので、読んだら削除します
+        if self.shared is None:
+            return None
+        try:
+            value = self.shared.pop(f"prefetch:{view_id}")
+        except Exception:
+            logger.exception("failed to read shared prefetched result")
+            return None
+        if value is None:
+            return None
+        with self._lock:
+            self.stats["shared_hits"] += 1
+        return json.loads(value)
+
+    def attach_task(self, view_id: str, task: asyncio.Task):
+        with self._lock:
+            entry = self._entries.get(view_id)
+            if entry is not None:
+                entry.task = task
+
+    def _pop(self, view_id: str):
+        with self._lock:
+            self._expire()
+            entry = self._entries.pop(view_id, None)
+            # まだキューで待っている先読みは取り消して、呼び出し側で実行してもらいます
+            if entry is None or entry.future.cancel() or entry.future.cancelled():
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits" if entry.future.done() else "waits"] += 1
+            return entry
+
+    def get(self, view_id: str, timeout: float = None):
+        # 先読みがなければ None を返します。失敗していたら例外をそのまま送出します
+        entry = self._pop(view_id)
+        if entry is None:
+            return self._shared_get(view_id)
+        return entry.future.result(timeout)
+
+    async def aget(self, view_id: str, timeout: float = None):
+        entry = self._pop(view_id)
+        if entry is None:
+            return await asyncio.to_thread(self._shared_get, view_id)
+        return await asyncio.wait_for(asyncio.wrap_future(entry.future), timeout)
+
+    def cancel(self, view_id: str):
+        # view_closed などでモーダルが閉じられたら破棄します
+        with self._lock:
+            entry = self._entries.pop(view_id, None)
+            if entry is None:
+                return
+            self.stats["cancelled"] += 1
+        self._drop(entry)
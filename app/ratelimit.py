@@ -0,0 +1,407 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Slack Web API の tier ごとの上限（回/分）
+# https://api.slack.com/apis/rate-limits
+TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+
+# メソッドごとの tier（各メソッドのドキュメントの Rate limits に合わせます）
+# conversations.history / replies は社内アプリ（Marketplace 以外で配布しないアプリ）の tier です
+METHOD_TIERS = {
+    "auth.test": 4,
+    "chat.delete": 3,
+    "chat.postEphemeral": 4,
+    "chat.scheduleMessage": 3,
+    "chat.update": 3,
+    "conversations.history": 3,
+    "conversations.info": 3,
+    "conversations.list": 2,
+    "conversations.members": 4,
+    "conversations.replies": 3,
+    "users.conversations": 3,
+    "users.info": 4,
+    "users.list": 2,
+    "views.open": 4,
+    "views.push": 4,
+    "views.update": 4,
+}
+DEFAULT_TIER = 3
+
+# 1 分あたりの上限のうち、間隔を空けずに続けて呼んでよい割合
+# Slack は上限を 1 分単位で数え、短いバーストは許容するので、30 秒分までは待たずに通します
+# （小さくしすぎると、上限に遠く及ばない呼び出しまで待たされます）
+BURST_RATIO = 0.5
+
+# チャンネル単位の上限（回/秒）。chat.postMessage は 1 チャンネルあたり約 1 回/秒です
+PER_CHANNEL_RATES = {"chat.postMessage": 1.0, "chat.update": 1.0}
+
+# workspace 全体での chat.postMessage の上限（回/分）
+POST_MESSAGE_LIMIT = 300
+
+# 小さいほど優先。views.open は trigger_id の有効期限（3 秒）内に呼ぶ必要があるので最優先です
+METHOD_PRIORITY = {"views.open": 0, "views.push": 0, "views.update": 1}
+DEFAULT_PRIORITY = 5
+
+
+class TokenBucket:
+    # 待っている呼び出しは優先度順にトークンを受け取ります
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # 回/秒
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.cond = threading.Condition()
+        self.waiters = []
+        self._seq = itertools.count()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = DEFAULT_PRIORITY) -> float:
+        # 待った秒数を返します
+        start = time.monotonic()
+        with self.cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self.waiters, ticket)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.waiters[0] == ticket:
+                    if now >= self.blocked_until and self.tokens >= 1:
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.cond.notify_all()
+                        return now - start
+                    timeout = max(
+                        self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001
+                    )
+                    self.cond.wait(timeout)
+                else:
+                    self.cond.wait()
+
+    def block(self, seconds: float):
+        # Retry-After を受け取ったら、その間は誰にもトークンを渡しません
+        with self.cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.cond.notify_all()
+
+
+class PrioritySemaphore:
+    # 同時に Slack へ投げる呼び出し数の上限。空きを待つ呼び出しは優先度順に通します
+
+    def __init__(self, value: int):
+        self.value = value
+        self.cond = threading.Condition()
+        self.waiters = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int):
+        with self.cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self.waiters, ticket)
+            while self.waiters[0] != ticket or self.value <= 0:
+                self.cond.wait()
+            heapq.heappop(self.waiters)
+            self.value -= 1
+            self.cond.notify_all()
+
+    def release(self):
+        with self.cond:
+            self.value += 1
+            self.cond.notify_all()
+
+
+class AsyncTokenBucket(TokenBucket):
+    # 非同期ランタイム用の TokenBucket（イベントループの中だけで使います）
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.cond = asyncio.Condition()
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY) -> float:
+        start = time.monotonic()
+        async with self.cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == ticket:
+                        if now >= self.blocked_until and self.tokens >= 1:
+                            heapq.heappop(self.waiters)
+                            self.tokens -= 1
+                            self.cond.notify_all()
+                            return now - start
+                        timeout = max(
+                            self.blocked_until - now,
+                            (1 - self.tokens) / self.rate,
+                            0.001,
+                        )
+                        try:
+                            await asyncio.wait_for(self.cond.wait(), timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await self.cond.wait()
+            except asyncio.CancelledError:
+                # キャンセルされた呼び出しが列の先頭に残ると、後ろが進めなくなります
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+                raise
+
+    async def block(self, seconds: float):
+        async with self.cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.cond.notify_all()
+
+
+class AsyncPrioritySemaphore(PrioritySemaphore):
+    # 非同期ランタイム用の PrioritySemaphore
+
+    def __init__(self, value: int):
+        super().__init__(value)
+        self.cond = asyncio.Condition()
+
+    async def acquire(self, priority: int):
+        async with self.cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while self.waiters[0] != ticket or self.value <= 0:
+                    await self.cond.wait()
+            except asyncio.CancelledError:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+                raise
+            heapq.heappop(self.waiters)
+            self.value -= 1
+            self.cond.notify_all()
+
+    async def release(self):
+        async with self.cond:
+            self.value += 1
+            self.cond.notify_all()
+
+
+class Dispatcher:
+    # メソッド単位・チャンネル単位のトークンバケットを通して Slack API を呼び出します
+    bucket_class = TokenBucket
+    semaphore_class = PrioritySemaphore
+
+    def __init__(
+        self,
+        max_concurrency: int = 20,
+        max_retries: int = 2,
+        burst_ratio: float = BURST_RATIO,
+    ):
+        self.max_retries = max_retries
+        self.burst_ratio = burst_ratio
+        self.concurrency = self.semaphore_class(max_concurrency)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stats = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrency=int(os.environ.get("SLACK_MAX_CONCURRENCY", "20")),
+            max_retries=int(os.environ.get("SLACK_RATE_LIMIT_RETRIES", "2")),
+            burst_ratio=float(
+                os.environ.get("SLACK_RATE_LIMIT_BURST", str(BURST_RATIO))
+            ),
+        )
+
+    def _bucket(self, key: tuple, rate: float, capacity: float) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = self.bucket_class(rate, capacity)
+            return bucket
+
+    def method_bucket(self, method: str) -> TokenBucket:
+        if method == "chat.postMessage":
+            per_minute = POST_MESSAGE_LIMIT
+        else:
+            per_minute = TIER_LIMITS[METHOD_TIERS.get(method, DEFAULT_TIER)]
+        # 1 分あたりの上限を平準化し、バーストは burst_ratio 分までにします
+        capacity = max(1, per_minute * self.burst_ratio)
+        return self._bucket(("method", method), per_minute / 60, capacity)
+
+    def channel_bucket(self, method: str, channel: str):
+        rate = PER_CHANNEL_RATES.get(method)
+        if rate is None or not channel:
+            return None
+        return self._bucket(("channel", method, channel), rate, 1)
+
+    def _record(self, method: str, **values):
+        with self._lock:
+            stats = self._stats.setdefault(
+                method,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "rate_limited": 0,
+                    "throttled": 0,
+                    "throttle_wait_seconds_total": 0.0,
+                    "latency_seconds_total": 0.0,
+                    "latency_seconds_max": 0.0,
+                },
+            )
+            for key, value in values.items():
+                if key == "latency_seconds_max":
+                    stats[key] = max(stats[key], value)
+                else:
+                    stats[key] += value
+
+    def call(self, method: str, fn, channel: str = None):
+        priority = METHOD_PRIORITY.get(method, DEFAULT_PRIORITY)
+        buckets = [self.method_bucket(method), self.channel_bucket(method, channel)]
+
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            for bucket in buckets:
+                if bucket is not None:
+                    waited += bucket.acquire(priority)
+
+            self.concurrency.acquire(priority)
+            start = time.perf_counter()
+            try:
+                response = fn()
+            except SlackApiError as e:
+                elapsed = time.perf_counter() - start
+                if e.response.status_code != 429 or attempt == self.max_retries:
+                    self._record(
+                        method, calls=1, errors=1, latency_seconds_total=elapsed
+                    )
+                    raise
+                retry_after = _retry_after(e.response.headers)
+                logger.warning(f"{method} rate limited, retry after {retry_after}s")
+                self._record(method, rate_limited=1)
+                for bucket in buckets:
+                    if bucket is not None:
+                        bucket.block(retry_after)
+                continue
+            except Exception:
+                self._record(method, calls=1, errors=1)
+                raise
+            finally:
+                self.concurrency.release()
+
+            elapsed = time.perf_counter() - start
+            self._record(
+                method,
+                calls=1,
+                throttled=1 if waited > 0.001 else 0,
+                throttle_wait_seconds_total=waited,
+                latency_seconds_total=elapsed,
+                latency_seconds_max=elapsed,
+            )
+            return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._stats.items()}
+
+
+class AsyncDispatcher(Dispatcher):
+    # 非同期ランタイム用の Dispatcher（fn はコルーチンを返す関数です）
+    bucket_class = AsyncTokenBucket
+    semaphore_class = AsyncPrioritySemaphore
+
+    async def call(self, method: str, fn, channel: str = None):
+        priority = METHOD_PRIORITY.get(method, DEFAULT_PRIORITY)
+        buckets = [self.method_bucket(method), self.channel_bucket(method, channel)]
+
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            for bucket in buckets:
+                if bucket is not None:
+                    waited += await bucket.acquire(priority)
+
+            await self.concurrency.acquire(priority)
+            start = time.perf_counter()
+            try:
+                response = await fn()
+            except SlackApiError as e:
+                elapsed = time.perf_counter() - start
+                if e.response.status_code != 429 or attempt == self.max_retries:
+                    self._record(
+                        method, calls=1, errors=1, latency_seconds_total=elapsed
+                    )
+                    raise
+                retry_after = _retry_after(e.response.headers)
+                logger.warning(f"{method} rate limited, retry after {retry_after}s")
+                self._record(method, rate_limited=1)
+                for bucket in buckets:
+                    if bucket is not None:
+                        await bucket.block(retry_after)
+                continue
+            except Exception:
+                self._record(method, calls=1, errors=1)
+                raise
+            finally:
+                await self.concurrency.release()
+
+            elapsed = time.perf_counter() - start
+            self._record(
+                method,
+                calls=1,
+                throttled=1 if waited > 0.001 else 0,
+                throttle_wait_seconds_total=waited,
+                latency_seconds_total=elapsed,
+                latency_seconds_max=elapsed,
+            )
+            return response
+
+
+def _retry_after(headers: dict) -> float:
+    for key, value in (headers or {}).items():
+        if key.lower() == "retry-after":
+            value = value[0] if isinstance(value, list) else value
+            return float(value)
+    return 1.0
+
+
+def channel_of(kwargs: dict):
+    for key in ("json", "data", "params"):
+        payload = kwargs.get(key)
+        if isinstance(payload, dict) and payload.get("channel"):
+            return payload["channel"]
+    return None
+
+
+class RateLimitedWebClient(WebClient):
+    # すべての API 呼び出しを Dispatcher 経由にした WebClient
+
+    def __init__(self, *args, dispatcher: Dispatcher = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatcher = dispatcher or Dispatcher.from_env()
+
+    def api_call(self, api_method: str, **kwargs):
+        # スパンにはレート制限の待ち時間も含みます
+        with tracer.span("slack_api", method=api_method):
+            return self.dispatcher.call(
+                api_method,
+                lambda: super(RateLimitedWebClient, self).api_call(api_method, **kwargs),
+                channel=channel_of(kwargs),
+            )
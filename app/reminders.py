@@ -0,0 +1,444 @@
+import dataclasses
+import datetime
+import hashlib
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zoneinfo
+from concurrent.futures import ThreadPoolExecutor
+
+from state import state_path
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = zoneinfo.ZoneInfo("Asia/Tokyo")
+
+DEFAULT_TEXT = "議事録の修正終わった？🍔"
+
+# 時刻を指定しないときは 30 秒後に送ります
+DEFAULT_DELAY = 30.0
+
+# 日付だけを指定したときに送る時刻
+REMIND_AT = datetime.time(9, 0)
+
+# 繰り返しの最短間隔（秒）
+MIN_INTERVAL = 60.0
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+DURATION_PATTERN = re.compile(r"^(\d+)([smhd])$")
+USER_MENTION = re.compile(r"^<@([UW][A-Z0-9]+)(?:\|[^>]*)?>$")
+CHANNEL_MENTION = re.compile(r"^<#([CG][A-Z0-9]+)(?:\|[^>]*)?>$")
+
+
+@dataclasses.dataclass
+class Reminder:
+    id: str
+    user: str  # 送信先（DM）
+    text: str
+    post_at: float
+    interval: float = None  # 繰り返しの間隔（秒）。None なら 1 回だけ
+    created_by: str = None
+    attempts: int = 0
+
+
+def reminder_id(user: str, text: str, created_by: str) -> str:
+    # 同じ人が登録した、同じ相手・同じ文面のリマインダーは同じ ID になり、登録し直すと上書きされます
+    # 登録した人も ID に含めるので、他の人の登録で上書きされる（一覧や取り消しから消える）ことはありません
+    source = f"{created_by}\0{user}\0{text}"
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+
+def parse_duration(value: str):
+    match = DURATION_PATTERN.match(value)
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_command(text: str, parse_date=None) -> dict:
+    # /yaruki_reminder の引数を解釈します
+    #   list                         自分が登録したリマインダーの一覧
+    #   cancel <id>                  取り消し
+    #   [@user ...] [#channel ...] [in 30m | at 10/20] [every 1d] [本文]
+    #                                宛先を省略すると自分、時刻を省略すると 30 秒後
+    # at の日付は parse_date（DateNormalizer.parse）で解釈し、その日の REMIND_AT に送ります
+    words = (text or "").split()
+    if words and words[0] == "list":
+        return {"action": "list"}
+    if words and words[0] == "cancel":
+        return {"action": "cancel", "ids": words[1:]}
+
+    command = {
+        "action": "schedule",
+        "users": [],
+        "channels": [],
+        "delay": DEFAULT_DELAY,
+        "interval": None,
+    }
+    rest = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        following = words[i + 1] if i + 1 < len(words) else ""
+        if USER_MENTION.match(word):
+            command["users"].append(USER_MENTION.match(word).group(1))
+        elif CHANNEL_MENTION.match(word):
+            command["channels"].append(CHANNEL_MENTION.match(word).group(1))
+        elif word in ("in", "every") and parse_duration(following) is not None:
+            key = "delay" if word == "in" else "interval"
+            command[key] = float(parse_duration(following))
+            i += 1
+        elif word == "at" and parse_date is not None and parse_date(following):
+            day = parse_date(following)
+            remind_at = datetime.datetime.combine(day, REMIND_AT, TIMEZONE)
+            command["delay"] = max(0.0, remind_at.timestamp() - time.time())
+            i += 1
+        else:
+            rest.append(word)
+        i += 1
+    command["text"] = " ".join(rest) or DEFAULT_TEXT
+    if command["interval"] is not None:
+        command["interval"] = max(command["interval"], MIN_INTERVAL)
+    return command
+
+
+def build_reminders(
+    users: list, text: str, delay: float, interval: float, created_by: str
+) -> list:
+    post_at = time.time() + delay
+    return [
+        Reminder(
+            reminder_id(user, text, created_by),
+            user,
+            text,
+            post_at,
+            interval,
+            created_by,
+        )
+        for user in dict.fromkeys(users)
+    ]
+
+
+def format_reminders(reminders: list, limit: int = 30) -> str:
+    if not reminders:
+        return "登録されているリマインダーはありません"
+    lines = []
+    for r in reminders[:limit]:
+        when = datetime.datetime.fromtimestamp(r.post_at, TIMEZONE).strftime("%m/%d %H:%M")
+        every = f"（{_format_duration(r.interval)}ごと）" if r.interval else ""
+        lines.append(f"`{r.id}` <@{r.user}> {when}{every} {r.text}")
+    if len(reminders) > limit:
+        lines.append(f"ほか {len(reminders) - limit} 件")
+    return "\n".join(lines)
+
+
+def _format_duration(seconds: float) -> str:
+    for unit, name in ((86400, "日"), (3600, "時間"), (60, "分")):
+        if seconds >= unit and seconds % unit == 0:
+            return f"{int(seconds // unit)}{name}"
+    return f"{int(seconds)}秒"
+
+
+def next_occurrence(post_at: float, interval: float, now: float) -> float:
+    # 停止中などで過ぎた回は飛ばして、次の未来の時刻を返します
+    missed = max(0, int((now - post_at) // interval) + 1)
+    return post_at + missed * interval
+
+
+class ReminderStore:
+    # リマインダーを SQLite に保存します（再起動しても消えず、同じホストのワーカー間で共有されます）
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            " id TEXT PRIMARY KEY,"
+            " user TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " post_at REAL NOT NULL,"
+            " interval REAL,"
+            " created_by TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS reminders_post_at ON reminders (post_at)"
+        )
+        self._conn.commit()
+
+    def upsert_many(self, reminders: list):
+        # 1 回のトランザクションでまとめて登録します。同じ ID は時刻と文面を上書きします
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO reminders VALUES (?, ?, ?, ?, ?, ?, 0)"
+                " ON CONFLICT (id) DO UPDATE SET"
+                " text = excluded.text, post_at = excluded.post_at,"
+                " interval = excluded.interval, attempts = 0",
+                [
+                    (r.id, r.user, r.text, r.post_at, r.interval, r.created_by)
+                    for r in reminders
+                ],
+            )
+            self._conn.commit()
+
+    def _select(self, where: str, params: tuple, limit: int = -1) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, user, text, post_at, interval, created_by, attempts"
+                f" FROM reminders WHERE {where} ORDER BY post_at LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def due(self, before: float, limit: int) -> list:
+        return self._select("post_at <= ?", (before,), limit)
+
+    def created_by(self, user: str) -> list:
+        return self._select("created_by = ?", (user,))
+
+    def delete(self, ids: list, created_by: str) -> list:
+        # 削除できた ID を返します（他の人が登録したものは消せません）
+        deleted = []
+        with self._lock:
+            for id in ids:
+                cursor = self._conn.execute(
+                    "DELETE FROM reminders WHERE id = ? AND created_by = ?",
+                    (id, created_by),
+                )
+                if cursor.rowcount:
+                    deleted.append(id)
+            self._conn.commit()
+        return deleted
+
+    def complete(
+        self, sent: list, failed: list, now: float, retry_delay: float, max_attempts: int
+    ):
+        # 送信結果を 1 回のトランザクションで反映し、次に送るもの（繰り返し・再送）を返します
+        # 1 回だけのものは削除、繰り返しは次の時刻へ、失敗は retry_delay 後に再送します
+        deletes, updates = [], []
+        for r in sent + failed:
+            if r in failed and r.attempts + 1 < max_attempts:
+                updates.append((now + retry_delay, r.attempts + 1, r.id, r.post_at))
+            elif r.interval:
+                next_at = next_occurrence(r.post_at, r.interval, now)
+                updates.append((next_at, 0, r.id, r.post_at))
+            else:
+                deletes.append((r.id, r.post_at))
+
+        # 送信中に登録し直されたもの（post_at が変わったもの）には触れません
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "DELETE FROM reminders WHERE id = ? AND post_at = ?", deletes
+                )
+                self._conn.executemany(
+                    "UPDATE reminders SET post_at = ?, attempts = ?"
+                    " WHERE id = ? AND post_at = ?",
+                    updates,
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+        by_id = {r.id: r for r in sent + failed}
+        return [
+            dataclasses.replace(by_id[id], post_at=post_at, attempts=attempts)
+            for post_at, attempts, id, _ in updates
+        ]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+
+
+class ReminderScheduler:
+    # 期限の近いリマインダーを時刻順のヒープに載せ、期限が来たものを batch_size 件ずつまとめて送ります
+    # 保存先は SQLite なので、どのワーカーからでも登録できます。送信はリーダーのワーカーだけが行い、
+    # poll_interval ごとに SQLite から期限の近いものを読み込みます（他のワーカーが登録した分や再起動前の分）
+
+    def __init__(
+        self,
+        store: ReminderStore,
+        send,
+        batch_size: int = 50,
+        concurrency: int = 4,
+        poll_interval: float = 5.0,
+        retry_delay: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        self.store = store
+        self.send = send
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="reminder")
+        self._heap = []  # (post_at, id, Reminder)
+        self._queued = {}  # id : ヒープに載っている post_at
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = False
+        self._stats = {
+            "scheduled": 0,
+            "cancelled": 0,
+            "sent": 0,
+            "failed": 0,
+            "batches": 0,
+            "lag_seconds_max": 0.0,
+            "sent_per_second": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls, send):
+        return cls(
+            ReminderStore(
+                os.environ.get("REMINDERS_PATH") or state_path("reminders.sqlite3")
+            ),
+            send,
+            batch_size=int(os.environ.get("REMINDER_BATCH_SIZE", "50")),
+            concurrency=int(os.environ.get("REMINDER_CONCURRENCY", "4")),
+            poll_interval=float(os.environ.get("REMINDER_POLL_INTERVAL", "5")),
+        )
+
+    def schedule(self, reminders: list):
+        # 登録（同じ ID なら時刻と文面を更新）します。リーダーなら期限の近いものをすぐヒープに載せます
+        self.store.upsert_many(reminders)
+        with self._lock:
+            self._stats["scheduled"] += len(reminders)
+            if self._running:
+                horizon = time.time() + self.poll_interval
+                for r in reminders:
+                    if r.post_at <= horizon:
+                        self._push(r)
+                self._wakeup.notify()
+
+    def cancel(self, ids: list, created_by: str) -> list:
+        # ヒープに残ったエントリは _queued から外して、取り出したときに読み飛ばします
+        deleted = self.store.delete(ids, created_by)
+        with self._lock:
+            self._stats["cancelled"] += len(deleted)
+            for id in deleted:
+                self._queued.pop(id, None)
+        return deleted
+
+    def list(self, created_by: str) -> list:
+        return self.store.created_by(created_by)
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {
+                **self._stats,
+                "queued": len(self._queued),
+                "inflight": len(self._inflight),
+            }
+        result["stored"] = len(self.store)
+        return result
+
+    def _push(self, r: Reminder):
+        # ロックを持った状態で呼びます
+        if r.id in self._inflight or self._queued.get(r.id) == r.post_at:
+            return
+        self._queued[r.id] = r.post_at
+        heapq.heappush(self._heap, (r.post_at, r.id, r))
+
+    def _pop_due(self, now: float) -> list:
+        # ロックを持った状態で呼びます。古くなったエントリ（更新・取り消し済み）は読み飛ばします
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            post_at, id, r = heapq.heappop(self._heap)
+            if self._queued.get(id) != post_at:
+                continue
+            del self._queued[id]
+            self._inflight.add(id)
+            batch.append(r)
+        return batch
+
+    def _poll(self):
+        due = self.store.due(time.time() + self.poll_interval, limit=10000)
+        with self._lock:
+            for r in due:
+                self._push(r)
+
+    def _send_batch(self, batch: list):
+        start = now = time.time()
+        sent, failed, rescheduled = [], [], []
+        try:
+            with tracer.span("reminder_batch", size=len(batch)):
+                results = list(self._executor.map(self._send_one, batch))
+            sent = [r for r, ok in zip(batch, results) if ok]
+            failed = [r for r, ok in zip(batch, results) if not ok]
+            now = time.time()
+            rescheduled = self.store.complete(
+                sent, failed, now, self.retry_delay, self.max_attempts
+            )
+        except Exception:
+            # 結果を保存できなかったものは SQLite に元の時刻のまま残り、次の読み込みで送り直します
+            logger.exception(f"failed to complete a batch of {len(batch)} reminders")
+        finally:
+            with self._lock:
+                for r in batch:
+                    self._inflight.discard(r.id)
+                for r in rescheduled:
+                    if r.post_at <= now + self.poll_interval:
+                        self._push(r)
+                self._stats["batches"] += 1
+                self._stats["sent"] += len(sent)
+                self._stats["failed"] += len(failed)
+                lag = max(start - r.post_at for r in batch)
+                self._stats["lag_seconds_max"] = max(
+                    self._stats["lag_seconds_max"], lag
+                )
+                self._stats["sent_per_second"] = len(batch) / max(now - start, 1e-6)
+
+    def _send_one(self, r: Reminder) -> bool:
+        tracer.observe("reminder_lag", max(0.0, time.time() - r.post_at))
+        try:
+            self.send(r)
+            return True
+        except Exception:
+            logger.exception(f"failed to send reminder {r.id} to {r.user}")
+            return False
+
+    def _run(self):
+        next_poll = 0.0
+        while self._running:
+            now = time.time()
+            if now >= next_poll:
+                try:
+                    self._poll()
+                except Exception:
+                    logger.exception("failed to load reminders")
+                next_poll = now + self.poll_interval
+
+            with self._lock:
+                batch = self._pop_due(now)
+                if not batch:
+                    wake_at = next_poll
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._wakeup.wait(max(0.0, wake_at - now))
+                    continue
+            self._send_batch(batch)
+
+    def start(self):
+        # リーダーに選ばれたときに呼びます（leader.on_elected）
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        threading.Thread(target=self._run, name="reminders", daemon=True).start()
+        logger.info("reminder scheduler started")
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
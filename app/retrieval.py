@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+from history import strip_message
+from serializer import history_item
+from tracing import tracer
+
+if TYPE_CHECKING:
+    # aiohttp の読み込みが重いので、同期版では読み込みません
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+
+def _window(oldest: str = None, latest: str = None) -> dict:
+    # conversations.history / replies の期間指定（どちらも含みません）
+    window = {}
+    if oldest:
+        window["oldest"] = oldest
+    if latest:
+        window["latest"] = latest
+    return window
+
+
+def _next_cursor(response) -> str:
+    if not response.get("has_more"):
+        return None
+    return (response.get("response_metadata") or {}).get("next_cursor") or None
+
+
+def _thread_parents(page: list) -> list:
+    # 返信のあるスレッドの親（thread_ts が自分の ts）の ts
+    return [
+        message["ts"]
+        for message in page
+        if message.get("reply_count")
+        and message.get("thread_ts", message["ts"]) == message["ts"]
+    ]
+
+
+def _oldest_first(batches) -> list:
+    # ページとスレッドの返信をまとめて ts 昇順に並べます
+    return sorted(
+        (message for batch in batches for message in batch),
+        key=lambda message: float(message["ts"]),
+    )
+
+
+def _with_replies(page: list, replies: dict):
+    # スレッドの親の直後に、その返信を古い順に並べます
+    for message in page:
+        yield message
+        yield from replies.get(message["ts"], ())
+
+
+class HistoryReader:
+    # 大きなチャンネルの履歴を cursor でページごとに読み込みます
+    # messages() は新しい順に 1 件ずつ返すジェネレーターなので、必要な分が集まったら止められます
+    # （止めた後のページやスレッドは取得しません）。collect() は文字数の予算に収まるまで読みます
+    # threads=True ならスレッドの返信も conversations.replies で取得します（ページごとに並列、上限 thread_concurrency）
+    # oldest より前に始まったスレッドの親は返ってこないので、新しい返信のあるスレッドは active_threads で渡します
+    # oldest を指定したときは oldest の直後から古い順に返すので、予算で止めても読み残しは止めた位置より後だけです
+    # （差分更新で、次回の起点をそのまま読んだ最後の ts に進められます）
+
+    def __init__(
+        self,
+        page_size: int = 200,
+        max_pages: int = 20,
+        thread_concurrency: int = 4,
+        max_replies: int = 200,
+    ):
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.thread_concurrency = thread_concurrency
+        self.max_replies = max_replies
+        self._executor = ThreadPoolExecutor(
+            max_workers=thread_concurrency, thread_name_prefix="history-replies"
+        )
+        self._semaphore = asyncio.Semaphore(thread_concurrency)
+        self._lock = threading.Lock()
+        self.stats = {"pages": 0, "threads": 0, "messages": 0, "budget_stops": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            page_size=int(os.environ.get("HISTORY_PAGE_SIZE", "200")),
+            max_pages=int(os.environ.get("HISTORY_MAX_PAGES", "20")),
+            thread_concurrency=int(os.environ.get("HISTORY_THREAD_CONCURRENCY", "4")),
+            max_replies=int(os.environ.get("HISTORY_MAX_REPLIES", "200")),
+        )
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def pages(
+        self, client: WebClient, channel: str, oldest: str = None, latest: str = None
+    ):
+        # conversations.history のページ（新しい順、blocks 除去済み）を順に返します
+        cursor = None
+        for _ in range(self.max_pages):
+            with tracer.span("history_page"):
+                response = client.conversations_history(
+                    channel=channel,
+                    limit=self.page_size,
+                    cursor=cursor,
+                    **_window(oldest, latest),
+                )
+            self._count("pages")
+            yield [strip_message(message) for message in response["messages"]]
+            cursor = _next_cursor(response)
+            if cursor is None:
+                return
+
+    def replies(
+        self, client: WebClient, channel: str, thread_ts: str, oldest: str = None
+    ) -> list:
+        # スレッドの返信（親は除きます）を古い順に最大 max_replies 件返します
+        replies = []
+        cursor = None
+        with tracer.span("history_replies"):
+            while len(replies) < self.max_replies:
+                response = client.conversations_replies(
+                    channel=channel,
+                    ts=thread_ts,
+                    limit=self.page_size,
+                    cursor=cursor,
+                    **_window(oldest),
+                )
+                replies.extend(
+                    strip_message(message)
+                    for message in response["messages"]
+                    if message["ts"] != thread_ts
+                )
+                cursor = _next_cursor(response)
+                if cursor is None:
+                    break
+        self._count("threads")
+        return replies[: self.max_replies]
+
+    def messages(
+        self,
+        client: WebClient,
+        channel: str,
+        oldest: str = None,
+        latest: str = None,
+        threads: bool = False,
+        active_threads=(),
+    ):
+        # 新しい順にメッセージを返します。threads=True ならスレッドの親の直後に返信が続きます
+        # oldest を指定したときは、返信や active_threads の返信も含めて ts の古い順に返します
+        if oldest:
+            yield from self._forward(
+                client, channel, oldest, latest, threads, active_threads
+            )
+            return
+        for page in self.pages(client, channel, oldest, latest):
+            replies = {}
+            parents = _thread_parents(page) if threads else []
+            if parents:
+                results = self._executor.map(
+                    lambda ts: self.replies(client, channel, ts, oldest), parents
+                )
+                replies = dict(zip(parents, results))
+            yield from _with_replies(page, replies)
+
+    def _forward(
+        self,
+        client: WebClient,
+        channel: str,
+        oldest: str,
+        latest: str,
+        threads: bool,
+        active_threads,
+    ) -> list:
+        # oldest より後を全ページ（最大 max_pages）読んでから、古い順に並べ直します
+        batches = []
+        parents = list(active_threads) if threads else []
+        for page in self.pages(client, channel, oldest, latest):
+            batches.append(page)
+            if threads:
+                parents.extend(_thread_parents(page))
+        if parents:
+            batches.extend(
+                self._executor.map(
+                    lambda ts: self.replies(client, channel, ts, oldest), parents
+                )
+            )
+        return _oldest_first(batches)
+
+    def collect(
+        self, client: WebClient, channel: str, budget_chars: int, names=None, **kwargs
+    ) -> list:
+        # serialize_history と同じ数え方で予算に収まるまで読み、ts 昇順で返します
+        generator = self.messages(client, channel, **kwargs)
+        collected = _Collector(budget_chars, names)
+        try:
+            for message in generator:
+                if not collected.add(message):
+                    self._count("budget_stops")
+                    break
+        finally:
+            generator.close()
+        self._count("messages", len(collected.messages))
+        return collected.result()
+
+    async def apages(
+        self,
+        client: "AsyncWebClient",
+        channel: str,
+        oldest: str = None,
+        latest: str = None,
+    ):
+        # 非同期ランタイム用の pages()
+        cursor = None
+        for _ in range(self.max_pages):
+            with tracer.span("history_page"):
+                response = await client.conversations_history(
+                    channel=channel,
+                    limit=self.page_size,
+                    cursor=cursor,
+                    **_window(oldest, latest),
+                )
+            self._count("pages")
+            yield [strip_message(message) for message in response["messages"]]
+            cursor = _next_cursor(response)
+            if cursor is None:
+                return
+
+    async def areplies(
+        self, client: "AsyncWebClient", channel: str, thread_ts: str, oldest: str = None
+    ) -> list:
+        replies = []
+        cursor = None
+        async with self._semaphore:
+            with tracer.span("history_replies"):
+                while len(replies) < self.max_replies:
+                    response = await client.conversations_replies(
+                        channel=channel,
+                        ts=thread_ts,
+                        limit=self.page_size,
+                        cursor=cursor,
+                        **_window(oldest),
+                    )
+                    replies.extend(
+                        strip_message(message)
+                        for message in response["messages"]
+                        if message["ts"] != thread_ts
+                    )
+                    cursor = _next_cursor(response)
+                    if cursor is None:
+                        break
+        self._count("threads")
+        return replies[: self.max_replies]
+
+    async def amessages(
+        self,
+        client: "AsyncWebClient",
+        channel: str,
+        oldest: str = None,
+        latest: str = None,
+        threads: bool = False,
+        active_threads=(),
+    ):
+        if oldest:
+            for message in await self._aforward(
+                client, channel, oldest, latest, threads, active_threads
+            ):
+                yield message
+            return
+        async for page in self.apages(client, channel, oldest, latest):
+            replies = {}
+            parents = _thread_parents(page) if threads else []
+            if parents:
+                results = await asyncio.gather(
+                    *(self.areplies(client, channel, ts, oldest) for ts in parents)
+                )
+                replies = dict(zip(parents, results))
+            for message in _with_replies(page, replies):
+                yield message
+
+    async def _aforward(
+        self,
+        client: "AsyncWebClient",
+        channel: str,
+        oldest: str,
+        latest: str,
+        threads: bool,
+        active_threads,
+    ) -> list:
+        batches = []
+        parents = list(active_threads) if threads else []
+        async for page in self.apages(client, channel, oldest, latest):
+            batches.append(page)
+            if threads:
+                parents.extend(_thread_parents(page))
+        if parents:
+            batches.extend(
+                await asyncio.gather(
+                    *(self.areplies(client, channel, ts, oldest) for ts in parents)
+                )
+            )
+        return _oldest_first(batches)
+
+    async def acollect(
+        self,
+        client: "AsyncWebClient",
+        channel: str,
+        budget_chars: int,
+        names=None,
+        **kwargs,
+    ) -> list:
+        generator = self.amessages(client, channel, **kwargs)
+        collected = _Collector(budget_chars, names)
+        try:
+            async for message in generator:
+                if not collected.add(message):
+                    self._count("budget_stops")
+                    break
+        finally:
+            await generator.aclose()
+        self._count("messages", len(collected.messages))
+        return collected.result()
+
+
+class _Collector:
+    # 受け取った順（新しい順、oldest 指定時は古い順）に、chat_history の予算に収まる分だけ残します
+    def __init__(self, budget_chars: int, names=None):
+        self.budget_chars = budget_chars
+        self.names = names
+        self.messages = []
+        self.used = 2  # "[" と "]"
+
+    def add(self, message: dict) -> bool:
+        cost = len(history_item(message, self.names)) + (1 if self.messages else 0)
+        if self.used + cost > self.budget_chars:
+            return False
+        self.messages.append(message)
+        self.used += cost
+        return True
+
+    def result(self) -> list:
+        return sorted(self.messages, key=lambda message: float(message["ts"]))
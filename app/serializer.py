@@ -0,0 +1,57 @@
+import json
+import os
+
+# Dify に渡す chat_history の上限（文字数）。新しいメッセージから詰めていきます
+HISTORY_BUDGET_CHARS = int(os.environ.get("HISTORY_BUDGET_CHARS", "8000"))
+
+# タスク抽出（APP3）はより長い履歴を渡すため別に設定できます
+TASKS_HISTORY_BUDGET_CHARS = int(os.environ.get("TASKS_HISTORY_BUDGET_CHARS", "32000"))
+
+
+def project_message(message: dict, names=None) -> dict:
+    # LLM に必要な最小限のフィールドだけを残します
+    user = message.get("user") or message.get("bot_id")
+    projected = {"user": user}
+
+    name = None
+    if names is not None and user:
+        name = names(user) if callable(names) else names.get(user)
+    if not name:
+        name = message.get("username") or (message.get("bot_profile") or {}).get("name")
+    if name:
+        projected["name"] = name
+
+    projected["ts"] = message.get("ts")
+    projected["text"] = message.get("text", "")
+
+    thread_ts = message.get("thread_ts")
+    if thread_ts:
+        projected["thread_ts"] = thread_ts
+    return projected
+
+
+def history_item(message: dict, names=None) -> str:
+    # chat_history の 1 件分の JSON（予算の計算にも使います）
+    return json.dumps(
+        project_message(message, names),
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def serialize_history(messages: list, names=None, budget_chars: int = None) -> str:
+    # messages は ts 昇順。予算を超える古いメッセージは落とします
+    budget = HISTORY_BUDGET_CHARS if budget_chars is None else budget_chars
+
+    items = []
+    used = 2  # "[" と "]"
+    for message in reversed(messages):
+        item = history_item(message, names)
+        cost = len(item) + (1 if items else 0)
+        if used + cost > budget:
+            break
+        items.append(item)
+        used += cost
+
+    items.reverse()
+    return "[" + ",".join(items) + "]"
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import threading
+
+from cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def _ignore_inputs_from_env() -> set:
+    ignore = os.environ.get("DIFY_SINGLEFLIGHT_IGNORE_INPUTS", "date,today")
+    return {k.strip() for k in ignore.split(",") if k.strip()}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SingleFlightBase:
+    # apps に含まれるアプリだけが対象です（画像生成のように毎回違う結果がほしいアプリは含めません）
+
+    def __init__(
+        self, apps: set, timeout: float = 90.0, ignore_inputs: set = frozenset()
+    ):
+        self.apps = set(apps)
+        self.timeout = timeout
+        self.ignore_inputs = set(ignore_inputs)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "timeouts": 0}
+
+    @classmethod
+    def from_env(cls):
+        # DIFY_SINGLEFLIGHT_APPS が空ならまとめません
+        apps = {
+            a.strip() for a in os.environ.get("DIFY_SINGLEFLIGHT_APPS", "").split(",")
+        }
+        apps.discard("")
+        if not apps:
+            return None
+        return cls(
+            apps,
+            timeout=float(os.environ.get("DIFY_SINGLEFLIGHT_TIMEOUT", "90")),
+            ignore_inputs=_ignore_inputs_from_env(),
+        )
+
+    def enabled_for(self, app: str) -> bool:
+        return app in self.apps
+
+    def key(self, app: str, token: str, inputs: dict) -> str:
+        return cache_key(app, token, inputs, self.ignore_inputs)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+
+class SingleFlight(_SingleFlightBase):
+    # 同じキーの呼び出しが同時に来たら 1 回だけ実行し、結果を全員で共有します（スレッド版）
+
+    def __init__(
+        self, apps: set, timeout: float = 90.0, ignore_inputs: set = frozenset()
+    ):
+        super().__init__(apps, timeout, ignore_inputs)
+        self._calls = {}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executed"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout):
+            # 待っている側だけがタイムアウトします。実行中の呼び出しはそのまま続けます
+            self._count("timeouts")
+            raise TimeoutError(f"single-flight wait timed out after {self.timeout}s")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight(_SingleFlightBase):
+    # 非同期ランタイム用の SingleFlight
+
+    def __init__(
+        self, apps: set, timeout: float = 90.0, ignore_inputs: set = frozenset()
+    ):
+        super().__init__(apps, timeout, ignore_inputs)
+        self._futures = {}
+
+    async def do(self, key: str, coro_fn):
+        self.stats["calls"] += 1
+        future = self._futures.get(key)
+        if future is None:
+            self.stats["executed"] += 1
+            future = self._futures[key] = asyncio.ensure_future(coro_fn())
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+
+        try:
+            # shield して、待つ側がキャンセル・タイムアウトしても実行中の呼び出しは止めません
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
@@ -0,0 +1,37 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    # 起動の各段階（import、設定の読み込み、Slack への接続など）にかかった時間を記録します
+    # このモジュールを最初に import した時刻を起点にするので、main.py では先頭で import してください
+    # 結果は 1 行のログと /metrics（startup_*）で確認できます
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = {}  # 段階の名前 : 秒
+
+    def mark(self, phase: str):
+        # 前の段階の終わり（最初は起点）からの時間を phase の時間として記録します
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self):
+        phases = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in self.phases.items()
+        )
+        logger.info(f"started in {self.total():.3f}s ({phases})")
+
+    def stats(self) -> dict:
+        return {"seconds": dict(self.phases), "total_seconds": self.total()}
+
+
+# プロセス全体で 1 つのタイマーを使います
+startup = StartupTimer()
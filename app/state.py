@@ -0,0 +1,26 @@
+import os
+
+# 複数のワーカー（プロセス・コンテナ）で共有する状態の保存先
+# STATE_DIR を設定すると、重複排除・レスポンスキャッシュ・先読み結果の既定の保存先が
+# このディレクトリの SQLite になり、同じホストのワーカー間で共有されます
+
+
+def state_dir():
+    return os.environ.get("STATE_DIR") or None
+
+
+def shared() -> bool:
+    return state_dir() is not None
+
+
+def state_path(name: str) -> str:
+    directory = state_dir()
+    if directory is None:
+        return name
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def default_backend() -> str:
+    # 各ストアの *_BACKEND が未設定のときの既定値
+    return "sqlite" if shared() else "memory"
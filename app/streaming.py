@@ -0,0 +1,197 @@
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+if TYPE_CHECKING:
+    # aiohttp の読み込みが重いので、同期版では読み込みません
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+# chat.update の最小間隔（秒）。Slack のチャンネル単位のレート制限（約 1 回/秒）に合わせます
+STREAM_UPDATE_INTERVAL = float(os.environ.get("SLACK_STREAM_UPDATE_INTERVAL", "1.0"))
+
+# 生成中に表示するプレースホルダー
+PLACEHOLDER_TEXT = "考え中…"
+
+# 生成の途中で失敗したときに、プレースホルダー（またはそれまでの文章の後ろ）に表示する文
+ERROR_TEXT = "エラーが発生したため、回答を最後まで生成できませんでした🙏"
+
+
+def streaming_enabled() -> bool:
+    return os.environ.get("DIFY_STREAMING", "false").lower() in ("1", "true", "yes")
+
+
+class ProgressiveMessage:
+    # Dify のストリーミング出力を Slack メッセージへ少しずつ反映します
+    # チャンクは interval ごとにまとめて 1 回の更新にし、max_updates 回を超えたら最後にだけ更新します
+
+    def __init__(
+        self,
+        post,
+        update,
+        interval: float = STREAM_UPDATE_INTERVAL,
+        max_updates: int = None,
+    ):
+        self.post = post
+        self.update = update
+        self.interval = interval
+        self.max_updates = max_updates
+        self.updates = 0
+
+    def _reset(self):
+        self.chunks = []
+        self.shown = PLACEHOLDER_TEXT
+        self.last_update = time.monotonic()
+        self.final = None
+
+    def _on_event(self, event: dict, output_key: str):
+        # 更新すべきタイミングならその時点の全文を返します
+        kind = event.get("event")
+        if kind == "workflow_finished":
+            self.final = (event["data"].get("outputs") or {}).get(output_key)
+            return None
+        if kind != "text_chunk":
+            return None
+
+        self.chunks.append(event["data"]["text"])
+        now = time.monotonic()
+        text = "".join(self.chunks)
+        if now - self.last_update < self.interval or text == self.shown:
+            return None
+        # 最後の 1 回は確定版の更新のために残しておきます
+        if self.max_updates is not None and self.updates >= self.max_updates - 1:
+            return None
+
+        self.updates += 1
+        self.shown = text
+        self.last_update = now
+        return text
+
+    def _on_finish(self):
+        text = self.final if self.final is not None else "".join(self.chunks)
+        if text == self.shown:
+            return text, False
+        self.updates += 1
+        return text, True
+
+    def _error_text(self) -> str:
+        # それまでに届いた文章は残して、失敗したことを書き添えます
+        partial = "".join(self.chunks)
+        return f"{partial}\n\n{ERROR_TEXT}" if partial else ERROR_TEXT
+
+    def run(self, events, output_key: str = "text") -> str:
+        self._reset()
+        self.post(PLACEHOLDER_TEXT)
+
+        # ストリームが途中で失敗しても、プレースホルダーを残したままにしません
+        try:
+            for event in events:
+                text = self._on_event(event, output_key)
+                if text is not None:
+                    self.update(text)
+        except Exception:
+            try:
+                self.update(self._error_text())
+            except Exception:
+                logger.exception("failed to show the streaming error")
+            raise
+
+        text, changed = self._on_finish()
+        if changed:
+            self.update(text)
+        return text
+
+    async def arun(self, events, output_key: str = "text") -> str:
+        # post / update / events が非同期の場合はこちらを使います
+        self._reset()
+        await self.post(PLACEHOLDER_TEXT)
+
+        try:
+            async for event in events:
+                text = self._on_event(event, output_key)
+                if text is not None:
+                    await self.update(text)
+        except Exception:
+            try:
+                await self.update(self._error_text())
+            except Exception:
+                logger.exception("failed to show the streaming error")
+            raise
+
+        text, changed = self._on_finish()
+        if changed:
+            await self.update(text)
+        return text
+
+
+def stream_to_message(
+    client: WebClient,
+    channel: str,
+    events,
+    thread_ts: str = None,
+    output_key: str = "text",
+) -> str:
+    # chat.postMessage でプレースホルダーを投稿し、chat.update で書き換えていきます
+    posted = {}
+
+    def post(text):
+        response = client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=text)
+        posted["channel"] = response["channel"]
+        posted["ts"] = response["ts"]
+
+    def update(text):
+        client.chat_update(channel=posted["channel"], ts=posted["ts"], text=text)
+
+    return ProgressiveMessage(post, update).run(events, output_key=output_key)
+
+
+def stream_to_ephemeral(respond, events, output_key: str = "text") -> str:
+    # エフェメラルメッセージは chat.update できないため response_url で置き換えます
+    # response_url は 30 分で 5 回までしか使えないので、更新回数を制限します
+    def post(text):
+        respond(text=text, response_type="ephemeral")
+
+    def update(text):
+        respond(text=text, response_type="ephemeral", replace_original=True)
+
+    return ProgressiveMessage(post, update, max_updates=4).run(
+        events, output_key=output_key
+    )
+
+
+async def astream_to_message(
+    client: "AsyncWebClient",
+    channel: str,
+    events,
+    thread_ts: str = None,
+    output_key: str = "text",
+) -> str:
+    posted = {}
+
+    async def post(text):
+        response = await client.chat_postMessage(
+            channel=channel, thread_ts=thread_ts, text=text
+        )
+        posted["channel"] = response["channel"]
+        posted["ts"] = response["ts"]
+
+    async def update(text):
+        await client.chat_update(channel=posted["channel"], ts=posted["ts"], text=text)
+
+    return await ProgressiveMessage(post, update).arun(events, output_key=output_key)
+
+
+async def astream_to_ephemeral(respond, events, output_key: str = "text") -> str:
+    async def post(text):
+        await respond(text=text, response_type="ephemeral")
+
+    async def update(text):
+        await respond(text=text, response_type="ephemeral", replace_original=True)
+
+    return await ProgressiveMessage(post, update, max_updates=4).arun(
+        events, output_key=output_key
+    )
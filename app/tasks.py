@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Dify に渡すタスクのフィールド（due などこちらで付けたものは渡しません）
+PROMPT_FIELDS = ("id", "term", "description", "status")
+
+
+def task_id(task: dict) -> str:
+    # Dify が ID を返さなかったタスクは、内容から ID を決めます
+    source = " ".join(str(task.get("description") or "").split())
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+
+def assign_ids(tasks: list) -> list:
+    # Dify から受け取ったタスクに重複しない ID を付けます（渡した ID が返ってきたらそのまま使います）
+    seen = set()
+    result = []
+    for index, task in enumerate(tasks):
+        id = str(task.get("id") or task_id(task))
+        if id in seen:
+            id = f"{id}-{index}"
+        seen.add(id)
+        result.append({**task, "id": id})
+    return result
+
+
+def serialize_tasks(tasks: list) -> str:
+    # Dify の task_list 入力（保存済みのタスク一覧）
+    return json.dumps(
+        [{key: task.get(key) for key in PROMPT_FIELDS} for task in tasks],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+class TaskStore:
+    # タスク抽出の結果をチャンネルごとに SQLite に保存します（再起動しても消えず、ワーカー間で共有されます）
+    # 最後に抽出したメッセージの ts も保存し、次回はそれより新しいメッセージと保存済みのタスク一覧だけを
+    # Dify に渡して差分で更新します。チャンネルが長くなってもプロンプトの大きさと処理時間は一定です
+    # incremental=False なら、これまでどおり毎回すべてのメッセージから抽出し直します
+
+    def __init__(self, path: str, incremental: bool = True):
+        self.path = path
+        self.incremental = incremental
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " channel TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " task TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (channel, id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_cursors ("
+            " channel TEXT PRIMARY KEY,"
+            " last_ts TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.stats = {
+            "updates": 0,
+            "unchanged": 0,
+            "conflicts": 0,
+            "refused": 0,
+            "new_messages": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("TASKS_PATH") or state_path("tasks.sqlite3"),
+            incremental=os.environ.get("TASKS_INCREMENTAL", "false").lower()
+            in ("1", "true", "yes"),
+        )
+
+    def cursor(self, channel: str):
+        # 最後に抽出したメッセージの ts（まだ抽出していなければ None）
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_ts FROM task_cursors WHERE channel = ?", (channel,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def list(self, channel: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task FROM tasks WHERE channel = ? ORDER BY position", (channel,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pending(self, channel: str, messages: list) -> tuple:
+        # (前回の ts, Dify に渡すタスク一覧, Dify に渡すメッセージ) を返します
+        # 差分更新でメッセージが空なら、Dify を呼ばずに保存済みの一覧を使ってください
+        last_ts = self.cursor(channel)
+        if not self.incremental or last_ts is None:
+            return last_ts, [], messages
+
+        new = [m for m in messages if float(m["ts"]) > float(last_ts)]
+        with self._lock:
+            self.stats["new_messages"] += len(new)
+            if not new:
+                self.stats["unchanged"] += 1
+        return last_ts, self.list(channel), new
+
+    def replace(self, channel: str, tasks: list, last_ts: str, expected_ts: str):
+        # タスク一覧を置き換えて ts を進めます。ID が同じタスクは作成時刻を引き継ぎます
+        # 別のワーカーが先に更新していたら（ts が expected_ts でなければ）何もせず None を返します
+        # 差分更新で保存済みのタスクを渡したのに空の一覧が返ってきたら、ワークフローの失敗とみなして
+        # 保存済みの一覧を消さずに None を返します（ts も進めないので、次回もう一度抽出します）
+        tasks = assign_ids(tasks)
+        now = time.time()
+        with self._lock:
+            if self.incremental and not tasks and expected_ts is not None:
+                stored = self._conn.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE channel = ?", (channel,)
+                ).fetchone()[0]
+                if stored:
+                    logger.warning(
+                        f"refused to drop {stored} tasks: workflow returned no tasks"
+                    )
+                    self.stats["refused"] += 1
+                    return None
+            try:
+                if expected_ts is None:
+                    cursor = self._conn.execute(
+                        "INSERT INTO task_cursors VALUES (?, ?, ?)"
+                        " ON CONFLICT (channel) DO NOTHING",
+                        (channel, last_ts, now),
+                    )
+                else:
+                    cursor = self._conn.execute(
+                        "UPDATE task_cursors SET last_ts = ?, updated_at = ?"
+                        " WHERE channel = ? AND last_ts = ?",
+                        (last_ts, now, channel, expected_ts),
+                    )
+                if not cursor.rowcount:
+                    self._conn.rollback()
+                    self.stats["conflicts"] += 1
+                    return None
+
+                self._conn.executemany(
+                    "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (channel, id) DO UPDATE SET"
+                    " position = excluded.position, task = excluded.task,"
+                    " updated_at = excluded.updated_at",
+                    [
+                        (
+                            channel,
+                            task["id"],
+                            position,
+                            json.dumps(task, ensure_ascii=False),
+                            now,
+                            now,
+                        )
+                        for position, task in enumerate(tasks)
+                    ],
+                )
+                ids = [task["id"] for task in tasks]
+                self._conn.execute(
+                    "DELETE FROM tasks WHERE channel = ?"
+                    f" AND id NOT IN ({','.join('?' * len(ids))})",
+                    (channel, *ids),
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self.stats["updates"] += 1
+        return tasks
@@ -0,0 +1,269 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from slack_bolt import Ack
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット（秒）。Slack の ack 期限（3 秒）から Dify の長い生成までを覆います
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "slackbot"
+
+# 同じ処理（ジョブ 1 件など）で記録したスパンをまとめる ID
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def _metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(parts))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def request_kind(body: dict) -> str:
+    # ack の時間を分類するためのラベル（イベントの種類・コマンド名など）
+    event = body.get("event")
+    if isinstance(event, dict) and event.get("type"):
+        return f"event:{event['type']}"
+    if body.get("command"):
+        return f"command:{body['command']}"
+    return body.get("type") or "unknown"
+
+
+class _NoopSpan:
+    # 無効なときに返すスパン。何も記録しません
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **labels):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer, name: str, labels: dict):
+        self.tracer = tracer
+        self.name = name
+        self.labels = labels
+
+    def set(self, **labels):
+        # 処理の途中で分かったラベル（履歴の取得方法など）を追加します
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.labels["error"] = exc_type.__name__
+        self.tracer.observe(self.name, duration, **self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Tracer:
+    # Slack / Dify への呼び出しやハンドラーの処理時間をスパンとして記録します
+    # Prometheus 形式のヒストグラムを HTTP で公開し、必要なら JSON Lines でスパンを書き出します
+    # 無効なとき span() は何もしないオブジェクトを返すだけです
+
+    def __init__(self, enabled: bool = False, trace_log: str = None):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) : Histogram
+        self._collectors = []
+        self._trace_file = open(trace_log, "a", buffering=1) if trace_log else None
+        self._server = None
+
+    @classmethod
+    def from_env(cls):
+        # METRICS_PORT か TRACE_LOG_PATH を設定すると有効になります
+        metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+        trace_log = os.environ.get("TRACE_LOG_PATH") or None
+        return cls(enabled=bool(metrics_port or trace_log), trace_log=trace_log)
+
+    def span(self, name: str, **labels):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+        if self._trace_file is not None:
+            record = {
+                "ts": time.time(),
+                "trace": _trace_id.get(),
+                "span": name,
+                "seconds": round(seconds, 6),
+                **labels,
+            }
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            with self._lock:
+                self._trace_file.write(line + "\n")
+
+    def new_trace(self):
+        # 以降このコンテキストで記録するスパンに共通の ID を付けます
+        if self.enabled:
+            _trace_id.set(uuid.uuid4().hex[:16])
+
+    def timed_ack(self, kind: str) -> Ack:
+        # ack() が呼ばれるまでの時間を記録する Ack（Bolt の context["ack"] に差し込みます）
+        return _TimedAck(self, kind, time.perf_counter())
+
+    def timed_async_ack(self, kind: str):
+        # 非同期版は aiohttp を読み込むので、同期版の起動を遅くしないよう別モジュールに置いています
+        from async_tracing import TimedAsyncAck
+
+        return TimedAsyncAck(self, kind, time.perf_counter())
+
+    def register(self, name: str, stats, label: str = None):
+        # 既存の stats()（dict を返す関数）をゲージとして公開します
+        # label を指定すると、最上位のキーをそのラベルの値として扱います
+        self._collectors.append((name, stats, label))
+
+    def _collect(self):
+        for name, stats, label in self._collectors:
+            try:
+                values = stats() if callable(stats) else stats
+                if label is None:
+                    yield from _samples(name, values, ())
+                else:
+                    for key, inner in values.items():
+                        if isinstance(inner, dict):
+                            yield from _samples(name, inner, ((label, key),))
+            except Exception:
+                logger.exception(f"failed to collect {name} stats")
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = [
+                (key, list(h.counts), h.sum, h.count)
+                for key, h in sorted(self._histograms.items(), key=lambda kv: kv[0][0])
+            ]
+
+        declared = set()
+        for (name, labels), counts, total, count in histograms:
+            metric = _metric_name(METRIC_PREFIX, name, "seconds")
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                bucket_labels = labels + (("le", bound),)
+                lines.append(f"{metric}_bucket{_label_text(bucket_labels)} {cumulative}")
+            lines.append(f"{metric}_sum{_label_text(labels)} {total}")
+            lines.append(f"{metric}_count{_label_text(labels)} {count}")
+
+        # 同じメトリクスの行はまとめて出力する必要があります
+        gauges = {}
+        for name, labels, value in self._collect():
+            metric = _metric_name(METRIC_PREFIX, name)
+            gauges.setdefault(metric, []).append(f"{metric}{_label_text(labels)} {value}")
+        for metric, samples in gauges.items():
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        # /metrics を返す HTTP サーバーをバックグラウンドで起動します
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"metrics endpoint listening on :{port}/metrics")
+
+    def serve_from_env(self):
+        # 複数ワーカーで動かすときは METRICS_PORT + WORKER_ID で待ち受けます
+        port = int(os.environ.get("METRICS_PORT", "0"))
+        if port:
+            self.serve(port + int(os.environ.get("WORKER_ID", "0")))
+
+
+def _samples(name: str, values: dict, labels: tuple):
+    # 数値はそのまま、数値の dict は key ラベル付きで返します（それ以外は無視します）
+    for key, value in values.items():
+        if isinstance(value, (int, float)):
+            yield _metric_name(name, key), labels, float(value)
+        elif isinstance(value, dict):
+            for sub, inner in value.items():
+                if isinstance(inner, (int, float)):
+                    yield _metric_name(name, key), labels + (("key", sub),), float(inner)
+
+
+class _TimedAck(Ack):
+    def __init__(self, tracer: Tracer, kind: str, start: float):
+        super().__init__()
+        self._tracer = tracer
+        self._kind = kind
+        self._start = start
+
+    def __call__(self, *args, **kwargs):
+        if self.response is None:
+            self._tracer.observe("ack", time.perf_counter() - self._start, type=self._kind)
+        return super().__call__(*args, **kwargs)
+
+
+# アプリ全体で 1 つのトレーサーを使います
+tracer = Tracer.from_env()
@@ -0,0 +1,357 @@
+# モーダルやメッセージの Block Kit を組み立てます
+# 同期版（main.py）と非同期版（async_main.py）の両方から使います
+
+### ショートカットアプリ１
+APP1_SHORTCUT_ID = "test_shortcut1"
+APP1_CALLBACK_ID = "APP_1_CALLBACK_ID"
+APP1_MODAL1_BLOCK1_ID = "APP1_MODAL1_BLOCK1_ID"
+APP1_MODAL1_BLOCK1_ACTIONID = "APP1_MODAL1_BLOCK1_ID"
+APP1_MODAL1_BLOCK2_ID = "APP1_MODAL1_BLOCK2_ID"
+APP1_MODAL1_BLOCK2_ACTIONID = "APP1_MODAL1_BLOCK2_ACTIONID"
+APP1_MODAL1_BLOCK3_ID = "APP1_MODAL1_BLOCK3_ID"
+APP1_MODAL1_BLOCK3_ACTIONID = "APP1_MODAL1_BLOCK3_ACTIONID"
+APP1_MODAL1_BLOCK4_ID = "APP1_MODAL1_BLOCK4_ID"
+APP1_MODAL1_BLOCK4_ACTIONID = "APP1_MODAL1_BLOCK4_ACTIONID"
+APP1_MODAL1_BLOCK5_ID = "APP1_MODAL1_BLOCK5_ID"
+APP1_MODAL1_BLOCK5_ACTIONID = "APP1_MODAL1_BLOCK5_ACTIONID"
+
+### ショートカットアプリ２
+APP2_SHORTCUT_ID = "task_manager_001"
+APP2_CALLBACK_ID = "APP2_CALLBACK_ID"
+APP2_MODAL1_BLOCK1_ID = "APP2_MODAL1_BLOCK1_ID"
+APP2_MODAL1_BLOCK1_ACTIONID = "APP2_MODAL1_BLOCK1_ACTIONID"
+APP2_MODAL1_BLOCK2_ID = "APP2_MODAL1_BLOCK2_ID"
+APP2_MODAL1_BLOCK2_ACTIONID = "APP2_MODAL1_BLOCK2_ACTIONID"
+APP2_MODAL1_BLOCK3_ID = "APP2_MODAL1_BLOCK3_ID"
+APP2_MODAL1_BLOCK3_ACTIONID = "APP2_MODAL1_BLOCK3_ACTIONID"
+APP2_MODAL1_BLOCK4_ID = "APP2_MODAL1_BLOCK4_ID"
+APP2_MODAL1_BLOCK4_ACTIONID = "APP2_MODAL1_BLOCK4_ACTIONID"
+
+## ショートカットアプリ２
+APP3_SHORTCUT_ID = "test_shortcut3"
+APP3_CALLBACK_ID = "APP_3_CALLBACK_ID"
+
+
+# Slack の上限。超えると API がエラーを返すので、送信前に切り詰めます
+# https://api.slack.com/reference/block-kit
+TEXT_LIMIT = 3000  # section の text / plain_text_input の initial_value
+OPTION_TEXT_LIMIT = 75  # option の text / description
+OPTION_VALUE_LIMIT = 150
+CHECKBOX_OPTIONS_LIMIT = 10
+ALT_TEXT_LIMIT = 2000
+MODAL_BLOCKS_LIMIT = 100
+MESSAGE_BLOCKS_LIMIT = 50
+
+
+def truncate(text, limit: int) -> str:
+    if not isinstance(text, str):
+        text = f"{text}"
+    if len(text) <= limit:
+        return text
+    return text[: limit - 1] + "…"
+
+
+# 値を差し込まないブロックはインポート時に一度だけ組み立てて、そのまま使い回します（書き換えないこと）
+# 値を差し込むブロックとモーダル本体は、テンプレートをコピーするより速いので毎回そのまま組み立てます
+
+_APP1_BLOCK_2 = {
+    "type": "actions",
+    "elements": [
+        {
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "やわらかくする",
+            },
+            "value": "click_me_123",
+            "action_id": APP1_MODAL1_BLOCK2_ACTIONID,
+        }
+    ],
+}
+
+_APP2_BLOCK_1 = {
+    "type": "actions",
+    "block_id": APP2_MODAL1_BLOCK1_ID,
+    "elements": [
+        {
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "タスク取得",
+            },
+            "value": "click_me_123",
+            "action_id": APP2_MODAL1_BLOCK1_ACTIONID,
+        }
+    ],
+}
+
+_APP2_BLOCK_3 = {
+    "type": "input",
+    "block_id": APP2_MODAL1_BLOCK3_ID,
+    "element": {
+        "type": "plain_text_input",
+        "action_id": APP2_MODAL1_BLOCK3_ACTIONID,
+        "multiline": True,
+    },
+    "label": {"type": "plain_text", "text": "変更ある？？"},
+}
+
+_APP2_BLOCK_4 = {
+    "type": "actions",
+    "block_id": APP2_MODAL1_BLOCK4_ID,
+    "elements": [
+        {
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "お願い！",
+            },
+            "value": "click_me_123",
+            "action_id": APP2_MODAL1_BLOCK4_ACTIONID,
+        }
+    ],
+}
+
+_DIVIDER = {"type": "divider"}
+_REFERENCES_HEADER = {
+    "type": "section",
+    "text": {"type": "mrkdwn", "text": "関連ドキュメント"},
+}
+
+_SUBMIT = {"type": "plain_text", "text": "送信"}
+_CLOSE = {"type": "plain_text", "text": "閉じる"}
+
+
+def _text_input(block_id: str, action_id: str, label: str, value: str = None) -> dict:
+    element = {"type": "plain_text_input", "action_id": action_id, "multiline": True}
+    if value:
+        element["initial_value"] = truncate(value, TEXT_LIMIT)
+    return {
+        "type": "input",
+        "block_id": block_id,
+        "element": element,
+        "label": {"type": "plain_text", "text": label},
+    }
+
+
+_EMPTY_VIEWS = {}
+
+
+def _empty_view(builder, callback_id: str) -> dict:
+    # ショートカット直後の空のモーダルは毎回同じなので使い回します（返り値は書き換えないこと）
+    key = (builder, callback_id)
+    view = _EMPTY_VIEWS.get(key)
+    if view is None:
+        view = _EMPTY_VIEWS[key] = builder(callback_id)
+    return view
+
+
+def _reference_options(references: list) -> list:
+    # 件数が多いので、truncate は上限を超えたときだけ呼びます
+    options = []
+    for ref in references[:CHECKBOX_OPTIONS_LIMIT]:
+        name, content, value = (
+            f"{ref['document_name']}",
+            f"{ref['content']}",
+            f"{ref['segment_id']}",
+        )
+        if len(name) > OPTION_TEXT_LIMIT:
+            name = truncate(name, OPTION_TEXT_LIMIT)
+        if len(content) > OPTION_TEXT_LIMIT:
+            content = truncate(content, OPTION_TEXT_LIMIT)
+        if len(value) > OPTION_VALUE_LIMIT:
+            value = truncate(value, OPTION_VALUE_LIMIT)
+        options.append(
+            {
+                "text": {"type": "mrkdwn", "text": name},
+                "description": {"type": "mrkdwn", "text": content},
+                "value": value,
+            }
+        )
+    return options
+
+
+def app1_create_view(
+    callback_id: str,
+    message: str = None,
+    created_message: str = None,
+    references: dict = None,
+    initial_user: str = None,
+):
+
+    if not (message or created_message):
+        return _empty_view(_app1_view, callback_id)
+    return _app1_view(callback_id, message, created_message, references, initial_user)
+
+
+def _app1_view(
+    callback_id: str,
+    message: str = None,
+    created_message: str = None,
+    references: dict = None,
+    initial_user: str = None,
+):
+
+    blocks = [
+        _text_input(
+            APP1_MODAL1_BLOCK1_ID, APP1_MODAL1_BLOCK1_ACTIONID, "送りたい内容", message
+        ),
+        _APP1_BLOCK_2,
+    ]
+
+    if created_message:
+        blocks.append(
+            _text_input(
+                APP1_MODAL1_BLOCK3_ID,
+                APP1_MODAL1_BLOCK3_ACTIONID,
+                "やわらか",
+                created_message,
+            )
+        )
+
+        accessory = {
+            "type": "users_select",
+            "action_id": APP1_MODAL1_BLOCK4_ACTIONID,
+            "placeholder": {
+                "type": "plain_text",
+                "text": "Select a user",
+                "emoji": True,
+            },
+        }
+        if initial_user:
+            accessory["initial_user"] = initial_user
+        blocks.append(
+            {
+                "type": "section",
+                "block_id": APP1_MODAL1_BLOCK4_ID,
+                "text": {"type": "mrkdwn", "text": "送信先を選択"},
+                "accessory": accessory,
+            }
+        )
+
+        if references:
+            blocks.append(
+                {
+                    "type": "section",
+                    "block_id": APP1_MODAL1_BLOCK5_ID,
+                    "text": {"type": "mrkdwn", "text": "関連ドキュメントを選択（任意）"},
+                    "accessory": {
+                        "type": "checkboxes",
+                        "action_id": APP1_MODAL1_BLOCK5_ACTIONID,
+                        "options": _reference_options(references),
+                    },
+                }
+            )
+
+    return {
+        "type": "modal",
+        "callback_id": callback_id,
+        "title": {"type": "plain_text", "text": "やわらかコミュニケーター"},
+        "submit": _SUBMIT,
+        "close": _CLOSE,
+        "blocks": blocks[:MODAL_BLOCKS_LIMIT],
+    }
+
+
+def app2_create_view(callback_id: str, task_list: list = None):
+
+    if not task_list:
+        return _empty_view(_app2_view, callback_id)
+    return _app2_view(callback_id, task_list)
+
+
+def _app2_view(callback_id: str, task_list: list = None):
+
+    blocks = [_APP2_BLOCK_1]
+
+    if task_list:
+
+        task_str = [
+            f"{task['term']} {task['description']} {task['status']}"
+            for task in task_list
+        ]
+        task_str = "\n".join(task_str)
+
+        blocks.append(
+            _text_input(
+                APP2_MODAL1_BLOCK2_ID, APP2_MODAL1_BLOCK2_ACTIONID, "タスク", task_str
+            )
+        )
+        blocks.append(_APP2_BLOCK_3)
+        blocks.append(_APP2_BLOCK_4)
+
+    return {
+        "type": "modal",
+        "callback_id": callback_id,
+        "title": {"type": "plain_text", "text": "モーダル"},
+        "submit": _SUBMIT,
+        "close": _CLOSE,
+        # 先読みを破棄するため、閉じたときに view_closed を受け取ります
+        "notify_on_close": True,
+        "blocks": blocks[:MODAL_BLOCKS_LIMIT],
+    }
+
+
+def app1_message_blocks(
+    selected_user: str,
+    sender_id: str,
+    created_message: str,
+    image_url: str = None,
+    prompt: str = None,
+    selected_references_options: list = None,
+):
+
+    message_block = {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": truncate(created_message, TEXT_LIMIT),
+        },
+    }
+    # 画像は後から chat.update で追加されることがあります
+    if image_url:
+        message_block["accessory"] = {
+            "type": "image",
+            "image_url": f"{image_url}",
+            "alt_text": truncate(prompt, ALT_TEXT_LIMIT),
+        }
+
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"<@{selected_user}> さんへ <@{sender_id}> さんからメッセージが届いています。",
+            },
+        },
+        _DIVIDER,
+        message_block,
+        _DIVIDER,
+        _REFERENCES_HEADER,
+        {
+            "type": "rich_text",
+            "elements": [
+                {
+                    "type": "rich_text_list",
+                    "style": "bullet",
+                    "elements": [
+                        {
+                            "type": "rich_text_section",
+                            "elements": [
+                                {
+                                    "type": "text",
+                                    "text": f"{ref['text']['text']}:\n",
+                                },
+                                {
+                                    "type": "text",
+                                    "text": f"{ref['description']['text']}:\n",
+                                },
+                            ],
+                        }
+                        for ref in selected_references_options or []
+                    ],
+                }
+            ],
+        },
+    ]
+    return blocks[:MESSAGE_BLOCKS_LIMIT]
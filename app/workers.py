@@ -0,0 +1,78 @@
+import atexit
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count() -> int:
+    # このプロセスを含めた、Socket Mode で接続しているワーカーの数
+    # 子プロセスには SOCKET_MODE_WORKERS=1 を渡すので、全体の数は WORKER_COUNT で受け取ります
+    return int(
+        os.environ.get("WORKER_COUNT") or os.environ.get("SOCKET_MODE_WORKERS", "1")
+    )
+
+
+class WorkerPool:
+    # Socket Mode の接続を複数のプロセスに分けて張ります
+    # Slack はイベントを接続ごとに振り分けるので、プロセス数に応じて処理能力が増えます（最大 10 接続）
+    # 自分自身もワーカー 0 として動き、残りのワーカーを子プロセスとして起動・監視します
+
+    def __init__(self, count: int, script: str, restart_delay: float = 5.0):
+        self.count = count
+        self.script = script
+        self.restart_delay = restart_delay
+        self._processes = {}
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, script: str):
+        return cls(
+            int(os.environ.get("SOCKET_MODE_WORKERS", "1")),
+            script,
+            restart_delay=float(os.environ.get("WORKER_RESTART_DELAY", "5")),
+        )
+
+    def _spawn(self, worker_id: int):
+        # 子プロセスは同じスクリプトを 1 ワーカーとして起動します（状態はワーカーごとに別です）
+        env = {
+            **os.environ,
+            "SOCKET_MODE_WORKERS": "1",
+            "WORKER_ID": str(worker_id),
+            "WORKER_COUNT": str(self.count),
+        }
+        process = subprocess.Popen([sys.executable, self.script], env=env)
+        self._processes[worker_id] = process
+        logger.info(f"started worker {worker_id} (pid {process.pid})")
+
+    def _watch(self):
+        # 落ちたワーカーを再起動します
+        while not self._stopped.wait(self.restart_delay):
+            for worker_id, process in list(self._processes.items()):
+                if process.poll() is not None and not self._stopped.is_set():
+                    logger.warning(
+                        f"worker {worker_id} exited with {process.returncode}, restarting"
+                    )
+                    self._spawn(worker_id)
+
+    def start(self):
+        for worker_id in range(1, self.count):
+            self._spawn(worker_id)
+        if self.count > 1:
+            threading.Thread(target=self._watch, name="workers", daemon=True).start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped.set()
+        for process in self._processes.values():
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes.values():
+            try:
+                process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -0,0 +1,429 @@
+# 実際の Slack / Dify なしで app/main.py の全ハンドラーを動かす負荷試験です
+# Slack Web API と Dify はローカルの偽サーバーに置き換え、Socket Mode で届くエンベロープ（bench/envelopes.jsonl）を
+# SocketModeHandler と同じく app.dispatch() に渡して再生します
+# スループット、ack までの時間、最後の Slack 呼び出しまでの時間（end-to-end）、外部呼び出しの回数を表示します
+#
+# 実行方法: python bench/bench_app.py [--requests 500] [--concurrency 8] [--dify-latency 0.2] ...
+# アプリの設定（DIFY_STREAMING、APP2_PREFETCH、JOB_CONCURRENCY など）は環境変数でそのまま指定できます
+#
+# エンベロープのファイルは Socket Mode のエンベロープを 1 行ずつ並べたものです。次の文字列を置き換えて使います
+#   @N@     リクエストの通し番号（6 桁）。ID に BENCH@N@ を含めると、その番号の処理として Slack 呼び出しを数えます
+#   @C@     チャンネル番号（--channels で分散させます）
+#   @SLACK@ 偽の Slack サーバーの URL（response_url 用）
+
+import argparse
+import collections
+import json
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+ENVELOPES_PATH = os.path.join(os.path.dirname(__file__), "envelopes.jsonl")
+
+# Slack 呼び出しをどのリクエストの処理かに対応付けるための ID
+OWNER_PATTERN = re.compile(r"BENCH(\d{6})")
+
+
+class Activity:
+    # 偽サーバーが受けた呼び出しの記録（リクエストごとの最後の Slack 呼び出し時刻など）
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slack_calls = collections.Counter()
+        self.dify_calls = collections.Counter()
+        self.dify_errors = 0
+        self.last_call = {}  # 通し番号 : 最後の Slack 呼び出しの時刻
+        self.ts_owners = {}  # ts : 通し番号
+        self.updated_at = time.perf_counter()
+        self._seq = 0
+
+    def owner(self, text: str, params: dict):
+        match = OWNER_PATTERN.search(text)
+        if match:
+            return int(match.group(1))
+        for key in ("ts", "thread_ts"):
+            value = params.get(key)
+            if value in self.ts_owners:
+                return self.ts_owners[value]
+        return None
+
+    def slack(self, method: str, text: str, params: dict):
+        now = time.perf_counter()
+        with self.lock:
+            self.slack_calls[method] += 1
+            self.updated_at = now
+            owner = self.owner(text, params)
+            if owner is not None:
+                self.last_call[owner] = now
+            return owner
+
+    def new_ts(self, owner) -> str:
+        with self.lock:
+            self._seq += 1
+            ts = f"1800000000.{self._seq:06d}"
+            if owner is not None:
+                self.ts_owners[ts] = owner
+            return ts
+
+    def dify(self, app: str, error: bool):
+        with self.lock:
+            self.dify_calls[app] += 1
+            self.dify_errors += error
+            self.updated_at = time.perf_counter()
+
+
+activity = Activity()
+
+
+def history_messages(count: int) -> list:
+    return [
+        {
+            "type": "message",
+            "user": f"U{i % 5:04d}",
+            "ts": f"{1700000000 - count + i}.000100",
+            "text": f"議事録の修正と資料の確認をお願いします（{i}）。" * 2,
+        }
+        for i in reversed(range(count))
+    ]
+
+
+class FakeSlack(BaseHTTPRequestHandler):
+    # Slack Web API（/api/<method>）と response_url（/response/...）の代わり
+    latency = 0.01
+    history = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        text = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if "json" in (self.headers.get("Content-Type") or ""):
+            params = json.loads(text or "{}")
+        else:
+            params = dict(parse_qsl(text))
+        time.sleep(self.latency)
+
+        if self.path.startswith("/response/"):
+            activity.slack("response_url", self.path, params)
+            self._reply({"ok": True})
+            return
+
+        method = self.path.rsplit("/", 1)[-1].split("?")[0]
+        owner = activity.slack(method, self.path + text, params)
+        self._reply(self.respond(method, params, owner))
+
+    def respond(self, method: str, params: dict, owner) -> dict:
+        if method == "auth.test":
+            return {"ok": True, "user_id": "UBENCHBOT", "bot_id": "BBENCH", "team_id": "T0BENCH"}
+        if method == "users.list":
+            members = [
+                {"id": f"U{i:04d}", "name": f"user{i}", "profile": {"display_name": f"ユーザー{i}"}}
+                for i in range(5)
+            ]
+            return {"ok": True, "members": members}
+        if method == "conversations.list":
+            channels = [{"id": "CBENCHTASKS", "name": "user1-bot"}]
+            return {"ok": True, "channels": channels}
+        if method in ("conversations.history", "conversations.replies"):
+            # oldest 付き（差分取得）は新着なしとして返します
+            messages = [] if params.get("oldest") else self.history
+            limit = int(params.get("limit") or 100)
+            return {"ok": True, "messages": messages[:limit], "has_more": False}
+        if method == "conversations.members":
+            return {"ok": True, "members": [f"U{i:04d}" for i in range(5)]}
+        if method == "views.open":
+            suffix = f"BENCH{owner:06d}" if owner is not None else "BENCHOPEN"
+            return {"ok": True, "view": {"id": f"V{suffix}", "hash": "hash"}}
+        if method == "views.update":
+            return {"ok": True, "view": {"id": params.get("view_id"), "hash": "hash"}}
+        if method in ("chat.postMessage", "chat.update"):
+            ts = params.get("ts") or activity.new_ts(owner)
+            return {"ok": True, "channel": params.get("channel"), "ts": ts}
+        if method == "chat.postEphemeral":
+            return {"ok": True, "message_ts": activity.new_ts(owner)}
+        if method == "chat.scheduleMessage":
+            return {"ok": True, "scheduled_message_id": "QBENCH", "post_at": params.get("post_at")}
+        return {"ok": True}
+
+
+# Dify アプリごとの出力
+DIFY_OUTPUTS = {
+    "APP1": {
+        "result": "お手すきの際に、資料の修正をお願いできますでしょうか。",
+        "knowledge": [
+            {
+                "metadata": {"document_name": f"就業規則 {i}", "segment_id": f"seg-{i}"},
+                "content": "業務の依頼は相手の状況に配慮して行うこと。" * 3,
+            }
+            for i in range(5)
+        ],
+    },
+    "APP2": {"prompt": "a cat with a burger", "url": "https://example.com/cat.png"},
+    "APP3": {
+        "task_list": [
+            {"term": f"10月{20 + i}日", "description": f"資料 {i} の修正", "status": "未着手"}
+            for i in range(10)
+        ]
+    },
+    "APP4": {"text": "了解です。明日の定例の議題を整理しますね。" * 4},
+}
+
+
+class FakeDify(BaseHTTPRequestHandler):
+    # Dify のワークフロー実行 API の代わり（blocking / streaming、エラー率を指定できます）
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    chunks = 5
+    error_rate = 0.0
+    tokens = {f"app-bench-{app}": app for app in DIFY_OUTPUTS}
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+        app = self.tokens.get(token, "unknown")
+        error = random.random() < self.error_rate
+        activity.dify(app, error)
+
+        if error:
+            time.sleep(self.latency / 10)
+            body = b'{"code": "internal_error"}'
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        outputs = DIFY_OUTPUTS.get(app, {})
+        if payload.get("response_mode") == "streaming":
+            self.stream(outputs)
+            return
+
+        time.sleep(self.latency)
+        body = json.dumps({"data": {"status": "succeeded", "outputs": outputs}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, outputs: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(event: dict):
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+            self.wfile.flush()
+
+        send({"event": "workflow_started", "data": {}})
+        text = str(outputs.get("text", ""))
+        size = max(1, len(text) // self.chunks)
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / self.chunks)
+            send({"event": "text_chunk", "data": {"text": text[start : start + size]}})
+        send({"event": "workflow_finished", "data": {"outputs": outputs}})
+
+
+def serve(handler) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_envelopes(path: str) -> list:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def label(body: dict) -> str:
+    # 集計用の名前（イベントの種類・コマンド・callback_id・action_id）
+    if body.get("event"):
+        return f"event:{body['event'].get('type')}"
+    if body.get("command"):
+        return body["command"]
+    kind = body.get("type")
+    if kind == "block_actions":
+        return f"action:{body['actions'][0]['action_id']}"
+    callback_id = body.get("callback_id") or (body.get("view") or {}).get("callback_id")
+    return f"{kind}:{callback_id}"
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def wait_idle(jobs, quiet: float, timeout: float):
+    # ジョブキューが空になり、偽サーバーへの呼び出しが quiet 秒途絶えるまで待ちます
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        busy = any(
+            lane["depth"] or lane["running"] for lane in jobs.stats().values()
+        )
+        if not busy and time.perf_counter() - activity.updated_at > quiet:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に dispatch する数")
+    parser.add_argument("--channels", type=int, default=20, help="メッセージを分散させるチャンネル数")
+    parser.add_argument("--envelopes", default=ENVELOPES_PATH)
+    parser.add_argument("--dify-latency", type=float, default=0.2)
+    parser.add_argument("--dify-chunks", type=int, default=5, help="streaming 時のチャンク数")
+    parser.add_argument("--dify-error-rate", type=float, default=0.0)
+    parser.add_argument("--slack-latency", type=float, default=0.01)
+    parser.add_argument("--history", type=int, default=50, help="conversations.history の件数")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    FakeDify.latency = args.dify_latency
+    FakeDify.chunks = args.dify_chunks
+    FakeDify.error_rate = args.dify_error_rate
+    FakeSlack.latency = args.slack_latency
+    FakeSlack.history = history_messages(args.history)
+    slack_server = serve(FakeSlack)
+    dify_server = serve(FakeDify)
+    slack_url = f"http://127.0.0.1:{slack_server.server_port}"
+
+    # main.py は読み込み時に環境変数から各部品を作るので、先に偽サーバーを指しておきます
+    defaults = {
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_APP_TOKEN": "xapp-bench",
+        "SLACK_API_URL": f"{slack_url}/api/",
+        "DIFY_API_APP_URL": f"http://127.0.0.1:{dify_server.server_port}/v1/workflows/run",
+        "DIFY_API_TOKEN_USER": "bench",
+        "TASKS_CHANNEL": "CBENCHTASKS",
+        "WEBHOOK_URL_UBENCHTARGET": f"{slack_url}/webhook",
+        "LOG_LEVEL": "WARNING",
+        "REMINDERS_PATH": os.path.join(tempfile.mkdtemp(), "reminders.sqlite3"),
+        "TASKS_PATH": os.path.join(tempfile.mkdtemp(), "tasks.sqlite3"),
+        **{f"DIFY_API_{app}_TOKEN": f"app-bench-{app}" for app in DIFY_OUTPUTS},
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+    # blocks だけの投稿に対する slack_sdk の警告は集計の邪魔なので抑えます
+    warnings.filterwarnings("ignore", category=UserWarning, module="slack_sdk")
+    from slack_bolt.request import BoltRequest
+
+    import main as bot
+
+    bot.directory.load(bot.app.client)
+
+    templates = load_envelopes(args.envelopes)
+    requests = queue.Queue()
+    kinds = {}
+    for n in range(args.requests):
+        text = (
+            templates[n % len(templates)]
+            .replace("@N@", f"{n:06d}")
+            .replace("@C@", f"{n % args.channels:04d}")
+            .replace("@SLACK@", slack_url)
+        )
+        body = json.loads(text)["payload"]
+        kinds[n] = label(body)
+        event = body.get("event") or {}
+        for key in ("ts", "thread_ts"):
+            if event.get(key):
+                activity.ts_owners[event[key]] = n
+        requests.put((n, body))
+
+    started = {}
+    acked = {}
+    statuses = collections.Counter()
+
+    def worker():
+        while True:
+            try:
+                n, body = requests.get_nowait()
+            except queue.Empty:
+                return
+            started[n] = time.perf_counter()
+            response = bot.app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+            acked[n] = time.perf_counter()
+            statuses[response.status] += 1
+
+    print(
+        f"requests={args.requests} concurrency={args.concurrency} envelopes={len(templates)}"
+        f" dify_latency={args.dify_latency}s error_rate={args.dify_error_rate}"
+        f" streaming={os.environ.get('DIFY_STREAMING', 'false')}"
+    )
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dispatched = time.perf_counter()
+    if not wait_idle(bot.jobs, quiet=0.5, timeout=args.timeout):
+        print("timed out waiting for background jobs")
+
+    # end-to-end はその処理の最後の Slack 呼び出しまで（呼び出しがなければ ack まで）
+    finished = {n: max(acked[n], activity.last_call.get(n, 0)) for n in acked}
+    elapsed = max(finished.values()) - begin
+    ack_ms = {n: (acked[n] - started[n]) * 1000 for n in acked}
+    e2e_ms = {n: (finished[n] - started[n]) * 1000 for n in acked}
+
+    print(
+        f"elapsed {elapsed:.2f}s (dispatch {dispatched - begin:.2f}s)"
+        f"  throughput {len(acked) / elapsed:.1f} req/s  status {dict(statuses)}"
+    )
+    print()
+    print(f"{'handler':<40} {'n':>5} {'ack p50':>8} {'ack p99':>8} {'e2e p50':>8} {'e2e p99':>8}")
+    groups = collections.defaultdict(list)
+    for n, kind in kinds.items():
+        groups[kind].append(n)
+    groups["(all)"] = list(acked)
+    for kind, ids in groups.items():
+        acks = [ack_ms[n] for n in ids]
+        e2es = [e2e_ms[n] for n in ids]
+        print(
+            f"{kind:<40} {len(ids):>5} {percentile(acks, 0.5):>8.1f} {percentile(acks, 0.99):>8.1f}"
+            f" {percentile(e2es, 0.5):>8.1f} {percentile(e2es, 0.99):>8.1f}"
+        )
+
+    print()
+    print("slack calls: " + ", ".join(f"{k}={v}" for k, v in sorted(activity.slack_calls.items())))
+    print(
+        "dify calls:  "
+        + ", ".join(f"{k}={v}" for k, v in sorted(activity.dify_calls.items()))
+        + f" (injected errors={activity.dify_errors})"
+    )
+    failed = {kind: lane["failed"] for kind, lane in bot.jobs.stats().items() if lane["failed"]}
+    rejected = {kind: lane["rejected"] for kind, lane in bot.jobs.stats().items() if lane["rejected"]}
+    print(f"jobs failed: {failed or 0}  rejected: {rejected or 0}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# タスクの期限の解釈にかかる時間を、dateparser をそのまま使う場合と app/dates.py で比較します
+# cold: 新しいプロセスで最初の 1 件を解釈するまで（読み込み・言語の判定・正規表現の作成を含む）
+# warm: 準備が済んだ後の 1 件あたり
+# 実行方法: python bench/bench_dates.py
+
+import os
+import subprocess
+import sys
+import timeit
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+TERMS = ["明日", "10月20日", "10/25(金)", "2024/11/01", "3日後", "来週", "未定", "next friday"]
+
+COLD_CASES = {
+    # 従来どおり初回のリクエストで dateparser.parse を呼ぶ場合
+    "dateparser.parse (first request)": (
+        "",
+        "import dateparser; dateparser.parse('明日')",
+    ),
+    # preload しないまま最初のリクエストで解釈する場合
+    "DateNormalizer.parse without preload": (
+        "from dates import DateNormalizer; d = DateNormalizer()",
+        "d.parse('明日')",
+    ),
+    # 起動時に preload() しておく場合（起動時の時間と、その後の最初のリクエスト）
+    "DateNormalizer.preload (startup)": (
+        "from dates import DateNormalizer; d = DateNormalizer()",
+        "d.preload()",
+    ),
+    "DateNormalizer.parse after preload": (
+        "from dates import DateNormalizer; d = DateNormalizer(); d.preload()",
+        "d.parse('明日')",
+    ),
+}
+
+COLD_SCRIPT = """
+import sys, time
+sys.path.insert(0, {app!r})
+{setup}
+start = time.perf_counter()
+{stmt}
+print(time.perf_counter() - start)
+"""
+
+
+def cold(setup: str, stmt: str, repeat: int = 3) -> float:
+    # 毎回新しいプロセスで測り、最小値を返します（ミリ秒）
+    script = COLD_SCRIPT.format(app=APP_DIR, setup=setup, stmt=stmt)
+    results = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        )
+        results.append(float(process.stdout))
+    return min(results) * 1000
+
+
+def warm(fn, number: int = 200) -> float:
+    # 1 件あたりのマイクロ秒
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number / len(TERMS) * 1e6
+
+
+def main():
+    print(f"{'cold':<40} {'ms':>8}")
+    for name, (setup, stmt) in COLD_CASES.items():
+        print(f"{name:<40} {cold(setup, stmt):>8.1f}")
+
+    import dateparser
+    from dateparser.date import DateDataParser
+
+    from dates import DateNormalizer
+
+    parser = DateDataParser(languages=["ja", "en"])
+    normalizer = DateNormalizer()
+    normalizer.preload()
+
+    def uncached():
+        normalizer._cache.clear()
+        for term in TERMS:
+            normalizer.parse(term)
+
+    cases = {
+        "dateparser.parse (language detection)": (
+            lambda: [dateparser.parse(t) for t in TERMS],
+            20,
+        ),
+        "DateDataParser ja/en": (lambda: [parser.get_date_data(t) for t in TERMS], 20),
+        "DateNormalizer (cache miss)": (uncached, 20),
+        "DateNormalizer (cache hit)": (lambda: [normalizer.parse(t) for t in TERMS], 2000),
+    }
+    print()
+    print(f"{'warm (per term)':<40} {'us':>8}")
+    for name, (fn, number) in cases.items():
+        print(f"{name:<40} {warm(fn, number):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
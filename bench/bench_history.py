@@ -0,0 +1,131 @@
+# 大きなチャンネルの履歴の読み込み方を比べます
+# Slack の代わりに、1 回あたり一定時間 + 件数に比例した時間だけ待つ偽のクライアントを使います
+# 実行方法: python bench/bench_history.py [メッセージ数] [スレッドの割合]
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from retrieval import HistoryReader  # noqa: E402
+from serializer import TASKS_HISTORY_BUDGET_CHARS  # noqa: E402
+
+BASE_LATENCY = 0.05  # 1 回の API 呼び出し
+PER_MESSAGE = 0.0002  # 1 件あたり
+REPLIES = 5  # スレッドあたりの返信数
+
+
+def build_channel(count: int, thread_ratio: float) -> tuple:
+    # ts 降順のメッセージと、スレッドの親 ts : 返信
+    messages, replies = [], {}
+    every = int(1 / thread_ratio) if thread_ratio else 0
+    for i in range(count):
+        ts = f"{1700000000 + (count - i) * 60}.000100"
+        message = {"ts": ts, "user": f"U{i % 7:04d}", "text": f"メッセージ {i} " * 3}
+        if every and i % every == 0:
+            message.update(thread_ts=ts, reply_count=REPLIES)
+            replies[ts] = [
+                {
+                    "ts": f"{ts[:-6]}{n + 1:06d}",
+                    "thread_ts": ts,
+                    "user": "U0001",
+                    "text": f"返信 {n}",
+                }
+                for n in range(REPLIES)
+            ]
+        messages.append(message)
+    return messages, replies
+
+
+class FakeClient:
+    def __init__(self, messages: list, replies: dict):
+        self.messages = messages
+        self.replies = replies
+        self.calls = 0
+
+    def _page(self, items: list, limit: int, cursor: str):
+        start = int(cursor or 0)
+        page = items[start : start + limit]
+        self.calls += 1
+        time.sleep(BASE_LATENCY + PER_MESSAGE * len(page))
+        more = start + limit < len(items)
+        return {
+            "messages": page,
+            "has_more": more,
+            "response_metadata": {"next_cursor": str(start + limit) if more else ""},
+        }
+
+    def conversations_history(self, channel, limit, cursor=None, **window):
+        return self._page(self.messages, limit, cursor)
+
+    def conversations_replies(self, channel, ts, limit, cursor=None, **window):
+        return self._page([{"ts": ts}] + self.replies.get(ts, []), limit, cursor)
+
+
+class FakeAsyncClient(FakeClient):
+    async def conversations_history(self, channel, limit, cursor=None, **window):
+        fetch = super().conversations_history
+        return await asyncio.to_thread(fetch, channel, limit, cursor)
+
+    async def conversations_replies(self, channel, ts, limit, cursor=None, **window):
+        fetch = super().conversations_replies
+        return await asyncio.to_thread(fetch, channel, ts, limit, cursor)
+
+
+def run(name: str, fn, client):
+    client.calls = 0
+    start = time.perf_counter()
+    messages = fn(client)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<44} {elapsed * 1000:>8.0f} {client.calls:>6} {len(messages):>8}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    thread_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    messages, replies = build_channel(count, thread_ratio)
+    budget = TASKS_HISTORY_BUDGET_CHARS
+
+    print(f"messages={count} threads={len(replies)} budget={budget} chars")
+    print(f"{'':<44} {'ms':>8} {'calls':>6} {'messages':>8}")
+
+    sequential = HistoryReader(thread_concurrency=1, max_pages=count)
+    parallel = HistoryReader(thread_concurrency=4, max_pages=count)
+
+    # 1 回の conversations_history で全件を取得する場合
+    run(
+        "one-shot (limit=count)",
+        lambda c: c.conversations_history("C", limit=count)["messages"],
+        FakeClient(messages, replies),
+    )
+    run(
+        "paginated, all pages",
+        lambda c: list(parallel.messages(c, "C")),
+        FakeClient(messages, replies),
+    )
+    run(
+        "paginated + budget (early stop)",
+        lambda c: parallel.collect(c, "C", budget),
+        FakeClient(messages, replies),
+    )
+    run(
+        "paginated + budget + threads, concurrency 1",
+        lambda c: sequential.collect(c, "C", budget, threads=True),
+        FakeClient(messages, replies),
+    )
+    run(
+        "paginated + budget + threads, concurrency 4",
+        lambda c: parallel.collect(c, "C", budget, threads=True),
+        FakeClient(messages, replies),
+    )
+    run(
+        "async + budget + threads, concurrency 4",
+        lambda c: asyncio.run(parallel.acollect(c, "C", budget, threads=True)),
+        FakeAsyncClient(messages, replies),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# chat_history のペイロードサイズとシリアライズ時間を比較します
+# 実行方法: python bench/bench_history_serializer.py
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from history import strip_message  # noqa: E402
+from serializer import serialize_history  # noqa: E402
+
+
+def make_message(i: int) -> dict:
+    # conversations.history が返す典型的なメッセージを模したもの
+    ts = f"{1729000000 + i * 60}.{random.randint(0, 999999):06d}"
+    message = {
+        "user": f"U07RNU5{i % 7:04d}",
+        "type": "message",
+        "ts": ts,
+        "client_msg_id": "3f1c2a8e-8c7b-4f7e-9f5a-2d1e0b9c7a6f",
+        "text": "明日の定例までに議事録の修正をお願いします。資料は共有フォルダにあります。" * (1 + i % 3),
+        "team": "T07RNU4ABCD",
+        "blocks": [
+            {
+                "type": "rich_text",
+                "block_id": "abc12",
+                "elements": [
+                    {
+                        "type": "rich_text_section",
+                        "elements": [{"type": "text", "text": "明日の定例までに…"}],
+                    }
+                ],
+            }
+        ],
+        "reactions": [{"name": "eyes", "users": ["U07RNU50QKW"], "count": 1}],
+    }
+    if i % 5 == 0:
+        message["edited"] = {"user": message["user"], "ts": ts}
+    if i % 4 == 0:
+        message["thread_ts"] = ts
+        message["reply_count"] = 2
+        message["reply_users"] = ["U07RNU50QKW", "U07RNU5ZZZZ"]
+        message["latest_reply"] = ts
+    if i % 6 == 0:
+        message["attachments"] = [
+            {"fallback": "https://example.com", "title": "資料", "title_link": "https://example.com"}
+        ]
+    return message
+
+
+def legacy(messages: list) -> str:
+    return json.dumps([strip_message(m) for m in messages], ensure_ascii=False)
+
+
+def main():
+    random.seed(0)
+    names = {f"U07RNU5{i:04d}": f"user{i}" for i in range(7)}
+
+    print(f"{'messages':>8} {'before(B)':>10} {'after(B)':>10} {'ratio':>6} {'before(us)':>11} {'after(us)':>10}")
+    for count in (10, 20, 100):
+        messages = sorted((make_message(i) for i in range(count)), key=lambda m: m["ts"])
+        before = legacy(messages).encode()
+        after = serialize_history(messages, names=names, budget_chars=10**9).encode()
+
+        number = 200
+        t_before = timeit.timeit(lambda: legacy(messages), number=number) / number
+        t_after = timeit.timeit(
+            lambda: serialize_history(messages, names=names, budget_chars=10**9),
+            number=number,
+        ) / number
+
+        print(
+            f"{count:>8} {len(before):>10} {len(after):>10} {len(after) / len(before):>6.2f}"
+            f" {t_before * 1e6:>11.1f} {t_after * 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
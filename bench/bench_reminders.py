@@ -0,0 +1,75 @@
+# リマインダーの一括登録と送信のスループットを測ります
+# Slack の代わりに、一定時間待つだけの送信関数を使います
+# 実行方法: python bench/bench_reminders.py [件数] [送信 1 件の時間（秒）]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from reminders import ReminderScheduler, ReminderStore, build_reminders  # noqa: E402
+
+SETTINGS = ((50, 1), (50, 4), (50, 8))  # (batch_size, concurrency)
+
+
+def run(count: int, latency: float, batch_size: int, concurrency: int) -> dict:
+    done = threading.Event()
+    sent = []
+
+    def send(reminder):
+        time.sleep(latency)
+        sent.append(reminder.id)
+        if len(sent) == count:
+            done.set()
+
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = ReminderScheduler(
+            ReminderStore(os.path.join(directory, "reminders.sqlite3")),
+            send,
+            batch_size=batch_size,
+            concurrency=concurrency,
+        )
+        users = [f"U{i:06d}" for i in range(count)]
+
+        start = time.perf_counter()
+        scheduler.schedule(build_reminders(users, "締め切りです", 0.0, None, "UBENCH"))
+        scheduled = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scheduler.start()
+        done.wait()
+        elapsed = time.perf_counter() - start
+        scheduler.stop()
+        stats = scheduler.stats()
+
+    return {
+        "schedule_ms": scheduled * 1000,
+        "sent_per_second": count / elapsed,
+        "lag_max": stats["lag_seconds_max"],
+        "batches": stats["batches"],
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    print(f"reminders={count} send latency={latency}s")
+    print(
+        f"{'batch':>5} {'conc':>4} {'schedule ms':>11} {'sent/s':>8}"
+        f" {'lag max s':>9} {'batches':>7}"
+    )
+    for batch_size, concurrency in SETTINGS:
+        result = run(count, latency, batch_size, concurrency)
+        print(
+            f"{batch_size:>5} {concurrency:>4} {result['schedule_ms']:>11.1f}"
+            f" {result['sent_per_second']:>8.1f} {result['lag_max']:>9.2f}"
+            f" {result['batches']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
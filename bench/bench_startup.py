@@ -0,0 +1,131 @@
+# 起動時間（import と各部品の初期化）を python -X importtime で測り、予算を超えたら失敗します
+# Slack の auth.test はローカルの偽サーバーが返すので、ネットワークの時間は含みません
+# 実行方法: python bench/bench_startup.py [--repeat 5] [--app-dir app]
+# CI などで回帰を検出するときは終了コードを見てください（予算超過か、重いモジュールの読み込みで 1）
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+
+# エントリーポイントごとの予算（import から各部品の初期化まで、ミリ秒）
+BUDGETS_MS = {"main": 400, "async_main": 800}
+
+# 起動時には読み込まない（使うときか、接続後に読み込む）モジュール
+DEFERRED = {
+    "main": ("dateparser", "requests", "aiohttp"),
+    "async_main": ("dateparser", "requests"),
+}
+
+
+class FakeSlack(BaseHTTPRequestHandler):
+    # App の初期化で呼ばれる auth.test だけに答えます
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(
+            {"ok": True, "user_id": "UBOT", "bot_id": "BBOT", "team_id": "TBENCH"}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def parse_importtime(stderr: str, entry: str) -> dict:
+    # entry から読み込まれたモジュール名 : 累積時間（マイクロ秒）
+    # importtime は読み込みが終わった順に出力するので、entry の行より前で直前の最上位の行より後が対象です
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if name == entry:
+            modules[entry] = int(cumulative)
+            break
+        if depth == 0:
+            modules = {}
+            continue
+        modules.setdefault(name, int(cumulative))
+    return modules
+
+
+def measure(entry: str, app_dir: str, env: dict) -> dict:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry}"],
+        cwd=app_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        sys.exit(f"failed to import {entry}:\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr, entry)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--app-dir", default=APP_DIR, help="比較用に別のチェックアウトを指定できます")
+    parser.add_argument("--top", type=int, default=8, help="表示する重いパッケージの数")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSlack)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    state_dir = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_APP_TOKEN": "xapp-bench",
+        "SLACK_API_URL": f"http://127.0.0.1:{server.server_port}/api/",
+        "DIFY_API_APP_URL": "http://127.0.0.1:9/v1/workflows/run",
+        "DIFY_API_TOKEN_USER": "bench",
+        "LOG_LEVEL": "WARNING",
+        "STATE_DIR": state_dir,
+        "REMINDERS_PATH": os.path.join(state_dir, "reminders.sqlite3"),
+        **{f"DIFY_API_APP{n}_TOKEN": f"app-bench-{n}" for n in range(1, 5)},
+    }
+
+    failed = False
+    for entry, budget in BUDGETS_MS.items():
+        runs = [measure(entry, args.app_dir, env) for _ in range(args.repeat)]
+        total = statistics.median(run[entry] for run in runs) / 1000
+        status = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{entry}: {total:.0f} ms (budget {budget} ms) {status}")
+        failed |= total > budget
+
+        # 最上位のパッケージごとの累積時間（entry 自身は除きます）
+        packages = {}
+        for name, cumulative in runs[-1].items():
+            if "." not in name and name != entry:
+                packages[name] = max(packages.get(name, 0), cumulative)
+        slowest = sorted(packages.items(), key=lambda kv: -kv[1])[: args.top]
+        for name, cumulative in slowest:
+            print(f"  {name:<24} {cumulative / 1000:>7.1f} ms")
+
+        loaded = [name for name in DEFERRED[entry] if name in runs[-1]]
+        if loaded:
+            print(f"  loaded at startup (should be deferred): {', '.join(loaded)}")
+            failed = True
+        print()
+
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# Block Kit の組み立て時間を、app/views.py と従来の実装で比較します
+# app/views.py は空のモーダルを使い回し、値の入ったモーダルは毎回そのまま組み立てます（切り詰めの確認の分だけ従来より仕事が多いです）
+# 実行方法: python bench/bench_views.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import views  # noqa: E402
+from views import *  # noqa: E402,F401,F403
+
+# ---- 従来の実装（比較用にそのまま残しています） ----
+
+def legacy_app1_create_view(
+    callback_id: str,
+    message: str = None,
+    created_message: str = None,
+    references: dict = None,
+    initial_user: str = None,
+):
+
+    block_1 = {
+        "type": "input",
+        "block_id": APP1_MODAL1_BLOCK1_ID,
+        "element": {
+            "type": "plain_text_input",
+            "action_id": APP1_MODAL1_BLOCK1_ACTIONID,
+            "multiline": True,
+        },
+        "label": {"type": "plain_text", "text": "送りたい内容"},
+    }
+    if message:
+        block_1["element"]["initial_value"] = message
+
+    block_2 = {
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"やわらかくする",
+                },
+                "value": "click_me_123",
+                "action_id": APP1_MODAL1_BLOCK2_ACTIONID,
+            }
+        ],
+    }
+
+    blocks = [block_1, block_2]
+
+    if created_message:
+        block_3 = {
+            "type": "input",
+            "block_id": APP1_MODAL1_BLOCK3_ID,
+            "element": {
+                "type": "plain_text_input",
+                "action_id": APP1_MODAL1_BLOCK3_ACTIONID,
+                "multiline": True,
+                "initial_value": created_message,
+            },
+            "label": {"type": "plain_text", "text": "やわらか"},
+        }
+
+        blocks.append(block_3)
+
+        block_4 = {
+            "type": "section",
+            "block_id": APP1_MODAL1_BLOCK4_ID,
+            "text": {"type": "mrkdwn", "text": "送信先を選択"},
+            "accessory": {
+                "type": "users_select",
+                "action_id": APP1_MODAL1_BLOCK4_ACTIONID,
+                "placeholder": {
+                    "type": "plain_text",
+                    "text": "Select a user",
+                    "emoji": True,
+                },
+            },
+        }
+        if initial_user:
+            block_4["accessory"]["initial_user"] = initial_user
+
+        blocks.append(block_4)
+
+        if references:
+            block_5 = {
+                "type": "section",
+                "block_id": APP1_MODAL1_BLOCK5_ID,
+                "text": {"type": "mrkdwn", "text": "関連ドキュメントを選択（任意）"},
+                "accessory": {
+                    "type": "checkboxes",
+                    "action_id": APP1_MODAL1_BLOCK5_ACTIONID,
+                    "options": [
+                        {
+                            "text": {
+                                "type": "mrkdwn",
+                                "text": f"{ref['document_name']}",
+                            },
+                            "description": {
+                                "type": "mrkdwn",
+                                "text": f"{ref['content']}",
+                            },
+                            "value": f"{ref['segment_id']}",
+                        }
+                        for ref in references
+                    ],
+                },
+            }
+            blocks.append(block_5)
+
+    return {
+        "type": "modal",
+        "callback_id": callback_id,
+        "title": {"type": "plain_text", "text": "やわらかコミュニケーター"},
+        "submit": {"type": "plain_text", "text": "送信"},
+        "close": {"type": "plain_text", "text": "閉じる"},
+        "blocks": blocks,
+    }
+
+
+def legacy_app2_create_view(callback_id: str, task_list: list = None):
+
+    blocks = []
+
+    block_1 = {
+        "type": "actions",
+        "block_id": APP2_MODAL1_BLOCK1_ID,
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"タスク取得",
+                },
+                "value": "click_me_123",
+                "action_id": APP2_MODAL1_BLOCK1_ACTIONID,
+            }
+        ],
+    }
+
+    blocks.append(block_1)
+
+    if task_list:
+
+        task_str = [
+            f"{task['term']} {task['description']} {task['status']}"
+            for task in task_list
+        ]
+        task_str = "\n".join(task_str)
+
+        block_2 = {
+            "type": "input",
+            "block_id": APP2_MODAL1_BLOCK2_ID,
+            "element": {
+                "type": "plain_text_input",
+                "action_id": APP2_MODAL1_BLOCK2_ACTIONID,
+                "multiline": True,
+                "initial_value": task_str,
+            },
+            "label": {"type": "plain_text", "text": "タスク"},
+        }
+
+        blocks.append(block_2)
+
+        block_3 = {
+            "type": "input",
+            "block_id": APP2_MODAL1_BLOCK3_ID,
+            "element": {
+                "type": "plain_text_input",
+                "action_id": APP2_MODAL1_BLOCK3_ACTIONID,
+                "multiline": True,
+            },
+            "label": {"type": "plain_text", "text": "変更ある？？"},
+        }
+
+        blocks.append(block_3)
+
+        block_4 = {
+            "type": "actions",
+            "block_id": APP2_MODAL1_BLOCK4_ID,
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": f"お願い！",
+                    },
+                    "value": "click_me_123",
+                    "action_id": APP2_MODAL1_BLOCK4_ACTIONID,
+                }
+            ],
+        }
+
+        blocks.append(block_4)
+
+    return {
+        "type": "modal",
+        "callback_id": callback_id,
+        "title": {"type": "plain_text", "text": "モーダル"},
+        "submit": {"type": "plain_text", "text": "送信"},
+        "close": {"type": "plain_text", "text": "閉じる"},
+        # 先読みを破棄するため、閉じたときに view_closed を受け取ります
+        "notify_on_close": True,
+        "blocks": blocks,
+    }
+
+
+def legacy_app1_message_blocks(
+    selected_user: str,
+    sender_id: str,
+    created_message: str,
+    image_url: str = None,
+    prompt: str = None,
+    selected_references_options: list = None,
+):
+
+    message_block = {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"{created_message}",
+        },
+    }
+    # 画像は後から chat.update で追加されることがあります
+    if image_url:
+        message_block["accessory"] = {
+            "type": "image",
+            "image_url": f"{image_url}",
+            "alt_text": f"{prompt}",
+        }
+
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"<@{selected_user}> さんへ <@{sender_id}> さんからメッセージが届いています。",
+            },
+        },
+        {"type": "divider"},
+        message_block,
+        {"type": "divider"},
+        {"type": "section", "text": {"type": "mrkdwn", "text": "関連ドキュメント"}},
+        {
+            "type": "rich_text",
+            "elements": [
+                {
+                    "type": "rich_text_list",
+                    "style": "bullet",
+                    "elements": [
+                        {
+                            "type": "rich_text_section",
+                            "elements": [
+                                {
+                                    "type": "text",
+                                    "text": f"{ref['text']['text']}:\n",
+                                },
+                                {
+                                    "type": "text",
+                                    "text": f"{ref['description']['text']}:\n",
+                                },
+                            ],
+                        }
+                        for ref in selected_references_options or []
+                    ],
+                }
+            ],
+        },
+    ]
+
+
+# ---- ベンチマーク ----
+
+REFERENCES = [
+    {
+        "document_name": f"社内規程 第{i}章",
+        "content": "会議の議事録は翌営業日までに共有フォルダへ保存すること。" * 2,
+        "segment_id": f"seg-{i:04d}",
+    }
+    for i in range(8)
+]
+TASKS = [
+    {"term": f"10/{i + 1}", "description": f"資料 {i} の修正", "status": "未着手"}
+    for i in range(20)
+]
+MESSAGE = "明日の定例までに議事録の修正をお願いします。" * 5
+SELECTED = [
+    {"text": {"text": ref["document_name"]}, "description": {"text": ref["content"]}}
+    for ref in REFERENCES[:3]
+]
+
+CASES = {
+    "app1 empty": (
+        lambda: legacy_app1_create_view(APP1_CALLBACK_ID),
+        lambda: views.app1_create_view(APP1_CALLBACK_ID),
+    ),
+    "app1 full": (
+        lambda: legacy_app1_create_view(
+            APP1_CALLBACK_ID, MESSAGE, MESSAGE, REFERENCES, "U07RNU50QKW"
+        ),
+        lambda: views.app1_create_view(
+            APP1_CALLBACK_ID, MESSAGE, MESSAGE, REFERENCES, "U07RNU50QKW"
+        ),
+    ),
+    "app2 empty": (
+        lambda: legacy_app2_create_view(APP2_CALLBACK_ID),
+        lambda: views.app2_create_view(APP2_CALLBACK_ID),
+    ),
+    "app2 tasks": (
+        lambda: legacy_app2_create_view(APP2_CALLBACK_ID, TASKS),
+        lambda: views.app2_create_view(APP2_CALLBACK_ID, TASKS),
+    ),
+    "app1 message": (
+        lambda: legacy_app1_message_blocks(
+            "U1", "U2", MESSAGE, "https://example.com/a.png", "cat", SELECTED
+        ),
+        lambda: views.app1_message_blocks(
+            "U1", "U2", MESSAGE, "https://example.com/a.png", "cat", SELECTED
+        ),
+    ),
+}
+
+
+def bench(fn, number: int = 20000) -> float:
+    # 1 回あたりのマイクロ秒
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'case':<14} {'legacy us':>10} {'views us':>12} {'speedup':>8}")
+    for name, (legacy, current) in CASES.items():
+        before = bench(legacy)
+        after = bench(current)
+        print(f"{name:<14} {before:>10.2f} {after:>12.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
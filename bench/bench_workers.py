@@ -0,0 +1,265 @@
+# ワーカー数（Socket Mode の接続数）に応じてスループットが伸びるかを確かめる負荷試験です
+# app/main.py を SOCKET_MODE_WORKERS=N で実際に起動し、bench_app.py の偽の Slack / Dify サーバーに向けます
+# Slack の代わりに偽の Socket Mode サーバー（apps.connections.open が返す WebSocket）が
+# メッセージイベントを接続ごとに順番に振り分け、各イベントは 1 回ずつ別の接続にも再送します
+# 比較のため、同じ合計の JOB_CONCURRENCY を 1 プロセスに与えた場合も測ります
+#
+# 実行方法: python bench/bench_workers.py [--events 200] [--workers 2,4] [--chat 8] [--dify-latency 0.2]
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import WSMsgType, web
+
+import bench_app
+from bench_app import DIFY_OUTPUTS, FakeDify, FakeSlack, history_messages, percentile, serve
+
+MAIN_PATH = os.path.join(os.path.dirname(__file__), "..", "app", "main.py")
+
+
+class SocketModeServer:
+    # Socket Mode の WebSocket の代わり（接続ごとにエンベロープを送り、ack を記録します）
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.sockets = []
+        self.acked = {}  # envelope_id : ack の時刻
+        self.connected = threading.Event()
+        self.expected = 1
+        self.port = None
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready: threading.Event):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get("/link", self._handle)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = runner.addresses[0][1]
+        ready.set()
+        self.loop.run_forever()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/link"
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse(autoping=True)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"type": "hello", "num_connections": len(self.sockets) + 1}))
+        self.sockets.append(ws)
+        if len(self.sockets) >= self.expected:
+            self.connected.set()
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.TEXT:
+                    envelope_id = json.loads(message.data).get("envelope_id")
+                    if envelope_id:
+                        self.acked[envelope_id] = time.perf_counter()
+        finally:
+            self.sockets.remove(ws)
+        return ws
+
+    def reset(self, expected: int):
+        self.expected = expected
+        self.acked = {}
+        self.connected.clear()
+
+    def send(self, index: int, envelope: dict):
+        # Slack と同じく、接続を順番に使って配ります
+        async def send():
+            ws = self.sockets[index % len(self.sockets)]
+            await ws.send_str(json.dumps(envelope, ensure_ascii=False))
+
+        asyncio.run_coroutine_threadsafe(send(), self.loop).result()
+
+
+socket_mode = None
+
+
+class FakeSlackWithSocketMode(FakeSlack):
+    # apps.connections.open で偽の Socket Mode サーバーを返し、返信と「混雑中」の通知を記録します
+    replied = {}  # 通し番号 : 最初の返信の時刻
+    busy = set()  # 混雑中で断られた通し番号
+
+    def respond(self, method: str, params: dict, owner) -> dict:
+        if method == "apps.connections.open":
+            return {"ok": True, "url": socket_mode.url}
+        if method in ("chat.postMessage", "chat.update") and owner is not None:
+            self.replied.setdefault(owner, time.perf_counter())
+        if method == "chat.postEphemeral" and owner is not None:
+            self.busy.add(owner)
+        return super().respond(method, params, owner)
+
+
+def envelope(n: int, channels: int, retry: int = 0) -> dict:
+    ts = f"1700000000.{n:06d}"
+    return {
+        "envelope_id": f"env-{n:06d}-{retry}",
+        "type": "events_api",
+        "accepts_response_payload": False,
+        "retry_attempt": retry,
+        "retry_reason": "timeout" if retry else "",
+        "payload": {
+            "token": "xoxb-bench",
+            "team_id": "T0BENCH",
+            "api_app_id": "ABENCH",
+            "type": "event_callback",
+            "event_id": f"EvBENCH{n:06d}",
+            "event_time": 1700000000,
+            "event": {
+                "type": "message",
+                "user": f"UBENCH{n:06d}",
+                "channel": f"CBENCHCH{n % channels:04d}",
+                "channel_type": "channel",
+                "text": "明日の定例の議題を整理してもらえますか？",
+                "ts": ts,
+                "thread_ts": f"1690000000.{n:06d}",
+                "event_ts": ts,
+            },
+        },
+    }
+
+
+def start_bot(workers: int, concurrency: str, slack_url: str, dify_url: str, state_dir: str):
+    env = {
+        **os.environ,
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_APP_TOKEN": "xapp-bench",
+        "SLACK_API_URL": f"{slack_url}/api/",
+        "DIFY_API_APP_URL": dify_url,
+        "DIFY_API_TOKEN_USER": "bench",
+        "TASKS_CHANNEL": "CBENCHTASKS",
+        "LOG_LEVEL": "ERROR",
+        "STATE_DIR": state_dir,
+        "REMINDERS_PATH": os.path.join(state_dir, "reminders.sqlite3"),
+        "TASKS_PATH": os.path.join(state_dir, "tasks.sqlite3"),
+        "SOCKET_MODE_WORKERS": str(workers),
+        "JOB_CONCURRENCY": concurrency,
+        "PYTHONWARNINGS": "ignore::UserWarning",
+        **{f"DIFY_API_{app}_TOKEN": f"app-bench-{app}" for app in DIFY_OUTPUTS},
+    }
+    # ワーカーの子プロセスもまとめて止められるよう、新しいプロセスグループで起動します
+    return subprocess.Popen([sys.executable, MAIN_PATH], env=env, start_new_session=True)
+
+
+def stop_bot(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run(workers: int, chat: int, args, slack_url: str, dify_url: str) -> dict:
+    bench_app.activity = bench_app.Activity()
+    FakeSlackWithSocketMode.replied = {}
+    FakeSlackWithSocketMode.busy = set()
+    socket_mode.reset(workers)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        process = start_bot(workers, f"chat={chat}", slack_url, dify_url, state_dir)
+        try:
+            if not socket_mode.connected.wait(args.timeout):
+                raise RuntimeError(f"only {len(socket_mode.sockets)} of {workers} workers connected")
+
+            for n in range(args.events):
+                event = envelope(n, args.channels)["payload"]["event"]
+                for key in ("ts", "thread_ts"):
+                    bench_app.activity.ts_owners[event[key]] = n
+
+            sent = {}
+            begin = time.perf_counter()
+            for n in range(args.events):
+                sent[n] = time.perf_counter()
+                socket_mode.send(n, envelope(n, args.channels))
+                # 再送されたイベントは別の接続（別のワーカー）に届きます
+                socket_mode.send(n + 1, envelope(n, args.channels, retry=1))
+
+            deadline = begin + args.timeout
+            replied = FakeSlackWithSocketMode.replied
+            busy = FakeSlackWithSocketMode.busy
+            while len(replied) + len(busy) < args.events and time.perf_counter() < deadline:
+                time.sleep(0.05)
+            elapsed = max(replied.values(), default=begin) - begin
+        finally:
+            stop_bot(process)
+
+    acked = socket_mode.acked
+    ack_ms = [(acked[f"env-{n:06d}-0"] - sent[n]) * 1000 for n in sent if f"env-{n:06d}-0" in acked]
+    e2e_ms = [(replied[n] - sent[n]) * 1000 for n in replied]
+    return {
+        "replied": len(replied),
+        "busy": len(busy),
+        "dify": bench_app.activity.dify_calls["APP4"],
+        "calls": dict(bench_app.activity.slack_calls),
+        "elapsed": elapsed,
+        "throughput": len(replied) / elapsed if elapsed else 0.0,
+        "ack_p50": percentile(ack_ms, 0.5),
+        "e2e_p50": percentile(e2e_ms, 0.5),
+        "e2e_p99": percentile(e2e_ms, 0.99),
+    }
+
+
+def main():
+    global socket_mode
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--workers", default="2,4", help="比較するワーカー数（カンマ区切り）")
+    parser.add_argument("--chat", type=int, default=8, help="ワーカー 1 つあたりの chat レーンの並列数")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--dify-latency", type=float, default=0.2)
+    parser.add_argument("--slack-latency", type=float, default=0.01)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    FakeDify.latency = args.dify_latency
+    FakeSlack.latency = args.slack_latency
+    FakeSlack.history = history_messages(args.history)
+    socket_mode = SocketModeServer()
+    slack_server = serve(FakeSlackWithSocketMode)
+    dify_server = serve(FakeDify)
+    slack_url = f"http://127.0.0.1:{slack_server.server_port}"
+    dify_url = f"http://127.0.0.1:{dify_server.server_port}/v1/workflows/run"
+
+    # N ワーカー（各 chat=C）と、合計が同じ 1 プロセス（chat=N*C）を並べて比べます
+    configs = [(1, args.chat)]
+    for workers in (int(value) for value in args.workers.split(",")):
+        configs += [(workers, args.chat), (1, workers * args.chat)]
+
+    print(
+        f"events={args.events} (each delivered twice) channels={args.channels}"
+        f" dify_latency={args.dify_latency}s slack_latency={args.slack_latency}s"
+    )
+    print(
+        f"{'workers':>7} {'chat':>5} {'total':>5} {'replied':>7} {'busy':>5} {'dify':>5} {'seconds':>8}"
+        f" {'events/s':>9} {'ack p50':>8} {'e2e p50':>8} {'e2e p99':>8}"
+    )
+    for workers, chat in configs:
+        result = run(workers, chat, args, slack_url, dify_url)
+        print(
+            f"{workers:>7} {chat:>5} {workers * chat:>5} {result['replied']:>7}"
+            f" {result['busy']:>5} {result['dify']:>5}"
+            f" {result['elapsed']:>8.2f} {result['throughput']:>9.1f} {result['ack_p50']:>8.1f}"
+            f" {result['e2e_p50']:>8.1f} {result['e2e_p99']:>8.1f}"
+        )
+        calls = ", ".join(f"{k}={v}" for k, v in sorted(result["calls"].items()))
+        print(f"        slack calls: {calls}")
+
+
+if __name__ == "__main__":
+    main()